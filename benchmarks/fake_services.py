@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Fake eBay and Telegram Services
+Local stand-ins for the Browse API, OAuth and Bot API used by the benchmarks
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+SEARCH_PATH = "/buy/browse/v1/item_summary/search"
+ITEMS_PATH = "/buy/browse/v1/item/"
+TOKEN_PATH = "/identity/v1/oauth2/token"
+ITEM_LINK = re.compile(r"/itm/(\d+)")
+
+
+def iso_time(timestamp):
+    """Format a timestamp the way the Browse API does"""
+    dt = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.") + f"{dt.microsecond // 1000:03d}Z"
+
+
+def parse_filters(value):
+    """Split a Browse API filter= value into {name: value}, keeping commas inside [] and {}"""
+    filters = {}
+    for match in re.finditer(r"(\w+):(\[[^\]]*\]|\{[^}]*\}|[^,]*)", value or ""):
+        filters[match.group(1)] = match.group(2)
+    return filters
+
+
+def matches_filters(item, filters):
+    """Apply the price, buyingOptions and seller filters the monitor pushes down"""
+    if "price" in filters:
+        low, high = filters["price"].strip("[]").split("..")
+        price = float(item["price"]["value"])
+        if (low and price < float(low)) or (high and price > float(high)):
+            return False
+    if "buyingOptions" in filters:
+        if not set(filters["buyingOptions"].strip("{}").split("|")) & set(item["buyingOptions"]):
+            return False
+    seller = item["seller"]["username"].lower()
+    if "excludeSellers" in filters and seller in filters["excludeSellers"].strip("{}").split("|"):
+        return False
+    if "sellers" in filters and seller not in filters["sellers"].strip("{}").split("|"):
+        return False
+    return True
+
+
+class FakeMarket:
+    """Synthetic listings appearing over time for a set of keywords"""
+
+    def __init__(self, keywords, listings_per_minute=6.0, seed=1):
+        self.keywords = list(keywords)
+        self.listings_per_minute = listings_per_minute
+        self.random = random.Random(seed)
+        self.listings = {}  # normalized keyword -> newest-first list of items
+        self.created_at = {}  # legacy item ID -> wall clock time it was listed
+        self.by_id = {}  # itemId -> item
+        self._next_id = 100000000000
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(keywords):
+        return " ".join(keywords.lower().split())
+
+    def _new_listing(self, keyword, now):
+        self._next_id += 1
+        legacy_id = str(self._next_id)
+        price = f"{self.random.uniform(50, 1500):.2f}"
+        options = self.random.choice([["FIXED_PRICE"], ["AUCTION"], ["FIXED_PRICE", "BEST_OFFER"]])
+        self.created_at[legacy_id] = now
+        item = self.by_id[f"v1|{legacy_id}|0"] = {
+            "itemId": f"v1|{legacy_id}|0",
+            "title": f"{keyword.title()} listing {legacy_id}",
+            "price": {"value": price, "currency": "GBP"},
+            "buyingOptions": options,
+            "seller": {"username": f"seller{self.random.randint(1, 500)}"},
+            "listingDate": iso_time(now),
+            "itemWebUrl": f"https://www.ebay.co.uk/itm/{legacy_id}",
+        }
+        return item
+
+    def seed(self, per_keyword=50):
+        """Give every keyword a backlog of older listings"""
+        now = time.time()
+        with self._lock:
+            for keyword in self.keywords:
+                items = [self._new_listing(keyword, now - 3600 + i) for i in range(per_keyword)]
+                self.listings[self._normalize(keyword)] = list(reversed(items))
+
+    def tick(self, seconds):
+        """List new items as if the given number of seconds had passed"""
+        now = time.time()
+        expected = self.listings_per_minute * seconds / 60.0
+        created = 0
+        with self._lock:
+            for keyword in self.keywords:
+                count = int(expected) + (1 if self.random.random() < expected % 1 else 0)
+                items = self.listings.setdefault(self._normalize(keyword), [])
+                for _ in range(count):
+                    items.insert(0, self._new_listing(keyword, now))
+                    created += 1
+        return created
+
+    def details(self, item_ids):
+        """getItems entries for the listings that exist, with shipping, location and bids added"""
+        entries = []
+        with self._lock:
+            for item_id in item_ids:
+                item = self.by_id.get(item_id)
+                if item is None:
+                    continue
+                legacy_id = int(item_id.split("|")[1])
+                entry = dict(item)
+                entry["shippingOptions"] = [{
+                    "shippingCostType": "FIXED",
+                    "shippingCost": {"value": "0.00" if legacy_id % 3 == 0 else "4.99", "currency": "GBP"},
+                }]
+                entry["itemLocation"] = {"city": "London", "country": "GB"}
+                if "AUCTION" in item["buyingOptions"]:
+                    entry["currentBidPrice"] = item["price"]
+                entries.append(entry)
+        return entries
+
+    def search(self, q, offset, limit, start_date=None, filters=None):
+        with self._lock:
+            items = self.listings.get(self._normalize(q), [])
+            if start_date:
+                items = [item for item in items if item["listingDate"] >= start_date]
+            if filters:
+                items = [item for item in items if matches_filters(item, filters)]
+            return items[offset:offset + limit], len(items)
+
+
+class FakeServices:
+    """One local HTTP server answering eBay OAuth/search and Telegram sendMessage
+
+    latency is added to every response; error_rate and rate_429 make that
+    fraction of requests fail with a 500 or a 429 (with retry_after).
+    """
+
+    def __init__(self, market, latency=0.0, error_rate=0.0, rate_429=0.0, retry_after=1):
+        self.market = market
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.calls = {}
+        self.bytes_sent = 0
+        self.alerts = []  # (legacy item ID, chat ID, received at)
+        self._lock = threading.Lock()
+        self._random = random.Random(2)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls = {}
+            self.bytes_sent = 0
+            self.alerts = []
+
+    def _count(self, endpoint, size):
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            self.bytes_sent += size
+
+    def _fault(self):
+        """Pick an injected failure for this request, if any"""
+        roll = self._random.random()
+        if roll < self.rate_429:
+            return 429
+        if roll < self.rate_429 + self.error_rate:
+            return 500
+        return None
+
+    def _handler_class(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, endpoint, status, body, headers=None):
+                payload = json.dumps(body).encode()
+                services._count(endpoint, len(payload))
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _read_body(self):
+                length = int(self.headers.get("Content-Length", 0))
+                return self.rfile.read(length).decode() if length else ""
+
+            def do_GET(self):
+                if services.latency:
+                    time.sleep(services.latency)
+                parsed = urlparse(self.path)
+                if parsed.path == ITEMS_PATH:
+                    item_ids = parse_qs(parsed.query).get("item_ids", [""])[0].split(",")
+                    items = services.market.details(item_ids)
+                    if not items:
+                        return self._reply("get_items", 404, {"errors": [{"errorId": 11001}]})
+                    return self._reply("get_items", 200, {"items": items})
+                if parsed.path != SEARCH_PATH:
+                    return self._reply("unknown", 404, {"errors": [{"message": "not found"}]})
+
+                fault = services._fault()
+                if fault == 429:
+                    return self._reply("search", 429, {"errors": [{"errorId": 2001}]},
+                                       {"Retry-After": str(services.retry_after)})
+                if fault == 500:
+                    return self._reply("search", 500, {"errors": [{"errorId": 10001}]})
+
+                params = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+                filters = parse_filters(params.get("filter"))
+                start_date = filters.pop("itemStartDate", "").strip("[]").split("..")[0] or None
+                items, total = services.market.search(
+                    params.get("q", ""), int(params.get("offset", 0)), int(params.get("limit", 50)),
+                    start_date, filters
+                )
+                body = {"total": total, "itemSummaries": items} if items else {"total": total}
+                self._reply("search", 200, body)
+
+            def do_POST(self):
+                if services.latency:
+                    time.sleep(services.latency)
+                parsed = urlparse(self.path)
+                body = self._read_body()
+
+                if parsed.path == TOKEN_PATH:
+                    return self._reply("token", 200, {"access_token": "fake-token", "expires_in": 7200})
+
+                if parsed.path.endswith("/sendMessage"):
+                    fault = services._fault()
+                    if fault == 429:
+                        return self._reply("telegram", 429, {
+                            "ok": False, "error_code": 429,
+                            "parameters": {"retry_after": services.retry_after}
+                        })
+                    if fault == 500:
+                        return self._reply("telegram", 500, {"ok": False, "error_code": 500})
+
+                    form = {key: values[0] for key, values in parse_qs(body).items()}
+                    # A digest message carries several listings
+                    now = time.time()
+                    with services._lock:
+                        for match in ITEM_LINK.finditer(form.get("text", "")):
+                            services.alerts.append((match.group(1), form.get("chat_id"), now))
+                    return self._reply("telegram", 200, {"ok": True, "result": {"message_id": 1}})
+
+                return self._reply("unknown", 404, {"ok": False})
+
+        return Handler
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Offline Benchmarks
+Measures the search and alert loop against local fake eBay and Telegram services
+
+Usage:
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --keywords 1,10,40 --latency-ms 80 --error-rate 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import runpy
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_services import FakeMarket, FakeServices
+
+
+def install_config(overrides):
+    """Load config.sample.py as the config module, so real credentials are never used"""
+    values = runpy.run_path(os.path.join(ROOT, "config.sample.py"))
+    module = types.ModuleType("config")
+    for name, value in values.items():
+        if name.isupper():
+            setattr(module, name, value)
+    for name, value in overrides.items():
+        setattr(module, name, value)
+    sys.modules["config"] = module
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile, None for no values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def fmt_ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.1f}ms"
+
+
+def run_cycles(services, keyword_count, mode, cycles, tick_seconds, max_price=None, price_history=False,
+               enrich=False):
+    """Poll keyword_count keywords for a number of cycles and measure the pipeline"""
+    from ebay_api import EbayAPI, AsyncEbayAPI
+    from filters import FilterRule
+    from item_details import ItemEnricher
+    from message_handler import MessageHandler
+    from price_history import PriceHistory
+    from query_planner import QueryPlanner, Subscription
+    from watermarks import WatermarkStore
+    import monitor
+
+    keywords = [f"bike model {i}" for i in range(keyword_count)]
+    services.market.keywords = keywords
+    services.market.seed()
+
+    history = PriceHistory(f"prices-{mode}-{keyword_count}.db") if price_history else None
+    ebay_api = EbayAPI(watermarks=WatermarkStore(), history=history)
+    message_handler = MessageHandler()
+    message_handler.start_notifier()
+    enricher = ItemEnricher(ebay_api) if enrich else None
+    filters = FilterRule(max_price=max_price) if max_price is not None else None
+    queries = QueryPlanner().plan([Subscription(keyword, "177831", filters) for keyword in keywords])
+
+    async_api = None
+    loop = None
+    if mode == "async":
+        async_api = AsyncEbayAPI(ebay_api)
+        loop = asyncio.new_event_loop()
+
+    def poll():
+        if async_api:
+            return loop.run_until_complete(
+                monitor.run_async_polls(async_api, queries, message_handler, enricher=enricher)
+            )
+        return monitor.run_polls(ebay_api, queries, message_handler, enricher=enricher)
+
+    try:
+        # The first poll of each query only sets its watermark
+        poll()
+        message_handler.notifier.wait_idle(60)
+        services.reset_counters()
+
+        cycle_times = []
+        created = 0
+        for _ in range(cycles):
+            created += services.market.tick(tick_seconds)
+            start = time.perf_counter()
+            poll()
+            cycle_times.append(time.perf_counter() - start)
+        message_handler.notifier.wait_idle(120)
+
+        # One extra cycle under tracemalloc so its overhead doesn't skew the timings
+        services.market.tick(tick_seconds)
+        tracemalloc.start()
+        poll()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        message_handler.notifier.wait_idle(120)
+
+        with services._lock:
+            alerts = list(services.alerts)
+            calls = dict(services.calls)
+            bytes_sent = services.bytes_sent
+        alerted = {item_id for item_id, _, _ in alerts}
+        latencies = [
+            received - services.market.created_at[item_id]
+            for item_id, _, received in alerts if item_id in services.market.created_at
+        ]
+        search_calls = calls.get("search", 0)
+        return {
+            "scenario": "cycle",
+            "mode": mode,
+            "keywords": keyword_count,
+            "cycles": cycles,
+            "listed": created,
+            "alerted": len(alerted),
+            "cycle_mean": statistics.mean(cycle_times),
+            "cycle_p95": percentile(cycle_times, 0.95),
+            "latency_p50": percentile(latencies, 0.5),
+            "latency_p95": percentile(latencies, 0.95),
+            "search_calls": search_calls,
+            "messages": calls.get("telegram", 0),
+            "detail_calls": calls.get("get_items", 0),
+            "calls_per_alert": search_calls / len(alerted) if alerted else None,
+            "bytes_per_cycle": bytes_sent / (cycles + 1),
+            "peak_memory_kb": peak_memory / 1024,
+        }
+    finally:
+        if async_api:
+            async_api.close()
+            loop.close()
+        ebay_api.close()
+        message_handler.close()
+        if history:
+            history.close()
+        if enricher:
+            enricher.close()
+
+
+def run_seen_store(size, lookups=20000, adds=1000):
+    """Measure loading, lookups and appends for a seen-item store of the given size"""
+    from seen_store import FileSeenStore, SqliteSeenStore
+
+    results = []
+    with open("seen.txt", "w") as f:
+        f.write("\n".join(str(1000000 + i) for i in range(size)))
+
+    for backend in ("file", "sqlite"):
+        tracemalloc.start()
+        start = time.perf_counter()
+        if backend == "file":
+            store = FileSeenStore("seen.txt", fsync_every=50)
+        else:
+            store = SqliteSeenStore(f"seen-{size}.db", import_from="seen.txt")
+        load_time = time.perf_counter() - start
+        memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        for i in range(lookups):
+            _ = str(1000000 + (i * 7919) % (size * 2)) in store
+        lookup_time = (time.perf_counter() - start) / lookups
+
+        start = time.perf_counter()
+        for i in range(adds):
+            store.add(f"new{size}-{i}")
+        add_time = (time.perf_counter() - start) / adds
+        store.close()
+
+        results.append({
+            "scenario": "seen_store",
+            "backend": backend,
+            "size": size,
+            "load": load_time,
+            "lookup": lookup_time,
+            "add": add_time,
+            "load_memory_kb": memory / 1024,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the eBay monitor")
+    parser.add_argument("--keywords", default="1,10,40", help="Comma-separated keyword counts")
+    parser.add_argument("--modes", default="sync,async", help="Search modes to compare")
+    parser.add_argument("--cycles", type=int, default=5, help="Measured poll cycles per scenario")
+    parser.add_argument("--tick", type=float, default=30, help="Simulated seconds of listings between cycles")
+    parser.add_argument("--rate", type=float, default=6, help="New listings per keyword per simulated minute")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Latency added to every fake response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 500")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of requests failing with 429")
+    parser.add_argument("--chat-rate", type=float, default=100, help="Telegram messages per second per chat")
+    parser.add_argument("--max-price", type=float, help="Only alert on listings up to this price")
+    parser.add_argument("--price-history", action="store_true", help="Record every fetched listing's price")
+    parser.add_argument("--enrich", action="store_true", help="Fetch item details for every alerted listing")
+    parser.add_argument("--digest-window", type=float, default=0, help="Seconds alerts are coalesced into digests")
+    parser.add_argument("--seen-sizes", default="1000,100000", help="Comma-separated seen-store sizes")
+    parser.add_argument("--json", help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    market = FakeMarket([], listings_per_minute=args.rate)
+    services = FakeServices(
+        market, latency=args.latency_ms / 1000, error_rate=args.error_rate, rate_429=args.rate_429
+    ).start()
+
+    original_cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="ebay-bench-")
+    os.chdir(workdir)
+    install_config({
+        "EBAY_API_URL": services.url,
+        "TELEGRAM_API_URL": services.url,
+        "TELEGRAM_API_KEY": "bench-token",
+        "EBAY_CLIENT_ID": "bench",
+        "EBAY_CLIENT_SECRET": "bench",
+        "CHAT_IDS": [1001],
+        "EXCLUDED_SELLERS": [],
+        "SEARCH_BATCH_MODE": True,
+        "SEARCH_DELAY": 0,
+        "API_RATE_LIMIT_DELAY": 0,
+        "SEARCH_RATE_LIMIT": 1000,
+        "SEARCH_RATE_BURST": 1000,
+        "TELEGRAM_CHAT_RATE": args.chat_rate,
+        "TELEGRAM_GLOBAL_RATE": max(args.chat_rate, 30),
+        "NOTIFY_MAX_RETRIES": 3,
+        "DIGEST_WINDOW": args.digest_window,
+        "ITEMS_FILE": os.path.join(workdir, "items.txt"),
+        "OUTBOX_DB": os.path.join(workdir, "outbox.db"),
+        "WATERMARKS_FILE": os.path.join(workdir, "watermarks.json"),
+    })
+
+    # Scenario output would drown the results
+    real_stdout = sys.stdout
+    results = []
+    try:
+        for keyword_count in [int(n) for n in args.keywords.split(",")]:
+            for mode in args.modes.split(","):
+                for name in ("items.txt", "outbox.db"):
+                    path = os.path.join(workdir, name)
+                    if os.path.exists(path):
+                        os.remove(path)
+                sys.stdout = open(os.devnull, "w")
+                try:
+                    results.append(run_cycles(
+                        services, keyword_count, mode, args.cycles, args.tick, args.max_price, args.price_history,
+                        args.enrich
+                    ))
+                finally:
+                    sys.stdout.close()
+                    sys.stdout = real_stdout
+                print(f"✓ {mode} search with {keyword_count} keyword(s) done")
+
+        for size in [int(n) for n in args.seen_sizes.split(",")]:
+            sys.stdout = open(os.devnull, "w")
+            try:
+                results.extend(run_seen_store(size))
+            finally:
+                sys.stdout.close()
+                sys.stdout = real_stdout
+            print(f"✓ Seen store with {size} items done")
+    finally:
+        services.stop()
+
+    print("\n📊 Search and alert cycle")
+    print(f"{'mode':<6} {'keywords':>8} {'cycle':>10} {'cycle p95':>10} {'detect p50':>11} {'detect p95':>11} "
+          f"{'alerts':>7} {'messages':>9} {'calls/alert':>12} {'details':>8} {'bytes/cycle':>12} {'peak mem':>10}")
+    for r in results:
+        if r["scenario"] != "cycle":
+            continue
+        calls_per_alert = "-" if r["calls_per_alert"] is None else f"{r['calls_per_alert']:.2f}"
+        print(f"{r['mode']:<6} {r['keywords']:>8} {fmt_ms(r['cycle_mean']):>10} {fmt_ms(r['cycle_p95']):>10} "
+              f"{fmt_ms(r['latency_p50']):>11} {fmt_ms(r['latency_p95']):>11} {r['alerted']:>7} {r['messages']:>9} "
+              f"{calls_per_alert:>12} {r['detail_calls']:>8} {r['bytes_per_cycle']:>12.0f} {r['peak_memory_kb']:>8.0f}KB")
+
+    print("\n📊 Seen-item store")
+    print(f"{'backend':<8} {'size':>8} {'load':>10} {'lookup':>10} {'add':>10} {'load mem':>10}")
+    for r in results:
+        if r["scenario"] != "seen_store":
+            continue
+        print(f"{r['backend']:<8} {r['size']:>8} {fmt_ms(r['load']):>10} {r['lookup'] * 1e6:>8.1f}us "
+              f"{r['add'] * 1e6:>8.1f}us {r['load_memory_kb']:>8.0f}KB")
+
+    if args.json:
+        with open(os.path.join(original_cwd, args.json), "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✓ Results written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
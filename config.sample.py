@@ -4,26 +4,116 @@ import os
 
 # Search Configuration
 KEYWORDS = ["Brompton", "Brompton"]
-CATEGORY_ID = "177831"
+CATEGORY_ID = "177831"  # eBay category to search, or a list of categories each searched in every poll
+EBAY_MARKETPLACES = ["EBAY_GB"]  # Marketplaces searched in every poll, e.g. ["EBAY_GB", "EBAY_DE", "EBAY_US"]; earlier ones are preferred for items found on several
 EXCLUDED_SELLERS = [
     "nomorecorona",
     "acousticv8"
 ]
+COALESCE_QUERIES = False  # Serve narrower keywords (e.g. "Brompton M6L") from a broader search ("Brompton") in the same category
+KEYWORD_FILTERS = {}  # Per-keyword filters, e.g. {"Brompton": {"max_price": 900, "buying_options": ["FIXED_PRICE"], "exclude": [r"\bspares\b"]}}
+SUBSCRIPTIONS_FILE = None  # e.g. "subscriptions.yaml": JSON/YAML/TOML subscriptions used instead of KEYWORDS and KEYWORD_FILTERS, reloaded on change
+SUBSCRIPTIONS_CHECK_INTERVAL = 5  # Seconds between checks for changes to SUBSCRIPTIONS_FILE
 
 # Telegram Configuration
 CHAT_IDS = [1160971557]
 TELEGRAM_API_KEY = os.getenv("TELEGRAM_API_KEY", "your_telegram_bot_token_here")  # Set via environment variable
+TELEGRAM_API_URL = "https://api.telegram.org"  # Telegram Bot API endpoint
+NOTIFY_WORKERS = 2  # Background threads delivering Telegram messages
+NOTIFY_QUEUE_SIZE = 500  # Maximum alerts waiting for delivery before searches wait
+NOTIFY_MAX_RETRIES = 5  # Retries per chat for failed sends (429 flood waits don't count)
+TELEGRAM_CHAT_RATE = 1  # Messages per second to a single chat
+TELEGRAM_GLOBAL_RATE = 30  # Messages per second across all chats
+DIGEST_WINDOW = 0  # Seconds alerts for one subscription are collected into a single digest message after an alert, e.g. 20 (0 sends every alert alone)
+DIGEST_MAX_ITEMS = 10  # Send a digest early once this many alerts are waiting
 
 # eBay API Configuration
 EBAY_CLIENT_ID = "your_ebay_client_id_here"  # Replace with your actual client ID
 EBAY_CLIENT_SECRET = "your_ebay_client_secret_here"  # Replace with your actual client secret
+EBAY_API_URL = "https://api.ebay.com"  # eBay API endpoint (the sandbox is https://api.sandbox.ebay.com)
+TOKEN_CACHE_FILE = ".ebay_token.json"  # OAuth token cached between runs (None disables the cache)
+TOKEN_REFRESH_MARGIN = 600  # Renew the token in the background this many seconds before it expires
 
 # Browse API Configuration
 MAX_RESULTS_PER_BATCH = 50  # Maximum results to fetch per API call
 MAX_TOTAL_RESULTS = 200  # Maximum total results to process before giving up
+SEARCH_BATCH_MODE = True  # Alert on every new listing per search instead of only the newest one
+WATERMARK_PAGE_SIZE = 10  # Page size for incremental polls once a query has a watermark
+WATERMARKS_FILE = "watermarks.json"  # File to store the newest listing seen per query
+WATERMARKS_DB = None  # Keep watermarks in this SQLite file instead, required when sharding
+SEARCH_FIELDGROUPS = None  # Browse API fieldgroups, e.g. "EXTENDED"; None sends none and gets the default MATCHING_ITEMS
+
+# Listing Details
+ENRICH_ITEMS = False  # Fetch shipping cost, item location and auctions' Buy It Now price for listings about to be alerted
+# In sync mode a search's details are fetched in the background while the next searches run; async mode fetches a whole cycle's at once
+ENRICH_CACHE_SIZE = 5000  # Item details kept in memory, least recently used dropped first
+ENRICH_CACHE_TTL = 900  # Seconds item details are reused before being fetched again
+ENRICH_CONCURRENCY = 4  # getItems requests (of up to 20 listings each) run at once
 
 # Monitoring Configuration
-DELAY = 10  # Delay between searches in seconds
+DELAY = 10  # Initial poll interval for each keyword in seconds
 SEARCH_DELAY = 5  # Delay between individual searches in seconds
-API_RATE_LIMIT_DELAY = 1  # Delay between API calls to avoid rate limiting
-ITEMS_FILE = "items.txt"  # File to store processed item IDs 
\ No newline at end of file
+API_RATE_LIMIT_DELAY = 1  # Delay between the result pages of one search
+
+# HTTP Resilience (eBay and Telegram requests)
+HTTP_CONNECT_TIMEOUT = 5  # Seconds to wait for a connection
+HTTP_READ_TIMEOUT = 30  # Seconds to wait for response data
+HTTP_MAX_RETRIES = 2  # Retries after a connection error, timeout or 5xx, with jittered exponential backoff
+HTTP_BACKOFF_BASE = 0.5  # Seconds before the first retry, doubling for each further retry
+HTTP_MAX_RETRY_AFTER = 60  # Longest Retry-After waited out in line; longer ones fail the request until they pass
+CIRCUIT_FAILURE_THRESHOLD = 5  # Consecutive failures that stop requests to a host
+CIRCUIT_COOLDOWN = 5  # Seconds before a stopped host is probed again
+CIRCUIT_MAX_COOLDOWN = 300  # Longest pause between probes, the cooldown doubles after each failed probe
+
+# Price History
+PRICE_HISTORY_DB = None  # Record the price of every listing each poll fetches in this SQLite file (e.g. "prices.db"), None disables
+PRICE_DROP_PERCENT = 10  # Alert again when an alerted listing's price falls by at least this percentage (None only records prices)
+PRICE_SWEEP_INTERVAL = 3600  # Seconds between full-page re-reads of each search, so prices of listings already alerted are seen again
+PRICE_HISTORY_DAYS = 90  # Forget price observations older than this many days (None keeps them forever)
+
+# Deal Scoring
+DEAL_WINDOW = 0  # Recent listing prices per subscription the market median is taken over, e.g. 500 (0 disables deal scoring)
+DEAL_MIN_SAMPLES = 20  # Prices a subscription needs before its listings are scored
+DEAL_MIN_SCORE = None  # Skip listings less than this fraction below the median, e.g. 0.1 for 10% below or -0.2 to drop only those 20% above (None alerts on all)
+DEAL_PRIORITY_SCORE = None  # Listings at least this fraction below the median, e.g. 0.2, are alerted first and never held for a digest (None disables)
+
+# Adaptive Polling
+DAILY_CALL_BUDGET = 5000  # eBay Browse API calls per day shared by all keywords (getItems lookups included)
+MIN_POLL_INTERVAL = 10  # Fastest a busy keyword is polled, in seconds
+MAX_POLL_INTERVAL = 900  # Slowest a quiet keyword is polled, in seconds
+POLL_RATE_ALPHA = 0.3  # Weight of the latest poll in each keyword's new-items-per-poll average
+SCHEDULE_REPORT_INTERVAL = 600  # Seconds between printed poll schedule summaries
+
+# Search Mode
+SEARCH_MODE = "sync"  # "sync" searches keywords one by one, "async" fans them out concurrently
+MAX_CONCURRENT_SEARCHES = 8  # Maximum searches in flight at once in async mode
+SEARCH_RATE_LIMIT = 5  # Sustained eBay requests (search pages and getItems calls) per second in async mode (replaces SEARCH_DELAY)
+SEARCH_RATE_BURST = 5  # Requests allowed back-to-back before the rate limit applies
+ITEMS_FILE = "items.txt"  # File to store processed item IDs 
+OUTBOX_DB = "outbox.db"  # Alerts waiting for delivery, replayed after a restart
+OUTBOX_FAILED_TTL = 7 * 24 * 3600  # Seconds alerts that failed to reach a chat stay in the outbox (None keeps them forever)
+
+# Processed Items Store
+SEEN_STORE_BACKEND = "file"  # "file" (append-only ITEMS_FILE) or "sqlite"
+SEEN_ITEMS_DB = "items.db"  # Database used by the sqlite backend (imports ITEMS_FILE on first run)
+SEEN_ITEM_TTL = 90 * 24 * 3600  # Forget processed items after this many seconds (None keeps them forever)
+SEEN_STORE_FSYNC_EVERY = 20  # fsync the append-only log after this many new items
+
+# Logging and Metrics
+LOG_MODE = "print"  # "print" for plain console output, "structured" for JSON lines
+LOG_LEVEL = "INFO"  # DEBUG shows per-item details, WARNING keeps only problems
+METRICS_PORT = None  # Serve Prometheus metrics on this port (e.g. 9108), None disables the endpoint
+METRICS_HOST = "127.0.0.1"  # Interface the metrics endpoint listens on
+METRICS_DUMP_FILE = None  # Also write metrics as JSON to this file periodically and on exit
+
+# Service Mode
+STATE_FILE = "monitor_state.json"  # Checkpoint of the learned poll schedule, resumed on restart (None disables)
+CHECKPOINT_INTERVAL = 60  # Seconds between checkpoints of the poll schedule, watermarks and processed items
+SHUTDOWN_DRAIN_TIMEOUT = 20  # Seconds a SIGTERM/SIGINT shutdown waits for pending alerts, the rest stay in the outbox
+HEALTH_STALL_TIMEOUT = 600  # /healthz fails when the main loop is this many seconds late waking up or finishing polls
+
+# Sharding
+SHARD_DB = None  # SQLite file shared by shard workers (e.g. "shards.db"), None runs a single unsharded monitor
+SHARD_WORKERS = 1  # Local worker processes started by monitor.py when SHARD_DB is set
+SHARD_HEARTBEAT_INTERVAL = 10  # Seconds between worker heartbeats and shard ring checks
+SHARD_DEAD_AFTER = 30  # A worker silent for this many seconds is dropped and its searches reassigned
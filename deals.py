@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Deal Scoring
+Rates new listings by how far below the recent market price of their subscription they are
+"""
+
+from bisect import bisect_left, insort
+from collections import deque
+
+
+class RollingPrices:
+    """The last size prices, kept both in arrival order and sorted
+
+    Adding or evicting a price is a binary search plus one list move, and
+    quantiles and ranks are read straight from the sorted copy, so a
+    window of tens of thousands of prices costs microseconds per listing.
+    """
+
+    __slots__ = ("size", "_order", "_sorted")
+
+    def __init__(self, size):
+        self.size = size
+        self._order = deque()
+        self._sorted = []
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def add(self, price):
+        self._order.append(price)
+        insort(self._sorted, price)
+        if len(self._order) > self.size:
+            oldest = self._order.popleft()
+            del self._sorted[bisect_left(self._sorted, oldest)]
+
+    def quantile(self, fraction):
+        """Nearest-rank quantile, None while empty"""
+        if not self._sorted:
+            return None
+        return self._sorted[min(len(self._sorted) - 1, int(round(fraction * (len(self._sorted) - 1))))]
+
+    def rank(self, price):
+        """Fraction of the window priced below price"""
+        return bisect_left(self._sorted, price) / len(self._sorted) if self._sorted else None
+
+
+class Deal:
+    """How a listing's price compares with its subscription's market"""
+
+    __slots__ = ("score", "median", "rank", "samples", "currency")
+
+    def __init__(self, score, median, rank, samples, currency):
+        # Fraction below the median price: 0.25 is 25% cheaper, negative is dearer
+        self.score = score
+        self.median = median
+        self.rank = rank
+        self.samples = samples
+        self.currency = currency
+
+    def describe(self):
+        direction = "below" if self.score >= 0 else "above"
+        return (f"{abs(self.score) * 100:.0f}% {direction} the median of {self.samples} recent listings "
+                f"({self.median:.2f} {self.currency})")
+
+    def __repr__(self):
+        return f"Deal({self.score:+.2f} vs median {self.median} {self.currency})"
+
+
+class DealScorer:
+    """Rolling market prices per subscription and currency, and scores for new listings against them
+
+    A batch of listings is scored against the window as it stood before
+    the batch, then added to it, so a seller listing many items at once
+    does not move the median the batch is judged by. Listings are only
+    scored once their window holds min_samples prices.
+    """
+
+    def __init__(self, window=500, min_samples=20):
+        self.window = window
+        self.min_samples = min_samples
+        self._windows = {}
+
+    def score(self, key, listings):
+        """Score listings of one subscription and add their prices to its window
+
+        Returns a Deal (or None if unpriced or too few samples yet) per listing.
+        """
+        deals = []
+        priced = []
+        for listing in listings:
+            try:
+                price = float(listing.price)
+            except (TypeError, ValueError):
+                deals.append(None)
+                continue
+            prices = self._windows.get((key, listing.currency))
+            median = prices.quantile(0.5) if prices is not None and len(prices) >= self.min_samples else None
+            if median:
+                deals.append(Deal(1 - price / median, median, prices.rank(price), len(prices), listing.currency))
+            else:
+                deals.append(None)
+            priced.append((listing.currency, price))
+
+        for currency, price in priced:
+            prices = self._windows.get((key, currency))
+            if prices is None:
+                prices = self._windows[(key, currency)] = RollingPrices(self.window)
+            prices.add(price)
+        return deals
+
+    def retain(self, keys):
+        """Drop the windows of subscriptions no longer in keys"""
+        keys = set(keys)
+        for window_key in [window_key for window_key in self._windows if window_key[0] not in keys]:
+            del self._windows[window_key]
+
+    def describe(self):
+        """Median and sample count of every window, for the schedule report"""
+        lines = ["Market prices:"]
+        for (key, currency), prices in sorted(self._windows.items()):
+            lines.append(f"   {key[0]!r}: median {prices.quantile(0.5):.2f} {currency} over {len(prices)} listings")
+        return "\n".join(lines)
@@ -5,30 +5,79 @@ Handles authentication, search, and item parsing
 """
 
 import os
+import asyncio
 import base64
 import requests
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from config import (
-    EBAY_CLIENT_ID, EBAY_CLIENT_SECRET,
+    EBAY_CLIENT_ID, EBAY_CLIENT_SECRET, EBAY_API_URL,
     MAX_RESULTS_PER_BATCH, MAX_TOTAL_RESULTS,
-    API_RATE_LIMIT_DELAY
+    API_RATE_LIMIT_DELAY,
+    MAX_CONCURRENT_SEARCHES, SEARCH_RATE_LIMIT, SEARCH_RATE_BURST,
+    WATERMARK_PAGE_SIZE, SEARCH_FIELDGROUPS,
+    TOKEN_CACHE_FILE, TOKEN_REFRESH_MARGIN,
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_MAX_RETRIES, HTTP_BACKOFF_BASE, HTTP_MAX_RETRY_AFTER,
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN, CIRCUIT_MAX_COOLDOWN, PRICE_SWEEP_INTERVAL
 )
+from listing import Listing, iter_search_items
+from logs import get_logger
+from marketplaces import DEFAULT_MARKETPLACE, item_url, marketplace_currency
+from metrics import TOKEN_REFRESHES, ITEMS_FETCHED, ITEMS_FILTERED
+from rate_limit import TokenBucket
+from token_manager import TokenManager
+from transport import Transport, create_session
+from watermarks import WatermarkStore
+
+log = get_logger(__name__)
+
+STREAM_CHUNK_SIZE = 16384
+
+
+def create_transport(pool_size=MAX_CONCURRENT_SEARCHES, session=None, traffic=None):
+    """Create an HTTP transport with the timeouts, retries and circuit breaker settings from config
+    
+    traffic is an optional TrafficRecorder or TrafficReplay the requests go through.
+    """
+    return Transport(
+        session or create_session(pool_size, traffic.adapter(pool_size) if traffic is not None else None),
+        timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+        max_retries=HTTP_MAX_RETRIES,
+        backoff_base=HTTP_BACKOFF_BASE,
+        max_wait=HTTP_MAX_RETRY_AFTER,
+        failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+        cooldown=CIRCUIT_COOLDOWN,
+        max_cooldown=CIRCUIT_MAX_COOLDOWN
+    )
 
 
 class EbayAPI:
     """eBay Browse API client"""
     
-    def __init__(self):
-        self.access_token = None
-        self.token_expiry = None
-        self.base_url = "https://api.ebay.com"
+    def __init__(self, session=None, watermarks=None, tokens=None, transport=None, history=None):
+        self.base_url = EBAY_API_URL
+        self.transport = transport or create_transport(session=session)
+        self.session = self.transport.session
+        self.tokens = tokens or TokenManager(
+            self._request_access_token, TOKEN_CACHE_FILE, owner=f"{EBAY_API_URL}|{EBAY_CLIENT_ID}",
+            refresh_margin=TOKEN_REFRESH_MARGIN
+        )
+        self.watermarks = watermarks or WatermarkStore()
+        # Optional PriceHistory recording every listing a search fetches
+        self.history = history
+        # Optional TokenBucket every search page and getItems request waits on
+        self.rate_limiter = None
+        self.last_call_counts = {}
+        self._last_sweep = {}
+        self._fanout = None
         
     def get_access_token(self):
         """Get eBay OAuth access token"""
-        if self.access_token and self.token_expiry and datetime.now().timestamp() < self.token_expiry:
-            return self.access_token
-            
+        return self.tokens.get()
+    
+    def _request_access_token(self):
+        """Request a new OAuth access token from eBay, returns the token response"""
         auth_url = f"{self.base_url}/identity/v1/oauth2/token"
         
         # Create Basic auth header with client_id:client_secret
@@ -49,105 +98,412 @@ class EbayAPI:
         }
         
         try:
-            response = requests.post(auth_url, headers=headers, data=data)
+            response = self.transport.post(auth_url, endpoint="oauth_token", headers=headers, data=data)
             response.raise_for_status()
             
             token_data = response.json()
-            self.access_token = token_data["access_token"]
+            if "access_token" not in token_data:
+                raise ValueError("No access_token in OAuth response")
             
-            # Set expiry (subtract 5 minutes for safety)
-            expires_in = token_data.get("expires_in", 7200)  # Default 2 hours
-            self.token_expiry = datetime.now().timestamp() + expires_in - 300
-            
-            print("✓ Successfully obtained eBay access token")
-            return self.access_token
+            TOKEN_REFRESHES.inc(outcome="ok")
+            log.info("✓ Successfully obtained eBay access token")
+            return token_data
             
         except Exception as e:
-            print(f"✗ Failed to get eBay access token: {e}")
+            TOKEN_REFRESHES.inc(outcome="error")
+            log.error(f"✗ Failed to get eBay access token: {e}")
             raise
     
-    def search_listings(self, keywords, excluded_sellers, category_id, max_total_results=MAX_TOTAL_RESULTS):
-        """Search eBay listings and return latest items"""
-        
-        # Get access token
-        access_token = self.get_access_token()
+    def _browse_get(self, url, endpoint, marketplace, **kwargs):
+        """GET a Browse API URL with the access token, re-authenticating once if eBay rejects it
         
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json",
-            "X-EBAY-C-MARKETPLACE-ID": "3"  # UK marketplace
-        }
+        Every attempt waits on the rate limiter. Returns the requests Response.
+        """
+        for attempt in range(2):
+            access_token = self.get_access_token()
+            headers = {
+                "Authorization": f"Bearer {access_token}",
+                "Content-Type": "application/json",
+                "X-EBAY-C-MARKETPLACE-ID": marketplace
+            }
+            response = self.transport.get(url, endpoint=endpoint, headers=headers, limiter=self.rate_limiter, **kwargs)
+            if response.status_code != 401 or attempt:
+                return response
+            # Token revoked or expired early: re-authenticate once and retry
+            log.warning("⚠️  eBay rejected the access token, re-authenticating...")
+            response.close()
+            self.tokens.invalidate(access_token)
+    
+    def _fetch_page(self, keywords, category_id, offset=0, limit=MAX_RESULTS_PER_BATCH, filters=None,
+                    marketplace=DEFAULT_MARKETPLACE):
+        """Fetch one page of newly listed items, raises on request errors"""
         
         # Search parameters
         search_params = {
             "q": keywords,
             "category_ids": category_id,
             "sort": "newlyListed",
-            "limit": MAX_RESULTS_PER_BATCH,
-            "offset": 0
+            "limit": limit,
+            "offset": offset
         }
+        if SEARCH_FIELDGROUPS:
+            search_params["fieldgroups"] = SEARCH_FIELDGROUPS
+        if filters:
+            search_params["filter"] = filters
         
-        print(f"Searching for '{keywords}' in category {category_id}")
-        print(f"Excluded sellers: {excluded_sellers}")
+        # Make API request
+        api_url = f"{self.base_url}/buy/browse/v1/item_summary/search"
         
-        try:
-            # Make API request
-            api_url = f"{self.base_url}/buy/browse/v1/item_summary/search"
-            
-            response = requests.get(api_url, headers=headers, params=search_params)
+        # Stream the body so each item is reduced to a Listing as it is decoded
+        with self._browse_get(api_url, "search", marketplace, params=search_params, stream=True) as response:
             response.raise_for_status()
-            
-            data = response.json()
-            items = data.get("itemSummaries", [])
+            items = list(iter_search_items(response.iter_content(STREAM_CHUNK_SIZE), marketplace=marketplace))
+        
+        ITEMS_FETCHED.inc(len(items), query=keywords)
+        return items
+    
+    def get_items(self, item_ids, marketplace=DEFAULT_MARKETPLACE):
+        """Fetch full details of up to 20 listings with one getItems call, raises on request errors
+        
+        Returns the decoded items; listings that ended or were not found are left out.
+        """
+        api_url = f"{self.base_url}/buy/browse/v1/item/"
+        response = self._browse_get(api_url, "get_items", marketplace, params={"item_ids": ",".join(item_ids)})
+        if response.status_code == 404:
+            # None of the listings exist any more
+            return []
+        response.raise_for_status()
+        return response.json().get("items") or []
+    
+    def search_listings(self, keywords, excluded_sellers, category_id, max_total_results=MAX_TOTAL_RESULTS,
+                        api_filter=None, marketplace=DEFAULT_MARKETPLACE):
+        """Search eBay listings and return latest items
+        
+        api_filter is an optional Browse API filter= value applied by eBay.
+        Raises requests' RequestException if eBay could not be reached.
+        """
+        
+        log.info(f"Searching for '{keywords}' in category {category_id} on {marketplace}")
+        log.debug(f"Excluded sellers: {excluded_sellers}")
+        
+        try:
+            items = self._fetch_page(keywords, category_id, filters=api_filter, marketplace=marketplace)
+            if self.history is not None:
+                self.history.record(keywords, items)
             
             if not items:
-                print("No items found")
+                log.info("No items found")
                 return None
             
-            print(f"Found {len(items)} items")
+            log.info(f"Found {len(items)} items")
             
             # Return the first valid item (not from excluded sellers)
             for item in items:
-                seller_username = item.get("seller", {}).get("username", "")
+                seller_username = item.seller
                 if seller_username not in excluded_sellers:
-                    print(f"✓ Found valid item from seller: {seller_username}")
+                    log.debug(f"✓ Found valid item from seller: {seller_username}")
                     return item
                 else:
-                    print(f"  Skipping item from excluded seller: {seller_username}")
+                    log.debug(f"  Skipping item from excluded seller: {seller_username}")
             
-            # If no valid items found, return the first item anyway for testing
-            if items:
-                first_item = items[0]
-                first_seller = first_item.get("seller", {}).get("username", "")
-                print(f"⚠️  No valid items found, returning first item from excluded seller: {first_seller}")
-                return first_item
-            
-            print("No valid items found (all from excluded sellers)")
+            log.info("No valid items found (all from excluded sellers)")
             return None
             
         except requests.exceptions.RequestException as e:
-            print(f"✗ API request failed: {e}")
-            return None
+            # Raised so the poll counts as failed instead of as a quiet search
+            log.error(f"✗ API request failed: {e}")
+            raise
         except Exception as e:
-            print(f"✗ Unexpected error: {e}")
+            log.error(f"✗ Unexpected error: {e}")
             return None
+    
+    def search_new_listings(self, keywords, excluded_sellers, category_id,
+                            max_total_results=MAX_TOTAL_RESULTS, is_seen=None, api_filter=None,
+                            marketplace=DEFAULT_MARKETPLACE):
+        """Search eBay listings and return every item newer than the last search
+        
+        Once a query has a watermark, only listings started at or after it are
+        requested, in small pages, and further pages are fetched only while the
+        delta keeps filling them, up to max_total_results. Items accepted by
+        is_seen (already alerted, possibly by another search) are left out;
+        only on a first search, with no watermark yet, does paging stop at
+        one. A first search that finds nothing already seen only returns the
+        newest listing so a fresh start does not flood alerts. api_filter is an optional Browse API filter= value
+        applied by eBay. Raises requests' RequestException if eBay could not
+        be reached.
+        """
+        
+        watermark = self.watermarks.get(keywords, category_id, marketplace)
+        if watermark and not self._sweep_due(keywords, category_id, marketplace):
+            filters = f"itemStartDate:[{watermark.listing_date}..]"
+            page_size = WATERMARK_PAGE_SIZE
+        else:
+            filters = None
+            page_size = MAX_RESULTS_PER_BATCH
+        if api_filter:
+            filters = f"{filters},{api_filter}" if filters else api_filter
+        log.info(f"Searching for new '{keywords}' listings in category {category_id} on {marketplace}")
+        
+        new_items = []
+        fetched = []
+        offset = 0
+        calls = 0
+        try:
+            while offset < max_total_results:
+                limit = min(page_size, max_total_results - offset)
+                items = self._fetch_page(keywords, category_id, offset, limit, filters, marketplace)
+                calls += 1
+                fetched.extend(items)
+                
+                reached_seen = False
+                for item in items:
+                    if watermark and watermark.covers(item.item_id, item.listing_date):
+                        reached_seen = True
+                        continue
+                    if is_seen and is_seen(item.legacy_id):
+                        if watermark is None:
+                            # Nothing to anchor on yet: stop where the last run left off
+                            reached_seen = True
+                            break
+                        # Alerted by another search, listings after it may still be new
+                        continue
+                    seller_username = item.seller
+                    if seller_username in excluded_sellers:
+                        log.debug(f"  Skipping item from excluded seller: {seller_username}")
+                        ITEMS_FILTERED.inc(query=keywords, reason="excluded_seller")
+                        continue
+                    new_items.append(item)
+                
+                if watermark is None and not reached_seen:
+                    # Nothing to anchor on yet, so only the newest listing counts as new
+                    new_items = new_items[:1]
+                    break
+                if reached_seen or len(items) < limit:
+                    break
+                offset += limit
+                if API_RATE_LIMIT_DELAY:
+                    time.sleep(API_RATE_LIMIT_DELAY)
+        
+        except requests.exceptions.RequestException as e:
+            # The watermark did not move, so anything found so far is fetched again next time
+            log.error(f"✗ API request failed: {e}")
+            raise
+        except Exception as e:
+            log.error(f"✗ Unexpected error: {e}")
+            return new_items
+        finally:
+            self.last_call_counts[(keywords, category_id, marketplace)] = calls
+            if self.history is not None:
+                self.history.record(keywords, fetched)
+        
+        # Only advance the watermark once the whole delta has been read
+        self.watermarks.advance(keywords, category_id, fetched, marketplace)
+        
+        log.info(f"Found {len(new_items)} new items")
+        return new_items
+    
+    def _sweep_due(self, keywords, category_id, marketplace):
+        """Check whether a watermarked search should fetch a full page this time
+        
+        Watermarked polls only see new listings, so with a price history
+        every PRICE_SWEEP_INTERVAL seconds one poll of each search re-reads
+        the newest full page to observe price changes of listings already
+        alerted.
+        """
+        if self.history is None or not PRICE_SWEEP_INTERVAL:
+            return False
+        key = (keywords, category_id, marketplace)
+        now = time.monotonic()
+        if key not in self._last_sweep:
+            # Count from the first search rather than sweeping on every restart
+            self._last_sweep[key] = now
+            return False
+        if now - self._last_sweep[key] < PRICE_SWEEP_INTERVAL:
+            return False
+        self._last_sweep[key] = now
+        log.info(f"Re-reading the newest '{keywords}' listings in category {category_id} on {marketplace} for price changes")
+        return True
+    
+    def search_targets(self, keywords, targets, excluded_sellers, max_total_results=MAX_TOTAL_RESULTS,
+                       batch=True, is_seen=None, api_rule=None):
+        """Search several (marketplace, category_id) targets concurrently and merge the results
+        
+        Each target is searched with search_new_listings (batch=True) or
+        search_listings, and the results are combined by merge_results.
+        api_rule is an optional FilterRule eBay applies to every target.
+        """
+        searches = []
+        for marketplace, category_id in targets:
+            api_filter = target_filter(api_rule, marketplace)
+            if batch:
+                searches.append(partial(
+                    self.search_new_listings, keywords, excluded_sellers, category_id, max_total_results,
+                    is_seen, api_filter, marketplace
+                ))
+            else:
+                searches.append(partial(
+                    self.search_listings, keywords, excluded_sellers, category_id, max_total_results,
+                    api_filter, marketplace
+                ))
+        if len(searches) == 1:
+            return searches[0]()
+        
+        if self._fanout is None:
+            self._fanout = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SEARCHES, thread_name_prefix="ebay-fanout")
+        futures = [self._fanout.submit(search) for search in searches]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return merge_results(results, batch)
+    
+    def close(self):
+        """Stop the fan-out threads and close the watermark store"""
+        if self._fanout is not None:
+            self._fanout.shutdown(wait=False)
+            self._fanout = None
+        self.watermarks.close()
+
+
+class AsyncEbayAPI:
+    """Concurrent search front-end sharing one pooled EbayAPI client
+    
+    The rate limit is installed on the client, so it applies to every
+    request it sends: each page of a search and each getItems call.
+    """
+    
+    def __init__(self, ebay_api=None, max_concurrency=MAX_CONCURRENT_SEARCHES,
+                 rate_limit=SEARCH_RATE_LIMIT, burst=SEARCH_RATE_BURST):
+        self.max_concurrency = max_concurrency
+        self.api = ebay_api or EbayAPI()
+        self.rate_limiter = self.api.rate_limiter = TokenBucket(rate_limit, burst)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="ebay-search")
+        self._semaphore = None
+    
+    async def get_access_token(self):
+        """Get eBay OAuth access token without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.api.get_access_token)
+    
+    async def _run_search(self, search, *args):
+        """Run a blocking EbayAPI search on the executor under the concurrency cap"""
+        if self._semaphore is None:
+            # Created here so it belongs to the running event loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, search, *args)
+    
+    async def search_listings(self, keywords, excluded_sellers, category_id, max_total_results=MAX_TOTAL_RESULTS,
+                              api_filter=None, marketplace=DEFAULT_MARKETPLACE):
+        """Search eBay listings under the concurrency cap and rate limit"""
+        return await self._run_search(
+            self.api.search_listings,
+            keywords, excluded_sellers, category_id, max_total_results, api_filter, marketplace
+        )
+    
+    async def search_new_listings(self, keywords, excluded_sellers, category_id,
+                                  max_total_results=MAX_TOTAL_RESULTS, is_seen=None, api_filter=None,
+                                  marketplace=DEFAULT_MARKETPLACE):
+        """Search for every new listing under the concurrency cap and rate limit"""
+        return await self._run_search(
+            self.api.search_new_listings,
+            keywords, excluded_sellers, category_id, max_total_results, is_seen, api_filter, marketplace
+        )
+    
+    async def search_many(self, searches, excluded_sellers, max_total_results=MAX_TOTAL_RESULTS,
+                          batch=False, is_seen=None):
+        """Run searches concurrently, returns (search, result) pairs in input order
+        
+        Each search is a (keywords, targets, api_rule) tuple as for
+        EbayAPI.search_targets. Every (marketplace, category_id) target of
+        every search is fetched concurrently, then each search's results are
+        combined by merge_results. With batch=True each result is a
+        newest-first list as from search_new_listings. A search whose
+        targets all failed gets the exception as its result.
+        """
+        jobs = []
+        for keywords, targets, api_rule in searches:
+            for marketplace, category_id in targets:
+                api_filter = target_filter(api_rule, marketplace)
+                if batch:
+                    jobs.append(self.search_new_listings(
+                        keywords, excluded_sellers, category_id, max_total_results, is_seen, api_filter, marketplace
+                    ))
+                else:
+                    jobs.append(self.search_listings(
+                        keywords, excluded_sellers, category_id, max_total_results, api_filter, marketplace
+                    ))
+        outcomes = iter(await asyncio.gather(*jobs, return_exceptions=True))
+        
+        results = []
+        for search in searches:
+            target_results = [next(outcomes) for _ in search[1]]
+            try:
+                results.append((search, merge_results(target_results, batch)))
+            except Exception as e:
+                results.append((search, e))
+        return results
+    
+    def close(self):
+        """Shut down worker threads and pooled connections"""
+        self.executor.shutdown(wait=False)
+        self.api.session.close()
 
 
-def parse_ebay_item(item_data):
-    """Parse item data from eBay Browse API response"""
+def target_filter(api_rule, marketplace):
+    """The Browse API filter= value of a FilterRule for one marketplace, or None"""
+    return api_rule.api_filter(marketplace_currency(marketplace)) if api_rule is not None else None
+
+
+def merge_results(results, batch=True):
+    """Combine the results of searching one query on several targets
+    
+    results holds each target's result in order of preference: a list of
+    Listings (batch=True), a single Listing or None, or the exception the
+    search raised. An item found on several marketplaces is kept once, as
+    found on the earliest target. Failed targets are logged and skipped
+    unless all of them failed, in which case the first error is raised.
+    Returns a newest-first list (batch=True) or the newest listing.
+    """
+    errors = [result for result in results if isinstance(result, Exception)]
+    if errors and len(errors) == len(results):
+        raise errors[0]
+    for error in errors:
+        log.error(f"✗ One marketplace or category search failed, using the others: {error}")
+    
+    seen = set()
+    merged = []
+    for result in results:
+        if isinstance(result, Exception) or not result:
+            continue
+        for item in result if isinstance(result, list) else [result]:
+            item_key = item.legacy_id or item.item_id
+            if item_key not in seen:
+                seen.add(item_key)
+                merged.append(item)
+    # ISO 8601 UTC dates sort as strings; the sort is stable so ties keep target order
+    merged.sort(key=lambda item: item.listing_date, reverse=True)
+    if batch:
+        return merged
+    return merged[0] if merged else None
+
+
+def parse_ebay_item(item_data, details=None):
+    """Parse a Listing (or a raw Browse API item) into the fields used for alerts
     
-    # Extract basic info
-    parts = str(item_data.get("itemId", "")).split("|")
-    item_id = parts[1] if len(parts) > 1 else ""
-    title = item_data.get("title", "")
+    details is an optional ItemDetails adding the real prices, shipping and location.
+    """
     
-    # Extract prices
-    price = item_data.get("price", {})
-    current_price = price.get("value", "") if price else ""
-    currency = price.get("currency", "GBP") if price else "GBP"
+    listing = item_data if isinstance(item_data, Listing) else Listing.from_dict(item_data)
+    current_price = listing.price
+    currency = listing.currency
     
     # Determine listing type and prices
-    buying_options = item_data.get("buyingOptions", [])
+    buying_options = listing.buying_options
     auction_price = None
     buy_now_price = None
     
@@ -157,20 +513,30 @@ def parse_ebay_item(item_data):
         buy_now_price = f"{current_price} {currency}"
     if "AUCTION_WITH_BIN" in buying_options:
         auction_price = f"{current_price} {currency}"
-        # For auction with BIN, the buy now price might be in a different field
-        # This is a simplified approach - you might need to adjust based on actual API response
+        # The search result only has one price, the Buy It Now price comes from the item details
+    
+    shipping = None
+    location = None
+    if details is not None:
+        if details.current_bid and auction_price:
+            auction_price = f"{details.current_bid} {details.currency}"
+        if details.buy_now_price:
+            buy_now_price = f"{details.buy_now_price} {details.currency}"
+        shipping = details.describe_shipping()
+        location = details.location
     
     # Check for best offer
     best_offer_enabled = "BEST_OFFER" in buying_options
     
-    # Extract listing time
-    listing_time = item_data.get("listingDate", "")
-    
     return {
-        "title": title,
-        "listing_time": listing_time,
-        "item_id": item_id,
+        "title": listing.title,
+        "listing_time": listing.listing_date,
+        "item_id": listing.legacy_id,
+        "marketplace": listing.marketplace,
+        "link": item_url(listing.legacy_id, listing.marketplace),
         "buy_now_price": buy_now_price,
         "auction_price": auction_price,
-        "best_offer_enabled": best_offer_enabled
-    } 
\ No newline at end of file
+        "best_offer_enabled": best_offer_enabled,
+        "shipping": shipping,
+        "location": location
+    }
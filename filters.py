@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Listing Filters
+Per-subscription price, buying option, condition, title and seller rules
+"""
+
+import re
+
+BUYING_OPTIONS = frozenset({"AUCTION", "FIXED_PRICE", "BEST_OFFER"})
+
+# The Browse API accepts at most this many sellers in one excludeSellers filter
+MAX_PUSHDOWN_SELLERS = 250
+
+
+def _seller_set(sellers):
+    return frozenset(seller.lower() for seller in sellers)
+
+
+class FilterRule:
+    """Which listings a subscription wants, compiled once for fast matching
+
+    Price, buying option, condition and seller rules are sent to eBay in the
+    search's filter= parameter so unwanted listings are never fetched. All
+    rules, including the title include/exclude regexes eBay cannot apply,
+    are also checked locally by matches().
+    """
+
+    __slots__ = (
+        "min_price", "max_price", "currency", "buying_options", "conditions",
+        "include", "exclude", "excluded_sellers", "sellers", "_include", "_exclude"
+    )
+
+    OPTIONS = (
+        "min_price", "max_price", "currency", "buying_options", "conditions",
+        "include", "exclude", "excluded_sellers", "sellers"
+    )
+
+    def __init__(self, min_price=None, max_price=None, currency="GBP", buying_options=None, conditions=None,
+                 include=(), exclude=(), excluded_sellers=(), sellers=None):
+        self.min_price = float(min_price) if min_price is not None else None
+        self.max_price = float(max_price) if max_price is not None else None
+        self.currency = currency
+        self.buying_options = frozenset(option.upper() for option in buying_options) if buying_options else None
+        if self.buying_options and not self.buying_options <= BUYING_OPTIONS:
+            unknown = ", ".join(sorted(self.buying_options - BUYING_OPTIONS))
+            raise ValueError(f"Unknown buying option(s): {unknown}")
+        self.conditions = frozenset(str(condition) for condition in conditions) if conditions else None
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self.excluded_sellers = _seller_set(excluded_sellers)
+        self.sellers = _seller_set(sellers) if sellers else None
+
+        # Every include pattern must match; the exclude patterns run as one alternation
+        self._include = tuple(re.compile(pattern, re.IGNORECASE) for pattern in self.include)
+        self._exclude = (
+            re.compile("|".join(f"(?:{pattern})" for pattern in self.exclude), re.IGNORECASE)
+            if self.exclude else None
+        )
+
+    @classmethod
+    def from_dict(cls, options, excluded_sellers=()):
+        """Build a rule from config options, adding the global excluded sellers"""
+        options = dict(options or {})
+        unknown = set(options) - set(cls.OPTIONS)
+        if unknown:
+            raise ValueError(f"Unknown filter option(s): {', '.join(sorted(unknown))}")
+        options["excluded_sellers"] = list(options.get("excluded_sellers", ())) + list(excluded_sellers)
+        return cls(**options)
+
+    @property
+    def key(self):
+        return (
+            self.min_price, self.max_price, self.currency, self.buying_options, self.conditions,
+            self.include, self.exclude, self.excluded_sellers, self.sellers
+        )
+
+    def __eq__(self, other):
+        return isinstance(other, FilterRule) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        parts = [f"{name}={getattr(self, name)!r}" for name in self.OPTIONS if getattr(self, name)]
+        return f"FilterRule({', '.join(parts)})"
+
+    def matches(self, listing):
+        """Check a Listing against every rule, cheapest checks first"""
+        if self.excluded_sellers and listing.seller.lower() in self.excluded_sellers:
+            return False
+        if self.sellers is not None and listing.seller.lower() not in self.sellers:
+            return False
+        if self.buying_options is not None and self.buying_options.isdisjoint(listing.buying_options):
+            return False
+        if self.conditions is not None and listing.condition_id and listing.condition_id not in self.conditions:
+            return False
+        if self.min_price is not None or self.max_price is not None:
+            # Prices on a marketplace with another currency can't be compared with the limits
+            if listing.currency != self.currency:
+                return False
+            try:
+                price = float(listing.price)
+            except (TypeError, ValueError):
+                return False
+            if self.min_price is not None and price < self.min_price:
+                return False
+            if self.max_price is not None and price > self.max_price:
+                return False
+        if self._exclude is not None and self._exclude.search(listing.title):
+            return False
+        return all(pattern.search(listing.title) for pattern in self._include)
+
+    def api_filter(self, currency=None):
+        """The part of this rule eBay can apply, as a Browse API filter= value (or None)
+
+        currency is that of the marketplace searched; price limits in another
+        currency are left to matches().
+        """
+        parts = []
+        if (self.min_price is not None or self.max_price is not None) and currency in (None, self.currency):
+            low = f"{self.min_price:g}" if self.min_price is not None else ""
+            high = f"{self.max_price:g}" if self.max_price is not None else ""
+            parts.append(f"price:[{low}..{high}]")
+            parts.append(f"priceCurrency:{self.currency}")
+        if self.buying_options:
+            parts.append(f"buyingOptions:{{{'|'.join(sorted(self.buying_options))}}}")
+        if self.conditions:
+            parts.append(f"conditionIds:{{{'|'.join(sorted(self.conditions))}}}")
+        if self.sellers:
+            parts.append(f"sellers:{{{'|'.join(sorted(self.sellers))}}}")
+        if self.excluded_sellers and len(self.excluded_sellers) <= MAX_PUSHDOWN_SELLERS:
+            parts.append(f"excludeSellers:{{{'|'.join(sorted(self.excluded_sellers))}}}")
+        return ",".join(parts) or None
+
+    @classmethod
+    def loosest(cls, rules):
+        """A rule eBay can apply that lets through everything any of the given rules accepts
+
+        Used when one search serves several subscriptions: each rule is
+        still checked locally per subscription afterwards.
+        """
+        rules = [rule or cls() for rule in rules]
+        if not rules:
+            return cls()
+
+        def bound(values, pick):
+            return None if any(value is None for value in values) else pick(values)
+
+        def union(sets):
+            return None if any(values is None for values in sets) else frozenset().union(*sets)
+
+        currencies = {rule.currency for rule in rules}
+        priced = len(currencies) == 1
+        return cls(
+            min_price=bound([rule.min_price for rule in rules], min) if priced else None,
+            max_price=bound([rule.max_price for rule in rules], max) if priced else None,
+            currency=rules[0].currency,
+            buying_options=union([rule.buying_options for rule in rules]),
+            conditions=union([rule.conditions for rule in rules]),
+            excluded_sellers=frozenset.intersection(*[rule.excluded_sellers for rule in rules]),
+            sellers=union([rule.sellers for rule in rules]),
+        )
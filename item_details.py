@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Item Details
+Enriches listings about to be alerted with getItems data (shipping, location, Buy It Now price), behind an LRU+TTL cache
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from logs import get_logger
+from metrics import ITEM_DETAILS_CACHE
+
+log = get_logger(__name__)
+
+# Most item IDs the Browse API getItems call accepts
+GET_ITEMS_MAX_IDS = 20
+
+_MISSING = object()
+
+
+class ItemDetails:
+    """The fields the alerts use from a getItems entry"""
+
+    __slots__ = ("item_id", "buy_now_price", "current_bid", "currency", "shipping_cost", "shipping_currency",
+                 "shipping_type", "location")
+
+    def __init__(self, item_id, buy_now_price=None, current_bid=None, currency="GBP", shipping_cost=None,
+                 shipping_currency=None, shipping_type=None, location=None):
+        self.item_id = item_id
+        self.buy_now_price = buy_now_price
+        self.current_bid = current_bid
+        self.currency = currency
+        self.shipping_cost = shipping_cost
+        self.shipping_currency = shipping_currency
+        # FIXED or CALCULATED (at checkout, no cost known)
+        self.shipping_type = shipping_type
+        self.location = location
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build details from a decoded getItems entry"""
+        buying_options = data.get("buyingOptions") or ()
+        price = data.get("price") or {}
+        bid = data.get("currentBidPrice") or {}
+        # For auctions price is only the Buy It Now price if the listing has one
+        has_bin = "FIXED_PRICE" in buying_options or "AUCTION_WITH_BIN" in buying_options
+        options = data.get("shippingOptions") or [{}]
+        shipping = next((option for option in options if option.get("shippingCost")), options[0])
+        cost = shipping.get("shippingCost") or {}
+        location = data.get("itemLocation") or {}
+        place = ", ".join(part for part in (location.get("city"), location.get("country")) if part)
+        return cls(
+            str(data.get("itemId", "")),
+            buy_now_price=price.get("value") if has_bin else None,
+            current_bid=bid.get("value"),
+            currency=price.get("currency") or bid.get("currency") or "GBP",
+            shipping_cost=cost.get("value"),
+            shipping_currency=cost.get("currency"),
+            shipping_type=shipping.get("shippingCostType"),
+            location=place or None,
+        )
+
+    def describe_shipping(self):
+        """Shipping as shown in alerts, None if unknown"""
+        if self.shipping_cost is not None:
+            try:
+                if float(self.shipping_cost) == 0:
+                    return "Free"
+            except ValueError:
+                pass
+            return f"{self.shipping_cost} {self.shipping_currency or self.currency}"
+        if self.shipping_type == "CALCULATED":
+            return "Calculated at checkout"
+        return None
+
+    def __repr__(self):
+        return f"ItemDetails({self.item_id!r}, bin={self.buy_now_price}, shipping={self.describe_shipping()!r})"
+
+
+class TTLCache:
+    """Thread-safe mapping holding at most max_size entries, each for ttl seconds
+
+    The least recently used entry is dropped when full. Expired entries
+    are dropped when looked up.
+    """
+
+    def __init__(self, max_size, ttl, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= self.clock():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class ItemEnricher:
+    """Fetches ItemDetails for listings, GET_ITEMS_MAX_IDS per call and several calls at once
+
+    Details are cached per (marketplace, item ID) for cache_ttl seconds,
+    including the absence of details for listings eBay no longer returns,
+    so each listing costs at most one lookup per TTL. A failed call only
+    leaves its listings unenriched; alerts never wait on a retry. submit()
+    runs enrich() in the background, one call at a time, so the caller can
+    carry on searching meanwhile.
+    """
+
+    def __init__(self, ebay_api, cache_size=5000, cache_ttl=900, concurrency=4):
+        self.api = ebay_api
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="ebay-details")
+        # Separate from the batch executor so a queued enrich() never waits on its own batches
+        self._background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ebay-details-queue")
+
+    def _fetch(self, marketplace, item_ids):
+        """Fetch and cache one getItems batch, returns {item_id: ItemDetails}"""
+        try:
+            entries = self.api.get_items(item_ids, marketplace)
+        except Exception as e:
+            log.error(f"✗ Could not fetch details of {len(item_ids)} listing(s) on {marketplace}: {e}")
+            return {}
+        found = {}
+        for entry in entries:
+            details = ItemDetails.from_dict(entry)
+            found[details.item_id] = details
+        for item_id in item_ids:
+            self.cache.put((marketplace, item_id), found.get(item_id))
+        return found
+
+    def enrich(self, listings):
+        """ItemDetails of each listing that has them keyed by legacy ID, and the getItems calls made"""
+        details = {}
+        missing = {}
+        for listing in listings:
+            cached = self.cache.get((listing.marketplace, listing.item_id), _MISSING)
+            if cached is _MISSING:
+                missing.setdefault(listing.marketplace, {})[listing.item_id] = listing
+            elif cached is not None:
+                details[listing.legacy_id] = cached
+        hits = len(listings) - sum(len(wanted) for wanted in missing.values())
+        ITEM_DETAILS_CACHE.inc(hits, result="hit")
+        if not missing:
+            return details, 0
+
+        batches = []
+        for marketplace, wanted in missing.items():
+            ITEM_DETAILS_CACHE.inc(len(wanted), result="miss")
+            item_ids = list(wanted)
+            for start in range(0, len(item_ids), GET_ITEMS_MAX_IDS):
+                batches.append((marketplace, item_ids[start:start + GET_ITEMS_MAX_IDS]))
+        if len(batches) == 1:
+            fetched = [self._fetch(*batches[0])]
+        else:
+            fetched = list(self.executor.map(lambda batch: self._fetch(*batch), batches))
+
+        found_count = 0
+        for (marketplace, _), found in zip(batches, fetched):
+            for item_id, item_details in found.items():
+                listing = missing[marketplace].get(item_id)
+                if listing is not None:
+                    details[listing.legacy_id] = item_details
+                    found_count += 1
+        log.debug(f"Fetched details of {found_count} listing(s) in {len(batches)} call(s), {hits} cached")
+        return details, len(batches)
+
+    def submit(self, listings):
+        """Enrich listings in the background, returns a Future of enrich()'s result"""
+        return self._background.submit(self.enrich, listings)
+
+    def close(self):
+        self._background.shutdown(wait=False)
+        self.executor.shutdown(wait=False)
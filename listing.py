@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Listing Records
+Compact search result items and a streaming parser for Browse API search responses
+"""
+
+import codecs
+import json
+import re
+from marketplaces import DEFAULT_MARKETPLACE
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class Listing:
+    """The fields the monitor uses from one itemSummaries entry"""
+
+    __slots__ = (
+        "item_id", "legacy_id", "title", "price", "currency",
+        "buying_options", "seller", "listing_date", "condition_id", "marketplace"
+    )
+
+    def __init__(self, item_id, title="", price="", currency="GBP", buying_options=(),
+                 seller="", listing_date="", condition_id="", marketplace=DEFAULT_MARKETPLACE):
+        self.item_id = item_id
+        # Browse API IDs look like v1|<legacy ID>|<variation>
+        parts = item_id.split("|")
+        self.legacy_id = parts[1] if len(parts) > 1 else ""
+        self.title = title
+        self.price = price
+        self.currency = currency
+        self.buying_options = tuple(buying_options)
+        self.seller = seller
+        self.listing_date = listing_date
+        self.condition_id = condition_id
+        # The marketplace the listing was found on, which decides its link and currency
+        self.marketplace = marketplace
+
+    @classmethod
+    def from_dict(cls, data, marketplace=DEFAULT_MARKETPLACE):
+        """Build a listing from a decoded itemSummaries entry"""
+        # Filled in directly rather than through __init__, this runs for every search result
+        listing = cls.__new__(cls)
+        listing.item_id = item_id = str(data.get("itemId", ""))
+        parts = item_id.split("|")
+        listing.legacy_id = parts[1] if len(parts) > 1 else ""
+        listing.title = data.get("title", "")
+        price = data.get("price") or {}
+        listing.price = price.get("value", "")
+        listing.currency = price.get("currency", "GBP")
+        listing.buying_options = tuple(data.get("buyingOptions") or ())
+        listing.seller = (data.get("seller") or {}).get("username", "")
+        listing.listing_date = data.get("listingDate", "")
+        listing.condition_id = data.get("conditionId", "")
+        listing.marketplace = marketplace
+        return listing
+
+    def __eq__(self, other):
+        return isinstance(other, Listing) and self.item_id == other.item_id
+
+    def __hash__(self):
+        return hash(self.item_id)
+
+    def __repr__(self):
+        return f"Listing({self.item_id!r}, {self.title!r})"
+
+
+class _StreamDecoder:
+    """Decodes JSON values one at a time from an iterable of byte chunks
+
+    Only the value being decoded and the unread part of the current chunk
+    are held in memory.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._done = False
+
+    def _read_more(self):
+        """Append the next chunk to the buffer, returns False at the end of the stream"""
+        text = ""
+        for chunk in self._chunks:
+            text = self._utf8.decode(chunk)
+            if text:
+                break
+        else:
+            text = self._utf8.decode(b"", final=True)
+            self._done = True
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+        return bool(text)
+
+    def peek(self):
+        """Next non-whitespace character, or an empty string at the end of the stream"""
+        while True:
+            pos = self._pos
+            buffer = self._buffer
+            if pos < len(buffer) and buffer[pos] not in " \t\n\r":
+                return buffer[pos]
+            self._pos = pos = _WHITESPACE.match(buffer, pos).end()
+            if pos < len(buffer):
+                return buffer[pos]
+            if self._done or not self._read_more():
+                return ""
+
+    def expect(self, char):
+        """Consume the given structural character"""
+        if self.peek() != char:
+            raise ValueError(f"Malformed search response: expected {char!r} at offset {self._pos}")
+        self._pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value"""
+        self.peek()
+        scan = self._decoder.scan_once
+        while True:
+            try:
+                value, end = scan(self._buffer, self._pos)
+                # A number or literal running up to the end of the buffer may be cut short
+                if end < len(self._buffer) or self._done:
+                    self._pos = end
+                    return value
+            except (json.JSONDecodeError, StopIteration):
+                if self._done:
+                    raise ValueError(f"Malformed search response at offset {self._pos}") from None
+            self._read_more()
+
+
+def iter_search_items(chunks, meta=None, marketplace=DEFAULT_MARKETPLACE):
+    """Yield a Listing for each itemSummaries entry of a search response as it is read
+
+    chunks is an iterable of response body bytes. Entries are decoded one at
+    a time and reduced to a Listing, so a full page is never held as nested
+    dicts. Other top-level fields (total, next, ...) are stored in meta if
+    given, otherwise discarded. Listings are tagged with the marketplace
+    that was searched.
+    """
+    stream = _StreamDecoder(chunks)
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+
+    while True:
+        key = stream.value()
+        stream.expect(":")
+        if key == "itemSummaries":
+            stream.expect("[")
+            if stream.peek() != "]":
+                while True:
+                    yield Listing.from_dict(stream.value(), marketplace)
+                    if stream.peek() != ",":
+                        break
+                    stream.expect(",")
+            stream.expect("]")
+        else:
+            value = stream.value()
+            if meta is not None:
+                meta[key] = value
+        if stream.peek() != ",":
+            break
+        stream.expect(",")
+    stream.expect("}")
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Logging Setup
+Routes monitor output through levelled logging, as plain text or JSON lines
+"""
+
+import json
+import logging
+import sys
+import time
+from config import LOG_MODE, LOG_LEVEL
+
+ROOT_LOGGER = "ebay_monitor"
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """Writes to whatever sys.stdout currently is, so redirection keeps working"""
+
+    def __init__(self):
+        super().__init__()
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, including any fields passed via extra"""
+
+    _RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage().strip(),
+        }
+        for key, value in vars(record).items():
+            if key not in self._RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(mode=LOG_MODE, level=LOG_LEVEL):
+    """Set how monitor output is written
+
+    "print" writes bare messages to stdout like the original print calls,
+    "structured" writes JSON lines. Messages below level are dropped, so
+    LOG_LEVEL = "WARNING" silences routine progress output.
+    """
+    logger = logging.getLogger(ROOT_LOGGER)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+    handler = _StdoutHandler()
+    if mode == "structured":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
+
+
+def get_logger(name):
+    """Logger for a monitor module"""
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+configure_logging()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+eBay Marketplaces
+Site domains and currencies of the marketplaces the Browse API can search
+"""
+
+DEFAULT_MARKETPLACE = "EBAY_GB"
+
+# X-EBAY-C-MARKETPLACE-ID -> (site domain, listing currency)
+MARKETPLACES = {
+    "EBAY_GB": ("www.ebay.co.uk", "GBP"),
+    "EBAY_US": ("www.ebay.com", "USD"),
+    "EBAY_DE": ("www.ebay.de", "EUR"),
+    "EBAY_FR": ("www.ebay.fr", "EUR"),
+    "EBAY_IT": ("www.ebay.it", "EUR"),
+    "EBAY_ES": ("www.ebay.es", "EUR"),
+    "EBAY_IE": ("www.ebay.ie", "EUR"),
+    "EBAY_AT": ("www.ebay.at", "EUR"),
+    "EBAY_NL": ("www.ebay.nl", "EUR"),
+    "EBAY_BE": ("www.befr.ebay.be", "EUR"),
+    "EBAY_CH": ("www.ebay.ch", "CHF"),
+    "EBAY_PL": ("www.ebay.pl", "PLN"),
+    "EBAY_AU": ("www.ebay.com.au", "AUD"),
+    "EBAY_CA": ("www.ebay.ca", "CAD"),
+    "EBAY_HK": ("www.ebay.com.hk", "HKD"),
+    "EBAY_SG": ("www.ebay.com.sg", "SGD"),
+}
+
+
+def validate_marketplace(marketplace):
+    """Return a marketplace ID in canonical form, raises ValueError for unknown ones"""
+    marketplace = str(marketplace).upper()
+    if marketplace not in MARKETPLACES:
+        raise ValueError(f"Unknown eBay marketplace '{marketplace}', expected one of {', '.join(MARKETPLACES)}")
+    return marketplace
+
+
+def marketplace_currency(marketplace):
+    """Currency prices are shown in on a marketplace"""
+    return MARKETPLACES.get(marketplace, MARKETPLACES[DEFAULT_MARKETPLACE])[1]
+
+
+def item_url(legacy_id, marketplace=DEFAULT_MARKETPLACE):
+    """Link to a listing on the given marketplace's site"""
+    domain = MARKETPLACES.get(marketplace, MARKETPLACES[DEFAULT_MARKETPLACE])[0]
+    return f"https://{domain}/itm/{legacy_id}"
@@ -4,53 +4,167 @@ Message Handler
 Handles message formatting and item tracking
 """
 
-import os
 from datetime import datetime
-from config import ITEMS_FILE, CHAT_IDS, TELEGRAM_API_KEY
-import requests
+from ebay_api import create_transport
+from config import (
+    ITEMS_FILE, CHAT_IDS, TELEGRAM_API_KEY, TELEGRAM_API_URL,
+    SEEN_STORE_BACKEND, SEEN_ITEMS_DB, SEEN_ITEM_TTL, SEEN_STORE_FSYNC_EVERY,
+    NOTIFY_WORKERS, NOTIFY_QUEUE_SIZE, NOTIFY_MAX_RETRIES, TELEGRAM_CHAT_RATE, TELEGRAM_GLOBAL_RATE,
+    OUTBOX_DB, OUTBOX_FAILED_TTL, DIGEST_WINDOW, DIGEST_MAX_ITEMS, DEAL_PRIORITY_SCORE
+)
+from logs import get_logger
+from marketplaces import item_url
+from metrics import NOTIFY_QUEUE_DEPTH
+from notifier import TelegramNotifier
+from outbox import Outbox
+from seen_store import create_seen_store
+
+log = get_logger(__name__)
 
 
 class MessageHandler:
     """Handles message formatting and item tracking"""
     
-    def __init__(self):
+    def __init__(self, owner="", transport=None):
         self.items_file = ITEMS_FILE
+        self.seen_store = create_seen_store(
+            SEEN_STORE_BACKEND, ITEMS_FILE,
+            db_file=SEEN_ITEMS_DB, ttl=SEEN_ITEM_TTL, fsync_every=SEEN_STORE_FSYNC_EVERY
+        )
+        self.outbox = Outbox(OUTBOX_DB, owner=owner)
         self.telegram_enabled = self._check_telegram_config()
+        # A transport passed in is shared with the eBay client and closed by its owner
+        self._own_transport = transport is None
+        self.transport = transport or create_transport(NOTIFY_WORKERS)
+        self.notifier = None
         
     def _check_telegram_config(self):
         """Check if Telegram is properly configured"""
         if not TELEGRAM_API_KEY or TELEGRAM_API_KEY == "your_telegram_bot_token_here":
-            print("⚠️  Warning: TELEGRAM_API_KEY not properly configured")
-            print("   Set TELEGRAM_API_KEY in config.py or as environment variable")
-            print("   Telegram notifications will be disabled")
+            log.warning("⚠️  Warning: TELEGRAM_API_KEY not properly configured")
+            log.warning("   Set TELEGRAM_API_KEY in config.py or as environment variable")
+            log.warning("   Telegram notifications will be disabled")
             return False
         else:
-            print(f"✓ Telegram configured with token: {TELEGRAM_API_KEY[:10]}...")
-            print(f"✓ Will send messages to {len(CHAT_IDS)} chat(s): {CHAT_IDS}")
+            log.info(f"✓ Telegram configured with token: {TELEGRAM_API_KEY[:10]}...")
+            log.info(f"✓ Will send messages to {len(CHAT_IDS)} chat(s): {CHAT_IDS}")
             return True
     
     def read_processed_items(self):
         """Read list of processed item IDs"""
-        if not os.path.exists(self.items_file):
-            open(self.items_file, "w").close()
-        return open(self.items_file).read().splitlines()
+        return list(self.seen_store)
     
     def add_processed_item(self, item_id):
         """Add item ID to processed items list"""
-        items = self.read_processed_items()
-        if item_id not in items:
-            items.append(item_id)
-            with open(self.items_file, 'w') as f:
-                f.write('\n'.join(items))
-            print(f"✓ Added item {item_id} to processed items")
+        if self.seen_store.add(item_id):
+            log.info(f"✓ Added item {item_id} to processed items")
     
     def is_item_processed(self, item_id):
         """Check if item has been processed before"""
-        return item_id in self.read_processed_items()
+        return item_id in self.seen_store
+    
+    def is_item_pending(self, item_id):
+        """Check if an item is waiting for delivery or was given up on"""
+        if self.notifier is not None and self.notifier.is_pending(item_id):
+            return True
+        return item_id in self.outbox
+    
+    def start_notifier(self):
+        """Start background Telegram delivery and replay alerts left in the outbox"""
+        if not self.telegram_enabled or self.notifier is not None:
+            return
+        
+        self.notifier = TelegramNotifier(
+            TELEGRAM_API_KEY, CHAT_IDS,
+            on_delivered=self._on_delivered,
+            on_sent=self.outbox.mark_sent,
+            on_failed=self.outbox.mark_failed,
+            workers=NOTIFY_WORKERS,
+            queue_size=NOTIFY_QUEUE_SIZE,
+            max_retries=NOTIFY_MAX_RETRIES,
+            chat_rate=TELEGRAM_CHAT_RATE,
+            global_rate=TELEGRAM_GLOBAL_RATE,
+            base_url=TELEGRAM_API_URL,
+            transport=self.transport,
+            digest_window=DIGEST_WINDOW,
+            digest_max_items=DIGEST_MAX_ITEMS
+        )
+        NOTIFY_QUEUE_DEPTH.set_function(lambda: len(self.notifier) if self.notifier else 0)
+        log.info(f"✓ Started {NOTIFY_WORKERS} Telegram delivery worker(s)")
+        
+        self._replay_outbox()
+    
+    def _replay_outbox(self):
+        """Queue the unsent alerts this handler owns in the outbox"""
+        # Finish items whose delivery completed just before a crash
+        for item_id in self.outbox.finished():
+            self.add_processed_item(item_id)
+            self.outbox.complete(item_id)
+        
+        pending = self.outbox.pending()
+        if pending:
+            log.info(f"📤 Replaying {len(pending)} unsent alert(s) from the outbox...")
+        for item_id, message, chat_ids, group in pending:
+            # Items already queued here are skipped by submit
+            self.notifier.submit(item_id, message, chat_ids=chat_ids, group=group)
+    
+    def adopt_orphans(self, alive_owners):
+        """Deliver alerts left in a shared outbox by workers that are no longer running"""
+        if self.notifier is None:
+            return
+        claimed = self.outbox.claim_orphans(alive_owners)
+        if claimed:
+            log.info(f"📥 Took over {claimed} alert(s) from stopped workers")
+            self._replay_outbox()
+    
+    def _on_delivered(self, item_id, delivered):
+        """Mark an item processed once its alert has been delivered"""
+        if delivered:
+            self.add_processed_item(item_id)
+        self.outbox.complete(item_id)
     
-    def format_message(self, item):
-        """Format item data into Telegram message"""
-        link = f"https://www.ebay.co.uk/itm/{item['item_id']}"
+    def queue_telegram_message(self, item_id, message, group=None):
+        """Queue an alert for background delivery, the item is marked processed once sent
+        
+        The alert is written to the outbox first so it is replayed if the
+        monitor stops before it is delivered. Alerts sharing a group (the
+        subscription that wants them) may be delivered together as a digest.
+        """
+        if not self.telegram_enabled:
+            log.error("✗ Telegram not configured. Cannot send message.")
+            return False
+        if self.notifier is None:
+            # No background workers: deliver inline
+            if self.send_telegram_message(message):
+                self.add_processed_item(item_id)
+                return True
+            return False
+        if not self.outbox.add(item_id, message, CHAT_IDS, group):
+            log.info(f"Item {item_id} already in the outbox, skipping...")
+            return False
+        return self.notifier.submit(item_id, message, group=group)
+    
+    def checkpoint(self):
+        """Make processed items recorded so far durable and prune long-failed alerts from the outbox"""
+        self.seen_store.flush()
+        if OUTBOX_FAILED_TTL is not None:
+            pruned = self.outbox.prune_failed(OUTBOX_FAILED_TTL)
+            if pruned:
+                log.info(f"🧹 Pruned {pruned} undeliverable alert(s) from the outbox")
+    
+    def close(self, timeout=30):
+        """Drain pending alerts for up to timeout seconds and flush processed items to disk"""
+        if self.notifier:
+            self.notifier.stop(timeout)
+            self.notifier = None
+        if self._own_transport:
+            self.transport.close()
+        self.outbox.close()
+        self.seen_store.close()
+    
+    def format_message(self, item, deal=None):
+        """Format item data into Telegram message, with how its price compares to the market if scored"""
+        link = item.get("link") or item_url(item["item_id"])
         title = item["title"]
         auc = item.get("auction_price")
         bin_price = item.get("buy_now_price")
@@ -63,10 +177,10 @@ class MessageHandler:
                 dt = datetime.fromisoformat(item["listing_time"].replace("Z", "+00:00"))
                 listing_time = dt.strftime("%I:%M %p %d/%m")
             except Exception as e:
-                print(f"Warning: Could not parse listing time: {e}")
+                log.warning(f"Warning: Could not parse listing time: {e}")
                 listing_time = item["listing_time"]
         
-        print(f"Formatting message for: {listing_time} - {title}")
+        log.debug(f"Formatting message for: {listing_time} - {title}")
         
         # Build message list
         message_list = [title, link]
@@ -77,36 +191,57 @@ class MessageHandler:
             message_list.append(f'BIN: {bin_price}')
         if item["best_offer_enabled"]:
             message_list.append("Best Offer Allowed")
+        if item.get("shipping"):
+            message_list.append(f"Shipping: {item['shipping']}")
+        if item.get("location"):
+            message_list.append(f"Location: {item['location']}")
         if listing_time:
             message_list.append(listing_time)
+        if deal is not None:
+            if DEAL_PRIORITY_SCORE is not None and deal.score >= DEAL_PRIORITY_SCORE:
+                message_list.insert(0, f"🔥 Deal: {deal.describe()}")
+            else:
+                message_list.append(f"Market: {deal.describe()}")
         
         return '\n'.join(message_list)
     
+    def format_price_drop(self, item, drop, median=None):
+        """Format a re-alert for a listing whose price fell"""
+        currency = drop.listing.currency
+        message_list = [
+            f"📉 Price drop -{drop.percent:.0f}%: {drop.old_price:.2f} → {drop.new_price:.2f} {currency}",
+            item["title"],
+            item.get("link") or item_url(item["item_id"])
+        ]
+        if median is not None:
+            message_list.append(f"Median for '{drop.query}': {median:.2f} {currency}")
+        return '\n'.join(message_list)
+    
     def send_telegram_message(self, message):
         """Send message to Telegram"""
         if not self.telegram_enabled:
-            print("✗ Telegram not configured. Cannot send message.")
+            log.error("✗ Telegram not configured. Cannot send message.")
             return False
         
-        print(f"📤 Sending message to {len(CHAT_IDS)} chat(s)...")
+        log.info(f"📤 Sending message to {len(CHAT_IDS)} chat(s)...")
         success_count = 0
         for chat_id in CHAT_IDS:
             try:
-                url = f'https://api.telegram.org/bot{TELEGRAM_API_KEY}/sendMessage'
+                url = f'{TELEGRAM_API_URL}/bot{TELEGRAM_API_KEY}/sendMessage'
                 data = {'chat_id': chat_id, 'text': message}
                 
-                response = requests.post(url, data=data)
+                response = self.transport.post(url, endpoint="telegram_send", data=data)
                 response.raise_for_status()
                 
-                print(f"✓ Message sent to chat {chat_id}")
+                log.info(f"✓ Message sent to chat {chat_id}")
                 success_count += 1
                 
             except Exception as e:
-                print(f"✗ Failed to send message to chat {chat_id}: {e}")
+                log.error(f"✗ Failed to send message to chat {chat_id}: {e}")
         
         if success_count > 0:
-            print(f"✓ Successfully sent to {success_count}/{len(CHAT_IDS)} chat(s)")
+            log.info(f"✓ Successfully sent to {success_count}/{len(CHAT_IDS)} chat(s)")
         else:
-            print("✗ Failed to send to any chats")
+            log.error("✗ Failed to send to any chats")
         
         return success_count > 0 
\ No newline at end of file
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Metrics
+Counters, gauges and histograms exposed as Prometheus text and JSON
+"""
+
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LAG_BUCKETS = (5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 21600)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """Base class for a named metric with optional labels"""
+
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def samples(self):
+        """(suffix, label values, extra label, value) tuples for rendering"""
+        with self._lock:
+            return [("", key, None, value) for key, value in self._values.items()]
+
+    def to_dict(self):
+        with self._lock:
+            return [
+                {"labels": dict(zip(self.label_names, key)), "value": value}
+                for key, value in self._values.items()
+            ]
+
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """Value that can go up and down, or be read from a callback when collected"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function, **labels):
+        """Read the value from function() every time metrics are collected"""
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def _collect(self):
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, function in functions.items():
+            try:
+                values[key] = function()
+            except Exception:
+                pass
+        return values
+
+    def samples(self):
+        return [("", key, None, value) for key, value in self._collect().items()]
+
+    def to_dict(self):
+        return [
+            {"labels": dict(zip(self.label_names, key)), "value": value}
+            for key, value in self._collect().items()
+        ]
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the with block takes"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            snapshot = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        rows = []
+        for key, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                rows.append(("_bucket", key, f'le="{le}"', cumulative))
+            rows.append(("_sum", key, None, total))
+            rows.append(("_count", key, None, count))
+        return rows
+
+    def to_dict(self):
+        with self._lock:
+            snapshot = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        rows = []
+        for key, counts, total, count in snapshot:
+            rows.append({
+                "labels": dict(zip(self.label_names, key)),
+                "count": count,
+                "sum": total,
+                "mean": total / count if count else None,
+                "buckets": {str(bound): n for bound, n in zip(self.buckets + ("+Inf",), counts)},
+            })
+        return rows
+
+
+class MetricsRegistry:
+    """Holds every metric, created on first use"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, labels, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, labels, **kwargs)
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=()):
+        return self._get(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def render_prometheus(self):
+        """Metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, key, extra, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(metric.label_names, key, extra)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            metric.name: {"type": metric.kind, "help": metric.help, "samples": metric.to_dict()}
+            for metric in metrics
+        }
+
+    def dump_json(self, path=None):
+        """Metrics as a JSON string, also written to path if given"""
+        text = json.dumps(self.to_dict(), indent=2, default=str)
+        if path:
+            with open(path, "w") as f:
+                f.write(text)
+        return text
+
+
+REGISTRY = MetricsRegistry()
+
+
+class MetricsServer:
+    """Local HTTP endpoint serving /metrics (Prometheus text) and /metrics.json
+
+    Further routes can be added with add_route(path, handler), where handler
+    returns (status, content_type, body).
+    """
+
+    def __init__(self, host="127.0.0.1", port=9108, registry=REGISTRY):
+        self.registry = registry
+        self.routes = {
+            "/metrics": lambda: (200, "text/plain; version=0.0.4", registry.render_prometheus()),
+            "/metrics.json": lambda: (200, "application/json", registry.dump_json()),
+        }
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    def add_route(self, path, handler):
+        self.routes[path] = handler
+
+    def _handler_class(self):
+        routes = self.routes
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                route = routes.get(self.path.split("?")[0])
+                if route is None:
+                    status, content_type, body = 404, "text/plain", "not found\n"
+                else:
+                    status, content_type, body = route()
+                payload = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+    @property
+    def port(self):
+        return self.server.server_port
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# Metrics recorded by the monitor
+API_REQUEST_SECONDS = REGISTRY.histogram(
+    "ebay_monitor_api_request_seconds", "HTTP request latency by endpoint", ("endpoint",)
+)
+API_REQUESTS = REGISTRY.counter(
+    "ebay_monitor_api_requests_total", "HTTP requests by endpoint and status", ("endpoint", "status")
+)
+TOKEN_REFRESHES = REGISTRY.counter(
+    "ebay_monitor_token_refreshes_total", "eBay OAuth token requests", ("outcome",)
+)
+ITEMS_FETCHED = REGISTRY.counter(
+    "ebay_monitor_items_fetched_total", "Listings returned by eBay per query", ("query",)
+)
+ITEMS_FILTERED = REGISTRY.counter(
+    "ebay_monitor_items_filtered_total", "Listings dropped before alerting per query", ("query", "reason")
+)
+ITEMS_NEW = REGISTRY.counter(
+    "ebay_monitor_items_new_total", "Listings queued for alerting per query", ("query",)
+)
+PRICE_DROPS = REGISTRY.counter(
+    "ebay_monitor_price_drops_total", "Price drop re-alerts queued per query", ("query",)
+)
+ITEM_DETAILS_CACHE = REGISTRY.counter(
+    "ebay_monitor_item_details_cache_total", "Item detail lookups by cache result (hit, miss)", ("result",)
+)
+DEDUP_CHECKS = REGISTRY.counter(
+    "ebay_monitor_dedup_checks_total", "Seen-item lookups by result (new, processed, pending)", ("result",)
+)
+POLLS = REGISTRY.counter(
+    "ebay_monitor_polls_total", "Scheduled searches by outcome", ("outcome",)
+)
+NOTIFY_QUEUE_DEPTH = REGISTRY.gauge(
+    "ebay_monitor_notify_queue_depth", "Alerts waiting for Telegram delivery"
+)
+ALERTS_COALESCED = REGISTRY.counter(
+    "ebay_monitor_alerts_coalesced_total", "Alerts sent as part of a digest message"
+)
+HTTP_RETRIES = REGISTRY.counter(
+    "ebay_monitor_http_retries_total", "HTTP requests retried by endpoint and reason", ("endpoint", "reason")
+)
+CIRCUIT_STATE = REGISTRY.gauge(
+    "ebay_monitor_circuit_state", "Circuit breaker state per host (0 closed, 1 half-open, 2 open)", ("host",)
+)
+DETECTION_LAG = REGISTRY.histogram(
+    "ebay_monitor_detection_lag_seconds", "Time from eBay listing to alert being queued", buckets=LAG_BUCKETS
+)
+
+
+@contextmanager
+def track_request(endpoint):
+    """Time an HTTP call and count it by status, the block may set box['status']"""
+    box = {"status": "ok"}
+    start = time.perf_counter()
+    try:
+        yield box
+    except Exception as e:
+        response = getattr(e, "response", None)
+        box["status"] = str(response.status_code) if response is not None else type(e).__name__
+        raise
+    finally:
+        API_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+        API_REQUESTS.inc(endpoint=endpoint, status=box["status"])
@@ -4,121 +4,803 @@ eBay Listing Monitor
 Main script that monitors eBay listings and sends notifications
 """
 
+import argparse
+import asyncio
+import cProfile
+import io
+import multiprocessing
+import os
+import pstats
+import tempfile
 import time
+import tracemalloc
 import sys
-from ebay_api import EbayAPI, parse_ebay_item
+from datetime import datetime
+from ebay_api import EbayAPI, AsyncEbayAPI, create_transport, parse_ebay_item
 from message_handler import MessageHandler
-from config import KEYWORDS, EXCLUDED_SELLERS, CATEGORY_ID, MAX_TOTAL_RESULTS, DELAY, SEARCH_DELAY, API_RATE_LIMIT_DELAY
+from deals import DealScorer
+from filters import FilterRule
+from item_details import ItemEnricher
+from price_history import PriceHistory
+from sharding import ShardMembership, SqliteWorkerRegistry, default_worker_id
+from watermarks import create_watermark_store
+from scheduler import PollScheduler
+from service import GracefulShutdown, HealthStatus, StateCheckpoint
+from query_planner import QueryPlanner, Subscription
+from subscriptions import SubscriptionFile
+from traffic import ReplayClock, TrafficRecorder, TrafficReplay
+from logs import get_logger
+from metrics import REGISTRY, MetricsServer, DEDUP_CHECKS, DETECTION_LAG, ITEMS_FILTERED, ITEMS_NEW, POLLS, PRICE_DROPS
+from config import (
+    KEYWORDS, EXCLUDED_SELLERS, CATEGORY_ID, MAX_TOTAL_RESULTS, DELAY, SEARCH_DELAY, API_RATE_LIMIT_DELAY,
+    SEARCH_MODE, MAX_CONCURRENT_SEARCHES, SEARCH_RATE_LIMIT, SEARCH_BATCH_MODE, WATERMARKS_FILE,
+    DAILY_CALL_BUDGET, MIN_POLL_INTERVAL, MAX_POLL_INTERVAL, POLL_RATE_ALPHA, SCHEDULE_REPORT_INTERVAL,
+    COALESCE_QUERIES, METRICS_HOST, METRICS_PORT, METRICS_DUMP_FILE,
+    SHARD_DB, SHARD_WORKERS, SHARD_HEARTBEAT_INTERVAL, SHARD_DEAD_AFTER,
+    SEEN_STORE_BACKEND, WATERMARKS_DB, KEYWORD_FILTERS, SUBSCRIPTIONS_FILE, SUBSCRIPTIONS_CHECK_INTERVAL,
+    NOTIFY_WORKERS, EBAY_MARKETPLACES, PRICE_HISTORY_DB, PRICE_DROP_PERCENT, PRICE_HISTORY_DAYS, PRICE_SWEEP_INTERVAL,
+    DEAL_WINDOW, DEAL_MIN_SAMPLES, DEAL_MIN_SCORE, DEAL_PRIORITY_SCORE,
+    STATE_FILE, CHECKPOINT_INTERVAL, SHUTDOWN_DRAIN_TIMEOUT, HEALTH_STALL_TIMEOUT,
+    ENRICH_ITEMS, ENRICH_CACHE_SIZE, ENRICH_CACHE_TTL, ENRICH_CONCURRENCY
+)
 
+log = get_logger("monitor")
 
-def main():
-    """Main monitoring loop"""
+
+def describe_ids(ids):
+    """One or several configured IDs as text"""
+    return ids if isinstance(ids, str) else ", ".join(ids)
+
+
+def observe_detection_lag(item):
+    """Record how long after listing an item was picked up"""
+    if not item.get("listing_time"):
+        return
+    try:
+        listed = datetime.fromisoformat(item["listing_time"].replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return
+    DETECTION_LAG.observe(max(0.0, time.time() - listed))
+
+
+def handle_item(item_data, message_handler, group=None, deal=None, details=None):
+    """Parse, deduplicate and alert on a single listing, group lets its alert join a digest"""
+    # Parse the item
+    item = parse_ebay_item(item_data, details)
+    item_id = item['item_id']
+    
+    log.debug(f"Found item: {item['title']}")
+    log.debug(f"Item ID: {item_id}")
+    
+    # Check if already processed
+    if message_handler.is_item_processed(item_id):
+        DEDUP_CHECKS.inc(result="processed")
+        log.debug(f"Item {item_id} already processed, skipping...")
+        return False
+    if message_handler.is_item_pending(item_id):
+        DEDUP_CHECKS.inc(result="pending")
+        log.debug(f"Item {item_id} already queued, skipping...")
+        return False
+    DEDUP_CHECKS.inc(result="new")
+    observe_detection_lag(item)
+    
+    # Format and send message
+    message = message_handler.format_message(item, deal)
+    log.debug(f"Generated message:\n{message}")
+    
+    # Queue for Telegram, the item is marked processed once delivered
+    if not message_handler.queue_telegram_message(item_id, message, group):
+        log.error("✗ Failed to queue message")
+    return True
+
+
+def unseen_items(items, message_handler):
+    """The items neither alerted nor queued for alerting yet"""
+    return [
+        item for item in items
+        if not message_handler.is_item_processed(item.legacy_id) and not message_handler.is_item_pending(item.legacy_id)
+    ]
+
+
+def score_deals(deal_scorer, query, items, message_handler):
+    """Score the new items of a search against the market of each subscription wanting them
+    
+    Items already alerted or queued are left out so repeated results don't
+    skew the rolling prices. Returns {item: best Deal} for scored items.
+    """
+    fresh = unseen_items(items, message_handler)
+    # Subscriptions with the same keywords and scope see the same market
+    markets = {}
+    for subscription, wanted in query.route(fresh).items():
+        markets.setdefault(subscription.key, {}).update(dict.fromkeys(wanted))
+    
+    deals = {}
+    for key, wanted in markets.items():
+        wanted = list(wanted)
+        for item, deal in zip(wanted, deal_scorer.score(key, wanted)):
+            if deal is not None and (item not in deals or deal.score > deals[item].score):
+                deals[item] = deal
+    return deals
+
+
+def is_priority_deal(deal):
+    return deal is not None and DEAL_PRIORITY_SCORE is not None and deal.score >= DEAL_PRIORITY_SCORE
+
+
+def select_alerts(query, result, message_handler, deal_scorer=None, price_history=None):
+    """Pick the items of one planned search's result to alert on, returns (alerts, skipped)
+    
+    The result is a single item in single-item mode, or a newest-first list
+    of new items in batch mode. Only items wanted by one of the query's
+    subscriptions are alerted. With a deal_scorer, items priced too far
+    above their market are skipped, and marked in the price_history if
+    there is one so their price drops aren't re-alerted, and the best deals
+    are alerted first. alerts is a list of (item, deal) pairs in alert order, skipped the
+    number of items left out for their deal score.
+    """
+    if not result:
+        log.info(f"No valid items found for keyword: {query.keywords}")
+        return [], 0
+    
+    result = result if isinstance(result, list) else [result]
+    items = query.matching_items(result)
+    if len(items) < len(result):
+        ITEMS_FILTERED.inc(len(result) - len(items), query=query.keywords, reason="subscription_match")
+    deals = score_deals(deal_scorer, query, items, message_handler) if deal_scorer else {}
+    
+    # Alert oldest first so messages arrive in listing order
+    alerts = []
+    skipped = []
+    for item_data in reversed(items):
+        deal = deals.get(item_data) if deals else None
+        if deal is not None and DEAL_MIN_SCORE is not None and deal.score < DEAL_MIN_SCORE:
+            log.info(f"Skipping '{item_data.title}', priced {deal.describe()}")
+            ITEMS_FILTERED.inc(query=query.keywords, reason="deal_score")
+            # Marked processed so later polls treat it as seen
+            message_handler.add_processed_item(item_data.legacy_id)
+            skipped.append(item_data)
+            continue
+        alerts.append((item_data, deal))
+    if skipped and price_history is not None:
+        price_history.record_skipped(query.keywords, skipped)
+    # Stable sort: priority deals first, each group still oldest first
+    alerts.sort(key=lambda alert: not is_priority_deal(alert[1]))
+    return alerts, len(skipped)
+
+
+def alert_group(query, item):
+    """The digest an item's alert may join: one per subscription wanting it, sent per chat by the notifier"""
+    subscription = query.subscription_for(item)
+    return subscription.keywords if subscription is not None else query.keywords
+
+
+def send_alerts(query, alerts, message_handler, details=None):
+    """Alert on the (item, deal) pairs select_alerts picked, returns the number of new items
+    
+    Priority deals bypass the digest window. details maps legacy IDs to
+    the ItemDetails shown in their alerts.
+    """
+    details = details or {}
+    new_count = 0
+    for item_data, deal in alerts:
+        group = None if is_priority_deal(deal) else alert_group(query, item_data)
+        if handle_item(item_data, message_handler, group, deal, details.get(item_data.legacy_id)):
+            new_count += 1
+    ITEMS_NEW.inc(new_count, query=query.keywords)
+    return new_count
+
+
+def alert_listings(alerts, message_handler):
+    """The listings among (item, deal) pairs still to be alerted, each once"""
+    return unseen_items(list(dict.fromkeys(item_data for item_data, _ in alerts)), message_handler)
+
+
+def handle_price_drops(price_history, queries, message_handler):
+    """Re-alert on listings already alerted whose price has since dropped
+    
+    A drop is only alerted while one of the searches that found the listing
+    still wants it. Returns the number of re-alerts queued.
+    """
+    queued = 0
+    for drop in price_history.take_drops():
+        listing = drop.listing
+        if not message_handler.is_item_processed(listing.legacy_id):
+            # Never alerted: filtered out, or its first alert is still pending
+            continue
+        query = next(
+            (query for query in queries if query.keywords == drop.query and query.subscription_for(listing)), None
+        )
+        if query is None:
+            continue
+        # Each drop is its own alert, deduplicated and replayed like a new listing
+        alert_id = f"{listing.legacy_id}-drop-{drop.new_price:.2f}"
+        if message_handler.is_item_processed(alert_id) or message_handler.is_item_pending(alert_id):
+            continue
+        
+        stats = price_history.percentiles((0.5,), query=drop.query).get((drop.query, listing.currency))
+        median = stats[1][0] if stats else None
+        message = message_handler.format_price_drop(parse_ebay_item(listing), drop, median)
+        log.info(f"📉 '{listing.title}' dropped {drop.percent:.0f}% to {drop.new_price:.2f} {listing.currency}")
+        if message_handler.queue_telegram_message(alert_id, message, alert_group(query, listing)):
+            PRICE_DROPS.inc(query=drop.query)
+            queued += 1
+    return queued
+
+
+def describe_query(query):
+    """Log how a planned search is shared and filtered"""
+    if len(query.routes) > 1:
+        log.info(f"   '{query.keywords}' serves: {', '.join(s.keywords for s in query.subscriptions)}")
+    if len(query.targets) > 1:
+        log.info(f"   '{query.keywords}' searches categories {', '.join(query.category_ids)} "
+                 f"on {', '.join(query.marketplaces)}")
+    if query.api_filter():
+        log.info(f"   '{query.keywords}' eBay filter: {query.api_filter()}")
+
+
+def search_query(ebay_api, query, message_handler):
+    """Run the configured search for one planned query on each of its marketplaces and categories"""
+    return ebay_api.search_targets(
+        query.keywords,
+        query.targets,
+        EXCLUDED_SELLERS,
+        MAX_TOTAL_RESULTS,
+        batch=SEARCH_BATCH_MODE,
+        is_seen=message_handler.is_item_processed,
+        api_rule=query.api_rule
+    )
+
+
+def poll_calls(ebay_api, query):
+    """eBay API calls the last poll of a planned query made"""
+    if not SEARCH_BATCH_MODE:
+        return len(query.targets)
+    return sum(
+        ebay_api.last_call_counts.get((query.keywords, category_id, marketplace), 1)
+        for marketplace, category_id in query.targets
+    )
+
+
+def run_polls(ebay_api, queries, message_handler, deal_scorer=None, sleep=time.sleep, shutdown=None, enricher=None):
+    """Run the given planned queries one at a time, returns (query key, new item count, getItems calls) triples
+    
+    The count is None when the search failed. Once shutdown (a
+    GracefulShutdown) is requested the remaining queries are left unpolled.
+    With an enricher, the details of a search's alerts are fetched in the
+    background while the next searches run, and its alerts are queued as
+    soon as they arrive.
+    """
+    results = []
+    enriching = []  # (query, alerts, skipped, future of their details)
+    
+    def send_enriched(wait=False):
+        """Queue the alerts whose details have arrived, or all of them with wait"""
+        for entry in list(enriching):
+            query, alerts, skipped, future = entry
+            if not wait and not future.done():
+                continue
+            enriching.remove(entry)
+            try:
+                details, calls = future.result()
+                results.append((query.key, send_alerts(query, alerts, message_handler, details) + skipped, calls))
+            except Exception as e:
+                log.exception(f"✗ Error processing keyword '{query.keywords}': {e}")
+                results.append((query.key, None, 0))
     
-    print("🚀 Starting eBay Listing Monitor")
-    print("=" * 50)
+    for i, query in enumerate(queries):
+        send_enriched()
+        if shutdown is not None and shutdown.requested:
+            log.info(f"Skipping {len(queries) - i} remaining search(es) to shut down")
+            break
+        log.info(f"\n🔍 Searching for: {query.keywords}")
+        
+        try:
+            # Search for listings
+            result = search_query(ebay_api, query, message_handler)
+            alerts, skipped = select_alerts(query, result, message_handler, deal_scorer, ebay_api.history)
+            listings = alert_listings(alerts, message_handler) if enricher is not None else None
+            if listings:
+                enriching.append((query, alerts, skipped, enricher.submit(listings)))
+            else:
+                # Skipped listings still count as activity for the poll schedule
+                results.append((query.key, send_alerts(query, alerts, message_handler) + skipped, 0))
+        
+        except Exception as e:
+            log.exception(f"✗ Error processing keyword '{query.keywords}': {e}")
+            results.append((query.key, None, 0))
+        
+        # Delay between searches
+        if i < len(queries) - 1:  # Don't delay after the last keyword
+            log.debug(f"Waiting {SEARCH_DELAY} seconds before next search...")
+            sleep(SEARCH_DELAY)
+    send_enriched(wait=True)
+    return results
+
+
+async def run_async_polls(async_api, queries, message_handler, deal_scorer=None, enricher=None):
+    """Run the given planned queries concurrently, returns (query key, new item count, getItems calls) triples
+    
+    With an enricher, the details of the items every query is about to
+    alert on are fetched together once all searches are done, and the calls
+    are shared among the queries by how many of the listings each wanted.
+    """
+    log.info(f"\n🔍 Searching {len(queries)} keywords concurrently...")
+    results = await async_api.search_many(
+        [(query.keywords, query.targets, query.api_rule) for query in queries], EXCLUDED_SELLERS,
+        MAX_TOTAL_RESULTS, batch=SEARCH_BATCH_MODE, is_seen=message_handler.is_item_processed
+    )
+    
+    selected = []
+    for query, (_, result) in zip(queries, results):
+        try:
+            if isinstance(result, Exception):
+                raise result
+            selected.append((query, *select_alerts(query, result, message_handler, deal_scorer, async_api.api.history)))
+        except Exception as e:
+            log.exception(f"✗ Error processing keyword '{query.keywords}': {e}")
+            selected.append((query, None, None))
+    
+    details = None
+    calls = 0
+    wanted = {query.key: alert_listings(alerts, message_handler) if enricher is not None and alerts else []
+              for query, alerts, _ in selected}
+    wanted_count = sum(len(listings) for listings in wanted.values())
+    if wanted_count:
+        listings = list(dict.fromkeys(listing for listings in wanted.values() for listing in listings))
+        details, calls = await asyncio.wrap_future(enricher.submit(listings))
+    
+    counts = []
+    for query, alerts, skipped in selected:
+        detail_calls = calls * len(wanted[query.key]) / wanted_count if wanted_count else 0
+        if alerts is None:
+            counts.append((query.key, None, detail_calls))
+            continue
+        try:
+            # Skipped listings still count as activity for the poll schedule
+            counts.append((query.key, send_alerts(query, alerts, message_handler, details) + skipped, detail_calls))
+        except Exception as e:
+            log.exception(f"✗ Error processing keyword '{query.keywords}': {e}")
+            counts.append((query.key, None, detail_calls))
+    return counts
+
+
+def run_worker(worker_id=None, announce=True, metrics_port=METRICS_PORT, traffic=None, clock=None,
+               subscriptions_file=SUBSCRIPTIONS_FILE):
+    """Main monitoring loop
+    
+    With SHARD_DB set this process is one worker of a shard ring and only
+    polls the searches the ring assigns to it. traffic is an optional
+    TrafficRecorder or TrafficReplay all HTTP requests go through, and
+    clock an optional ReplayClock used for scheduling and waits.
+    
+    SIGTERM or SIGINT stop the loop once the searches in flight are done;
+    the poll schedule, watermarks and processed items are checkpointed
+    and pending alerts drained before exiting.
+    """
+    shutdown = GracefulShutdown().install()
+    if clock:
+        sleep = lambda seconds: clock.sleep(seconds, shutdown.wait)
+    else:
+        sleep = shutdown.wait
+    
+    membership = None
+    if SHARD_DB:
+        membership = ShardMembership(
+            SqliteWorkerRegistry(SHARD_DB), worker_id,
+            interval=SHARD_HEARTBEAT_INTERVAL, dead_after=SHARD_DEAD_AFTER
+        )
+    
+    log.info("🚀 Starting eBay Listing Monitor")
+    if membership:
+        log.info(f"Shard worker {membership.worker_id} (ring in {SHARD_DB})")
+    log.info("=" * 50)
     
     # Initialize components
-    ebay_api = EbayAPI()
-    message_handler = MessageHandler()
-    
-    print(f"Keywords: {KEYWORDS}")
-    print(f"Category ID: {CATEGORY_ID}")
-    print(f"Excluded sellers: {EXCLUDED_SELLERS}")
-    print(f"Max total results: {MAX_TOTAL_RESULTS}")
-    print(f"Cycle delay: {DELAY} seconds")
-    print(f"Search delay: {SEARCH_DELAY} seconds")
-    print(f"API rate limit delay: {API_RATE_LIMIT_DELAY} seconds")
-    print("=" * 50)
+    # One transport, so eBay and Telegram share timeouts, retries and circuit breakers
+    transport = create_transport(max(MAX_CONCURRENT_SEARCHES, NOTIFY_WORKERS), traffic=traffic)
+    price_history = None
+    if PRICE_HISTORY_DB:
+        price_history = PriceHistory(
+            PRICE_HISTORY_DB, drop_percent=PRICE_DROP_PERCENT,
+            retention=PRICE_HISTORY_DAYS * 86400 if PRICE_HISTORY_DAYS else None
+        )
+    ebay_api = EbayAPI(
+        watermarks=create_watermark_store(WATERMARKS_FILE, WATERMARKS_DB), transport=transport, history=price_history
+    )
+    message_handler = MessageHandler(owner=membership.worker_id if membership else "", transport=transport)
+    
+    subscription_file = None
+    if subscriptions_file:
+        subscription_file = SubscriptionFile(subscriptions_file, CATEGORY_ID, EXCLUDED_SELLERS, EBAY_MARKETPLACES)
+        try:
+            subscriptions = subscription_file.load()
+        except (OSError, ValueError) as e:
+            log.error(f"✗ Could not load subscriptions from {subscriptions_file}: {e}")
+            sys.exit(1)
+        log.info(f"Subscriptions: {subscriptions_file} (reloaded on change)")
+    else:
+        subscriptions = [
+            Subscription(
+                keyword, CATEGORY_ID, FilterRule.from_dict(KEYWORD_FILTERS.get(keyword), EXCLUDED_SELLERS),
+                EBAY_MARKETPLACES
+            )
+            for keyword in KEYWORDS
+        ]
+    keywords = list(dict.fromkeys(subscription.keywords for subscription in subscriptions))
+    
+    log.info(f"Keywords: {keywords}")
+    log.info(f"Category ID: {describe_ids(CATEGORY_ID)}")
+    log.info(f"Marketplaces: {', '.join(EBAY_MARKETPLACES)}")
+    log.info(f"Excluded sellers: {EXCLUDED_SELLERS}")
+    log.info(f"Max total results: {MAX_TOTAL_RESULTS}")
+    log.info(f"Initial poll interval: {DELAY} seconds (adaptive {MIN_POLL_INTERVAL}-{MAX_POLL_INTERVAL}s)")
+    log.info(f"Daily API call budget: {DAILY_CALL_BUDGET}")
+    log.info(f"Search delay: {SEARCH_DELAY} seconds")
+    log.info(f"API rate limit delay: {API_RATE_LIMIT_DELAY} seconds")
+    if price_history:
+        log.info(f"Price history: {PRICE_HISTORY_DB} (re-alert on drops of {PRICE_DROP_PERCENT}% or more, "
+                 f"full-page sweep every {PRICE_SWEEP_INTERVAL}s)")
+    log.info("=" * 50)
     
     # Test API connection
     try:
-        print("Testing eBay API connection...")
+        log.info("Testing eBay API connection...")
         ebay_api.get_access_token()
-        print("✓ eBay API connection successful")
+        log.info("✓ eBay API connection successful")
+        # Renew the token ahead of expiry so searches never wait on OAuth
+        ebay_api.tokens.start()
     except Exception as e:
-        print(f"✗ Failed to connect to eBay API: {e}")
-        print("Please check your eBay API credentials in config.py")
+        log.error(f"✗ Failed to connect to eBay API: {e}")
+        log.error("Please check your eBay API credentials in config.py")
         sys.exit(1)
     
-    print("\nStarting monitoring loop...")
-    print("Press Ctrl+C to stop")
-    print("-" * 50)
+    log.info("\nStarting monitoring loop...")
+    log.info("Press Ctrl+C or send SIGTERM to stop")
+    log.info("-" * 50)
     
     # Send test message to confirm Telegram is working
-    if message_handler.telegram_enabled:
-        test_message = "🤖 eBay Monitor Started!\n\nSearching for: " + ", ".join(KEYWORDS) + "\nCategory: " + CATEGORY_ID + "\nExcluded sellers: " + ", ".join(EXCLUDED_SELLERS)
-        print("📤 Sending test message to Telegram...")
+    if announce and message_handler.telegram_enabled:
+        test_message = "🤖 eBay Monitor Started!\n\nSearching for: " + ", ".join(keywords) + "\nCategory: " + describe_ids(CATEGORY_ID) + "\nMarketplaces: " + ", ".join(EBAY_MARKETPLACES) + "\nExcluded sellers: " + ", ".join(EXCLUDED_SELLERS)
+        log.info("📤 Sending test message to Telegram...")
         if message_handler.send_telegram_message(test_message):
-            print("✓ Test message sent successfully!")
+            log.info("✓ Test message sent successfully!")
         else:
-            print("✗ Failed to send test message")
-        print("-" * 50)
+            log.error("✗ Failed to send test message")
+        log.info("-" * 50)
+    
+    message_handler.start_notifier()
+    
+    health = HealthStatus(HEALTH_STALL_TIMEOUT, membership.worker_id if membership else None)
+    metrics_server = None
+    if metrics_port is not None:
+        metrics_server = MetricsServer(METRICS_HOST, metrics_port)
+        for path, handler in health.routes().items():
+            metrics_server.add_route(path, handler)
+        metrics_server.start()
+        log.info(f"📊 Metrics at http://{METRICS_HOST}:{metrics_server.port}/metrics, "
+                 f"health at /healthz and /readyz")
+    
+    async_api = None
+    loop = None
+    if SEARCH_MODE == "async":
+        async_api = AsyncEbayAPI(ebay_api)
+        loop = asyncio.new_event_loop()
+        log.info(f"Async search mode: up to {MAX_CONCURRENT_SEARCHES} concurrent searches, {SEARCH_RATE_LIMIT} requests/second")
+    
+    deal_scorer = DealScorer(DEAL_WINDOW, DEAL_MIN_SAMPLES) if DEAL_WINDOW else None
+    enricher = None
+    if ENRICH_ITEMS:
+        enricher = ItemEnricher(ebay_api, ENRICH_CACHE_SIZE, ENRICH_CACHE_TTL, ENRICH_CONCURRENCY)
+        log.info(f"Listing details: fetched for new alerts, {ENRICH_CONCURRENCY} getItems calls at once, "
+                 f"cached for {ENRICH_CACHE_TTL}s")
+    
+    scheduler = PollScheduler(
+        DAILY_CALL_BUDGET, MIN_POLL_INTERVAL, MAX_POLL_INTERVAL, DELAY, alpha=POLL_RATE_ALPHA,
+        clock=clock.time if clock else time.time
+    )
+    planner = QueryPlanner(coalesce=COALESCE_QUERIES)
+    planned = {query.key: query for query in planner.plan(subscriptions)}
+    log.info(f"Planned {len(planned)} searches for {len(subscriptions)} subscriptions")
+    for query in planned.values():
+        describe_query(query)
+    
+    def assign_queries(keys):
+        """Schedule whichever of the given searches this worker owns, and set its share of the daily budget"""
+        for key in keys:
+            owned = key in planned and (membership is None or membership.owns(key))
+            if owned and key not in scheduler:
+                scheduler.add(key)
+            elif not owned and key in scheduler:
+                scheduler.remove(key)
+        scheduler.daily_budget = int(DAILY_CALL_BUDGET * len(scheduler) / max(1, len(planned)))
+        health.track(subscription for key in scheduler.queries for subscription in planned[key].subscriptions)
+        if membership:
+            log.info(f"Shard ring has {len(membership.ring)} worker(s), polling {len(scheduler)}/{len(planned)} searches")
+    
+    def reload_subscriptions(subscriptions):
+        """Apply an edited subscription file, touching only the searches that changed
+        
+        Unchanged searches keep their PlannedQuery, schedule state and
+        watermark; new ones are due at once.
+        """
+        new_planned = {query.key: query for query in planner.plan(subscriptions)}
+        removed = planned.keys() - new_planned.keys()
+        added = new_planned.keys() - planned.keys()
+        changed = [
+            key for key in new_planned.keys() & planned.keys()
+            if new_planned[key].subscriptions != planned[key].subscriptions
+            or new_planned[key].api_rule != planned[key].api_rule
+        ]
+        for key in removed:
+            log.info(f"   - '{planned.pop(key).keywords}' removed")
+        for key in added:
+            planned[key] = new_planned[key]
+            log.info(f"   + '{planned[key].keywords}' added")
+        for key in changed:
+            planned[key] = new_planned[key]
+            log.info(f"   ~ '{planned[key].keywords}' updated")
+            describe_query(planned[key])
+        assign_queries(removed | added)
+        if deal_scorer:
+            deal_scorer.retain(subscription.key for query in planned.values() for subscription in query.subscriptions)
+        log.info(f"🔄 Reloaded {subscriptions_file}: {len(added)} added, {len(removed)} removed, "
+                 f"{len(changed)} updated, {len(planned)} searches planned")
+    
+    if membership:
+        membership.start()
+        membership.refresh()
+        message_handler.adopt_orphans(membership.ring.workers)
+    assign_queries(planned)
+    last_report = time.time()
+    
+    checkpoint = None
+    if STATE_FILE:
+        root, extension = os.path.splitext(STATE_FILE)
+        # Workers sharing a directory keep one schedule each
+        checkpoint = StateCheckpoint(f"{root}-{membership.worker_id}{extension}" if membership else STATE_FILE)
+        saved = checkpoint.load()
+        if saved:
+            restored = scheduler.restore_state(saved)
+            log.info(f"♻️  Resumed the poll schedule of {restored}/{len(scheduler)} searches from {checkpoint.path}")
+    
+    def save_checkpoint():
+        """Persist watermarks, processed items and the poll schedule"""
+        try:
+            ebay_api.watermarks.save()
+            message_handler.checkpoint()
+            if checkpoint:
+                checkpoint.save(scheduler.export_state())
+        except OSError as e:
+            log.error(f"✗ Could not write checkpoint: {e}")
+    
+    last_checkpoint = time.time()
+    health.set_state("running")
     
     try:
-        while True:
-            for keyword in KEYWORDS:
-                print(f"\n🔍 Searching for: {keyword}")
-                
-                try:
-                    # Search for listings
-                    item_data = ebay_api.search_listings(
-                        keyword, 
-                        EXCLUDED_SELLERS, 
-                        CATEGORY_ID, 
-                        MAX_TOTAL_RESULTS
-                    )
-                    
-                    if item_data:
-                        # Parse the item
-                        item = parse_ebay_item(item_data)
-                        item_id = item['item_id']
-                        
-                        print(f"Found item: {item['title']}")
-                        print(f"Item ID: {item_id}")
-                        
-                        # Check if already processed
-                        if message_handler.is_item_processed(item_id):
-                            print(f"Item {item_id} already processed, skipping...")
-                            continue
-                        
-                        # Format and send message
-                        message = message_handler.format_message(item)
-                        print(f"Generated message:\n{message}")
-                        
-                        # Send to Telegram
-                        if message_handler.send_telegram_message(message):
-                            # Mark as processed
-                            message_handler.add_processed_item(item_id)
-                            print("✓ Message sent and item marked as processed")
-                        else:
-                            print("✗ Failed to send message")
-                    
-                    else:
-                        print(f"No valid items found for keyword: {keyword}")
-                
-                except Exception as e:
-                    print(f"✗ Error processing keyword '{keyword}': {e}")
-                    import traceback
-                    traceback.print_exc()
-                
-                # Delay between searches
-                if keyword != KEYWORDS[-1]:  # Don't delay after the last keyword
-                    print(f"Waiting {SEARCH_DELAY} seconds before next search...")
-                    time.sleep(SEARCH_DELAY)
+        while not shutdown.requested:
+            if traffic is not None and traffic.finished:
+                log.info("\n⏹  Recorded traffic used up, replay finished")
+                break
+            wait = scheduler.seconds_until_next()
+            if wait is None:
+                wait = DELAY  # Nothing to poll
+            if wait:
+                log.info(f"\nNext search due in {wait:.0f} seconds...")
+                if membership:
+                    # Wake up to notice workers joining or leaving
+                    wait = min(wait, membership.interval)
+                if subscription_file:
+                    wait = min(wait, SUBSCRIPTIONS_CHECK_INTERVAL)
+                health.beat(wait)
+                sleep(wait)
+                if shutdown.requested:
+                    break
+            
+            if membership and membership.refresh():
+                assign_queries(list(planned))
+                message_handler.adopt_orphans(membership.ring.workers)
+            
+            changed_subscriptions = subscription_file.poll() if subscription_file else None
+            if changed_subscriptions is not None:
+                reload_subscriptions(changed_subscriptions)
+            
+            due = [planned[key] for key in scheduler.pop_due()]
+            if not due:
+                continue
+            health.beat(0 if async_api else len(due) * SEARCH_DELAY)
+            if async_api:
+                results = loop.run_until_complete(
+                    run_async_polls(async_api, due, message_handler, deal_scorer, enricher)
+                )
+            else:
+                results = run_polls(ebay_api, due, message_handler, deal_scorer, sleep, shutdown, enricher)
             
-            # Complete cycle delay
-            print(f"\nCompleted search cycle. Waiting {DELAY} seconds before next cycle...")
-            print("-" * 50)
-            time.sleep(DELAY)
+            for key, new_count, detail_calls in results:
+                POLLS.inc(outcome="error" if new_count is None else "ok")
+                health.polled(planned[key].subscriptions, new_count)
+                if new_count is None:
+                    # Failed searches keep their interval rather than looking quiet, and
+                    # wait out an open circuit or a Retry-After instead of failing again at once
+                    blocked = ebay_api.transport.blocked_for(ebay_api.base_url)
+                    scheduler.reschedule(key, max(scheduler.queries[key].interval, blocked))
+                else:
+                    # getItems lookups come out of the same daily budget as the searches
+                    scheduler.record(key, new_count, calls=poll_calls(ebay_api, planned[key]) + detail_calls)
+            ebay_api.watermarks.save()
+            if price_history:
+                handle_price_drops(price_history, planned.values(), message_handler)
+            if time.time() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                save_checkpoint()
+                last_checkpoint = time.time()
             
+            if time.time() - last_report >= SCHEDULE_REPORT_INTERVAL:
+                log.info(scheduler.describe())
+                if deal_scorer:
+                    log.info(deal_scorer.describe())
+                if METRICS_DUMP_FILE:
+                    REGISTRY.dump_json(METRICS_DUMP_FILE)
+                log.info("-" * 50)
+                last_report = time.time()
+        
+        if shutdown.requested:
+            log.info(f"\n\n🛑 Monitoring stopped on {shutdown.reason}")
     except KeyboardInterrupt:
-        print("\n\n🛑 Monitoring stopped by user")
-        print("Goodbye!")
+        log.info("\n\n🛑 Monitoring stopped by user")
     except Exception as e:
-        print(f"\n✗ Unexpected error in main loop: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception(f"\n✗ Unexpected error in main loop: {e}")
+    finally:
+        health.set_state("draining")
+        if membership:
+            membership.stop()
+        ebay_api.tokens.stop()
+        save_checkpoint()
+        ebay_api.close()
+        if price_history:
+            price_history.close()
+        # Pending alerts are drained over the shared transport before it closes, the outbox keeps the rest
+        message_handler.close(SHUTDOWN_DRAIN_TIMEOUT)
+        if async_api:
+            async_api.close()
+            loop.close()
+        if enricher:
+            enricher.close()
+        transport.close()
+        if traffic is not None:
+            traffic.close()
+        if metrics_server:
+            metrics_server.stop()
+        if METRICS_DUMP_FILE:
+            REGISTRY.dump_json(METRICS_DUMP_FILE)
+        shutdown.restore()
+        log.info("Goodbye!")
+
+
+def run_coordinator(count):
+    """Run count local shard workers, restarting any that exit unexpectedly"""
+    log.info(f"🚀 Starting {count} shard workers (ring in {SHARD_DB})")
+    
+    def spawn(index):
+        metrics_port = METRICS_PORT + index if METRICS_PORT is not None else None
+        process = multiprocessing.Process(
+            target=run_worker, args=(default_worker_id(index), index == 0, metrics_port),
+            name=f"monitor-worker-{index}"
+        )
+        process.start()
+        return process
+    
+    shutdown = GracefulShutdown().install()
+    workers = [spawn(index) for index in range(count)]
+    try:
+        while not shutdown.wait(SHARD_HEARTBEAT_INTERVAL):
+            for index, process in enumerate(workers):
+                if not process.is_alive():
+                    log.error(f"✗ Worker {index} exited with code {process.exitcode}, restarting")
+                    workers[index] = spawn(index)
+        if shutdown.reason == "SIGTERM":
+            # Ctrl+C reaches every worker in the terminal's process group, a SIGTERM has to be passed on
+            for process in workers:
+                process.terminate()
+        log.info("\n\n🛑 Waiting for workers to stop...")
+    except KeyboardInterrupt:
+        # A second Ctrl+C reaches the workers too, and they stop at once
+        log.info("\n\n🛑 Stopping workers now...")
+    finally:
+        for process in workers:
+            process.join(timeout=SHUTDOWN_DRAIN_TIMEOUT + 30)
+            if process.is_alive():
+                process.terminate()
+        shutdown.restore()
+
+
+def run_profiled(target, profile_file=None, trace_memory=False):
+    """Run target() under cProfile and/or tracemalloc and report where time and memory went
+    
+    cProfile only sees the main thread, which is where sync mode parses,
+    deduplicates and formats.
+    """
+    profiler = cProfile.Profile() if profile_file else None
+    if trace_memory:
+        tracemalloc.start(10)
+    if profiler:
+        profiler.enable()
+    try:
+        return target()
+    finally:
+        if profiler:
+            profiler.disable()
+        if trace_memory:
+            # Taken before the profile report, whose own allocations would crowd the list
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+                tracemalloc.Filter(False, tracemalloc.__file__),
+            ))
+            tracemalloc.stop()
+            top = snapshot.statistics("lineno")[:15]
+            log.info("🧠 Largest allocation sites still held:\n" + "\n".join(f"   {stat}" for stat in top))
+        if profiler:
+            profiler.dump_stats(profile_file)
+            report = io.StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(25)
+            log.info(f"⏱  Profile written to {profile_file} (browse it with python -m pstats), top functions:\n"
+                     f"{report.getvalue()}")
+
+
+def main(argv=None):
+    """Run the monitor, as a single process or as shard workers"""
+    parser = argparse.ArgumentParser(description="Monitor eBay listings and send Telegram alerts")
+    parser.add_argument("--workers", type=int, default=SHARD_WORKERS,
+                        help="Local shard worker processes to run (needs SHARD_DB)")
+    parser.add_argument("--worker-id", help="Run one shard worker with this ID, e.g. one per host (needs SHARD_DB)")
+    parser.add_argument("--record", metavar="FILE",
+                        help="Write every eBay and Telegram request and response to a gzipped JSONL file")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="Answer eBay and Telegram requests from a recorded file instead of the network")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Replay speed: 1 keeps the recorded timing, 10 runs ten times faster, 0 as fast as possible")
+    parser.add_argument("--state-dir",
+                        help="Where a replay keeps its processed items, outbox and watermarks (default: a new temp dir)")
+    parser.add_argument("--profile", metavar="FILE", help="Profile the run with cProfile and save the stats to FILE")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Report the largest allocation sites with tracemalloc on exit")
+    args = parser.parse_args(argv)
+    
+    if (args.workers > 1 or args.worker_id) and not SHARD_DB:
+        parser.error("sharding needs SHARD_DB set in config.py")
+    if SHARD_DB and (SEEN_STORE_BACKEND != "sqlite" or not WATERMARKS_DB):
+        # Each worker would otherwise keep its own processed items and watermarks
+        parser.error('shard workers share state: set SEEN_STORE_BACKEND = "sqlite" and WATERMARKS_DB')
+    if args.record and args.replay:
+        parser.error("--record and --replay can't be combined")
+    if (args.record or args.replay or args.profile or args.trace_memory) and SHARD_DB:
+        parser.error("recording, replay and profiling run a single monitor process, unset SHARD_DB")
+    if args.workers > 1 and not args.worker_id:
+        run_coordinator(args.workers)
+        return
+    
+    traffic = None
+    clock = None
+    metrics_port = METRICS_PORT
+    subscriptions_file = SUBSCRIPTIONS_FILE
+    profile_file = os.path.abspath(args.profile) if args.profile else None
+    if args.record:
+        traffic = TrafficRecorder(args.record)
+    elif args.replay:
+        traffic = TrafficReplay(args.replay, args.speed)
+        clock = ReplayClock(args.speed)
+        # Replays start from empty state and never touch the live monitor's files or port
+        subscriptions_file = os.path.abspath(SUBSCRIPTIONS_FILE) if SUBSCRIPTIONS_FILE else None
+        state_dir = args.state_dir or tempfile.mkdtemp(prefix="ebay-replay-")
+        os.makedirs(state_dir, exist_ok=True)
+        os.chdir(state_dir)
+        metrics_port = None
+        log.info(f"Replay state in {state_dir} (only files configured with relative paths)")
+    
+    run_profiled(
+        lambda: run_worker(args.worker_id, metrics_port=metrics_port, traffic=traffic, clock=clock,
+                           subscriptions_file=subscriptions_file),
+        profile_file, args.trace_memory
+    )
 
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
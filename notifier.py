@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Telegram Notifier
+Delivers alerts from a bounded queue on background workers
+"""
+
+import heapq
+import itertools
+import random
+import threading
+import time
+from logs import get_logger
+from metrics import ALERTS_COALESCED
+from rate_limit import TokenBucket
+from transport import HostUnavailableError, Transport, create_session, retry_after_seconds
+
+log = get_logger(__name__)
+
+
+# Longest text Telegram accepts in one message, in UTF-16 code units
+MAX_MESSAGE_LENGTH = 4096
+
+
+def message_length(text):
+    """Length of a message as Telegram counts it"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def digest_header(group, count):
+    return f"📦 {count} new listings for {group}"
+
+
+def format_digest(group, messages):
+    """Combine several alerts of one query into a single message"""
+    return "\n\n".join([digest_header(group, len(messages))] + list(messages))
+
+
+class Delivery:
+    """An alert for one item and its per-chat delivery progress"""
+
+    __slots__ = ("item_id", "message", "group", "remaining", "succeeded", "failed")
+
+    def __init__(self, item_id, message, chat_ids, group=None):
+        self.item_id = item_id
+        self.message = message
+        # Alerts of the same group (subscription) may be coalesced into one digest per chat
+        self.group = group
+        self.remaining = set(chat_ids)
+        self.succeeded = []
+        self.failed = []
+
+
+class TelegramNotifier:
+    """Sends alerts to every chat without blocking the search loop
+
+    Each (item, chat) send is a task on a bounded queue drained by worker
+    threads sharing one keep-alive session. Sends are spaced to respect
+    Telegram's per-chat and global limits, a 429 pauses that chat for the
+    returned retry_after, and other failures are retried with jittered
+    exponential backoff. While the transport's circuit breaker holds
+    Telegram requests back, sends wait without using up retries.
+
+    With a digest_window, alerts submitted with a group are coalesced per
+    (chat, group): the first alert goes out at once and opens a window,
+    alerts arriving within it are held and sent together as one digest
+    when the window ends or digest_max_items are waiting. Each digest sent
+    reopens the window, so a burst of listings costs one message per
+    window instead of one per listing. Digests are split to stay within
+    Telegram's message size limit.
+    on_sent(item_id, chat_id) and on_failed(item_id,
+    chat_id) report each chat's outcome, and on_delivered(item_id, delivered)
+    is called once every chat has been tried; delivered is True if at least
+    one chat got the message.
+    """
+
+    def __init__(self, api_key, chat_ids, on_delivered=None, on_sent=None, on_failed=None,
+                 workers=2, queue_size=500, max_retries=5, chat_rate=1.0, global_rate=30.0,
+                 backoff_base=1.0, base_url="https://api.telegram.org", transport=None,
+                 digest_window=0.0, digest_max_items=10):
+        self.url = f"{base_url}/bot{api_key}/sendMessage"
+        self.chat_ids = [str(chat_id) for chat_id in chat_ids]
+        self.on_delivered = on_delivered
+        self.on_sent = on_sent
+        self.on_failed = on_failed
+        self.queue_size = queue_size
+        self.max_retries = max_retries
+        self.chat_interval = 1.0 / chat_rate
+        self.backoff_base = backoff_base
+        self.global_limiter = TokenBucket(global_rate)
+        self.digest_window = digest_window
+        self.digest_max_items = max(1, digest_max_items)
+        # A transport passed in is shared with other clients and closed by its owner
+        self._own_transport = transport is None
+        self.transport = transport or Transport(create_session(pool_size=workers))
+
+        self._tasks = []  # heap of (ready_at, seq, delivery, chat_id, attempt)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pending = {}  # item_id -> Delivery
+        self._chat_ready_at = {}
+        self._held = {}  # (chat_id, group) -> [(delivery, attempt)] waiting for a digest
+        self._windows = {}  # (chat_id, group) -> when its coalescing window ends
+        self._stopping = False
+        self._draining = False  # Held digests go out without waiting for their window
+        self._workers = [
+            threading.Thread(target=self._run, name=f"telegram-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def __len__(self):
+        """Number of items waiting for delivery"""
+        with self._cond:
+            return len(self._pending)
+
+    def is_pending(self, item_id):
+        """Check if an item is queued or being delivered"""
+        with self._cond:
+            return item_id in self._pending
+
+    def submit(self, item_id, message, chat_ids=None, timeout=None, group=None):
+        """Queue an alert for every chat (or just chat_ids), blocking while the queue is full
+
+        Alerts with the same group may be sent together in a digest. Returns
+        False if the item is already queued, or the queue stayed full for
+        longer than timeout seconds.
+        """
+        chat_ids = self.chat_ids if chat_ids is None else [str(chat_id) for chat_id in chat_ids]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            if item_id in self._pending:
+                return False
+            while len(self._pending) >= self.queue_size:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    log.error(f"✗ Notification queue full, dropping item {item_id}")
+                    return False
+                self._cond.wait(remaining)
+
+            delivery = Delivery(item_id, message, chat_ids, group)
+            self._pending[item_id] = delivery
+            now = time.monotonic()
+            for chat_id in chat_ids:
+                self._push(now, delivery, chat_id, 0)
+            self._cond.notify_all()
+        log.debug(f"📥 Queued item {item_id} for {len(chat_ids)} chat(s) ({len(self._pending)} pending)")
+        return True
+
+    def _push(self, ready_at, delivery, chat_id, attempt):
+        heapq.heappush(self._tasks, (ready_at, next(self._seq), delivery, chat_id, attempt))
+
+    def _hold(self, now, delivery, chat_id, attempt):
+        """Hold an alert back for a digest if its chat and group are inside a window"""
+        if not self.digest_window or delivery.group is None:
+            return False
+        key = (chat_id, delivery.group)
+        if key not in self._held and self._windows.get(key, 0) <= now:
+            return False
+        self._held.setdefault(key, []).append((delivery, attempt))
+        return True
+
+    def _flush_at(self, key, held):
+        """When the alerts held for a (chat, group) may be sent"""
+        chat_ready = self._chat_ready_at.get(key[0], 0)
+        if self._draining or len(held) >= self.digest_max_items:
+            return chat_ready
+        return max(self._windows.get(key, 0), chat_ready)
+
+    def _take_digest(self, now):
+        """Remove and return the next (batch, chat_id) of held alerts that is due"""
+        for key, held in self._held.items():
+            if self._flush_at(key, held) > now:
+                continue
+            chat_id, group = key
+            room = MAX_MESSAGE_LENGTH - message_length(digest_header(group, self.digest_max_items))
+            batch = []
+            for entry in held[:self.digest_max_items]:
+                size = message_length(entry[0].message) + 2
+                if batch and size > room:
+                    break
+                room -= size
+                batch.append(entry)
+            # Anything left over goes out in the next digest as soon as the chat allows
+            del held[:len(batch)]
+            if not held:
+                del self._held[key]
+            self._windows[key] = now + self.digest_window
+            self._chat_ready_at[chat_id] = now + self.chat_interval
+            return batch, chat_id
+        return None
+
+    def _next_task(self):
+        """Wait for the next batch of alerts whose chat is free to receive
+
+        Returns ([(delivery, attempt), ...], chat_id), a single alert unless
+        alerts were coalesced into a digest.
+        """
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                digest = self._take_digest(now) if self._held else None
+                if digest:
+                    return digest
+                if self._stopping and not self._tasks and not self._held:
+                    return None
+                if self._tasks and self._tasks[0][0] <= now:
+                    ready_at, _, delivery, chat_id, attempt = heapq.heappop(self._tasks)
+                    if self._hold(now, delivery, chat_id, attempt):
+                        continue
+                    chat_ready = self._chat_ready_at.get(chat_id, 0)
+                    if chat_ready > now:
+                        # Chat is still rate limited, try again once it frees up
+                        self._push(chat_ready, delivery, chat_id, attempt)
+                        continue
+                    self._chat_ready_at[chat_id] = now + self.chat_interval
+                    if self.digest_window and delivery.group is not None:
+                        # First alert in a while goes out alone and starts coalescing what follows
+                        self._windows[(chat_id, delivery.group)] = now + self.digest_window
+                    return [(delivery, attempt)], chat_id
+                wake_times = [self._flush_at(key, held) for key, held in self._held.items()]
+                if self._tasks:
+                    wake_times.append(self._tasks[0][0])
+                timeout = max(0.0, min(wake_times) - now) if wake_times else None
+                self._cond.wait(timeout)
+
+    def _run(self):
+        """Worker loop"""
+        while True:
+            task = self._next_task()
+            if task is None:
+                return
+            batch, chat_id = task
+            if len(batch) == 1:
+                message = batch[0][0].message
+            else:
+                message = format_digest(batch[0][0].group, [delivery.message for delivery, _ in batch])
+                ALERTS_COALESCED.inc(len(batch))
+                log.info(f"📦 Sending {len(batch)} alerts for '{batch[0][0].group}' to chat {chat_id} as one digest")
+            try:
+                ok, retry_after = self._send(chat_id, message)
+            except Exception as e:
+                log.error(f"✗ Failed to send message to chat {chat_id}: {e}")
+                ok, retry_after = False, None
+            for delivery, attempt in batch:
+                self._finish(delivery, chat_id, attempt, ok, retry_after)
+
+    def _notify(self, callback, *args):
+        """Run a result callback, reporting rather than raising its errors"""
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception as e:
+            log.error(f"✗ Delivery callback failed for item {args[0]}: {e}")
+
+    def _send(self, chat_id, text):
+        """Post one message, returns (ok, retry_after seconds on 429)"""
+        self.global_limiter.acquire()
+        try:
+            # Retries and 429s are handled per chat here rather than by the transport
+            response = self.transport.post(
+                self.url, endpoint="telegram_send", retries=0, throttle=False,
+                data={"chat_id": chat_id, "text": text}
+            )
+        except HostUnavailableError as e:
+            return False, max(1.0, e.retry_in)
+        if response.status_code == 429:
+            try:
+                retry_after = float(response.json()["parameters"]["retry_after"])
+            except (ValueError, TypeError, KeyError, AttributeError):
+                retry_after = retry_after_seconds(response)
+            if retry_after is None:
+                # No usable wait given: retry after the normal backoff
+                log.warning(f"⚠️  Telegram rate limited chat {chat_id}, backing off")
+                return False, None
+            log.warning(f"⚠️  Telegram rate limited chat {chat_id}, retrying in {retry_after:.0f}s")
+            return False, retry_after
+        response.raise_for_status()
+        return True, None
+
+    def _finish(self, delivery, chat_id, attempt, ok, retry_after):
+        """Record a send result, scheduling a retry or completing the delivery"""
+        gave_up = False
+        with self._cond:
+            now = time.monotonic()
+            if ok:
+                log.debug(f"✓ Message sent to chat {chat_id}")
+                delivery.succeeded.append(chat_id)
+                delivery.remaining.discard(chat_id)
+            elif retry_after is not None:
+                # Flood control is an instruction to wait, not a failed attempt
+                self._chat_ready_at[chat_id] = now + retry_after
+                self._push(now + retry_after, delivery, chat_id, attempt)
+            elif attempt < self.max_retries:
+                delay = self.backoff_base * (2 ** attempt) * random.uniform(0.5, 1.5)
+                self._push(now + delay, delivery, chat_id, attempt + 1)
+            else:
+                log.error(f"✗ Giving up on chat {chat_id} for item {delivery.item_id} after {attempt + 1} attempts")
+                delivery.failed.append(chat_id)
+                delivery.remaining.discard(chat_id)
+                gave_up = True
+
+            done = not delivery.remaining
+            self._cond.notify_all()
+
+        if ok:
+            self._notify(self.on_sent, delivery.item_id, chat_id)
+        elif gave_up:
+            self._notify(self.on_failed, delivery.item_id, chat_id)
+
+        if done:
+            delivered = bool(delivery.succeeded)
+            total = len(delivery.succeeded) + len(delivery.failed)
+            if delivered:
+                log.info(f"✓ Item {delivery.item_id} sent to {len(delivery.succeeded)}/{total} chat(s)")
+            else:
+                log.error(f"✗ Failed to send item {delivery.item_id} to any chats")
+            self._notify(self.on_delivered, delivery.item_id, delivered)
+            # Only leave the pending set once the item has been marked processed
+            with self._cond:
+                del self._pending[delivery.item_id]
+                self._cond.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """Block until every queued alert has been delivered or given up on"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stop(self, timeout=30):
+        """Drain pending alerts for up to timeout seconds, then stop the workers
+
+        Digests still inside their window are sent at once. Alerts still
+        undelivered at the timeout are not reported at all, so an outbox
+        keeps them for the next start.
+        """
+        if self._pending:
+            log.info(f"Waiting up to {timeout}s for {len(self._pending)} pending alert(s)...")
+        with self._cond:
+            self._draining = True
+            self._cond.notify_all()
+        self.wait_idle(timeout)
+        with self._cond:
+            self._stopping = True
+            self._tasks.clear()
+            self._held.clear()
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join(timeout=5)
+        if self._own_transport:
+            self.transport.close()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Alert Outbox
+Durable record of discovered items and their per-chat delivery state
+"""
+
+import sqlite3
+import threading
+import time
+
+
+class Outbox:
+    """SQLite outbox so alerts survive restarts without being sent twice
+
+    An item is written here, with one pending row per chat, before its
+    alert is queued. Each chat's row is marked sent as soon as Telegram
+    accepts the message, so a restart only replays chats that never got
+    it. Fully sent items are removed once they are in the processed store;
+    chats that exhausted their retries stay behind marked failed until
+    prune_failed() drops them.
+
+    Several workers may share one outbox. Each item is owned by the worker
+    that added it, and only its owner replays it; adding an item another
+    worker already added is refused, so it is alerted once.
+    """
+
+    def __init__(self, path, owner=""):
+        self.path = path
+        self.owner = owner
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS outbox_items (
+                item_id TEXT PRIMARY KEY,
+                message TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                owner TEXT NOT NULL DEFAULT '',
+                digest_group TEXT
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS outbox_deliveries (
+                item_id TEXT NOT NULL,
+                chat_id TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (item_id, chat_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_delivery_state ON outbox_deliveries(state, item_id);
+        """)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(outbox_items)")]
+        if "owner" not in columns:
+            # Outboxes created before workers could share them
+            self.conn.execute("ALTER TABLE outbox_items ADD COLUMN owner TEXT NOT NULL DEFAULT ''")
+        if "digest_group" not in columns:
+            # Outboxes created before alerts could be coalesced into digests
+            self.conn.execute("ALTER TABLE outbox_items ADD COLUMN digest_group TEXT")
+        self.conn.commit()
+
+    def __contains__(self, item_id):
+        with self._lock:
+            row = self.conn.execute("SELECT 1 FROM outbox_items WHERE item_id = ?", (item_id,)).fetchone()
+        return row is not None
+
+    def add(self, item_id, message, chat_ids, group=None):
+        """Record a discovered item, returns False if it is already in the outbox"""
+        now = time.time()
+        with self._lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO outbox_items (item_id, message, created_at, owner, digest_group) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (item_id, message, now, self.owner, group)
+            )
+            if cursor.rowcount != 1:
+                return False
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO outbox_deliveries VALUES (?, ?, 'pending', ?)",
+                [(item_id, str(chat_id), now) for chat_id in chat_ids]
+            )
+        return True
+
+    def _set_state(self, item_id, chat_id, state):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE outbox_deliveries SET state = ?, updated_at = ? WHERE item_id = ? AND chat_id = ?",
+                (state, time.time(), item_id, str(chat_id))
+            )
+
+    def mark_sent(self, item_id, chat_id):
+        """Record that a chat received the alert"""
+        self._set_state(item_id, chat_id, "sent")
+
+    def mark_failed(self, item_id, chat_id):
+        """Record that a chat could not be reached after all retries"""
+        self._set_state(item_id, chat_id, "failed")
+
+    def complete(self, item_id):
+        """Remove an item once it has been sent to every chat, returns True if removed"""
+        with self._lock, self.conn:
+            unsent = self.conn.execute(
+                "SELECT 1 FROM outbox_deliveries WHERE item_id = ? AND state != 'sent' LIMIT 1", (item_id,)
+            ).fetchone()
+            if unsent:
+                return False
+            self.conn.execute("DELETE FROM outbox_deliveries WHERE item_id = ?", (item_id,))
+            self.conn.execute("DELETE FROM outbox_items WHERE item_id = ?", (item_id,))
+        return True
+
+    def pending(self):
+        """Items with chats still waiting for their alert, oldest first
+
+        Returns (item_id, message, chat_ids, group) tuples from a single query.
+        """
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT i.item_id, i.message, i.digest_group, d.chat_id FROM outbox_deliveries d "
+                "JOIN outbox_items i ON i.item_id = d.item_id "
+                "WHERE d.state = 'pending' AND i.owner = ? ORDER BY i.created_at, i.item_id", (self.owner,)
+            ).fetchall()
+
+        grouped = {}
+        for item_id, message, group, chat_id in rows:
+            grouped.setdefault(item_id, (message, group, []))[2].append(chat_id)
+        return [(item_id, message, chat_ids, group) for item_id, (message, group, chat_ids) in grouped.items()]
+
+    def finished(self):
+        """Items delivered to at least one chat with none pending, left behind by a crash before cleanup"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT item_id FROM outbox_items i WHERE i.owner = ? AND EXISTS ("
+                "SELECT 1 FROM outbox_deliveries d WHERE d.item_id = i.item_id AND d.state = 'sent') "
+                "AND NOT EXISTS ("
+                "SELECT 1 FROM outbox_deliveries d WHERE d.item_id = i.item_id AND d.state = 'pending')",
+                (self.owner,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def claim_orphans(self, alive_owners):
+        """Take over items owned by workers not in alive_owners, returns how many were claimed"""
+        owners = set(alive_owners) | {self.owner}
+        placeholders = ", ".join("?" * len(owners))
+        with self._lock, self.conn:
+            cursor = self.conn.execute(
+                f"UPDATE outbox_items SET owner = ? WHERE owner NOT IN ({placeholders})",
+                (self.owner, *owners)
+            )
+        return cursor.rowcount
+
+    def prune_failed(self, max_age):
+        """Remove items with a chat that failed over max_age seconds ago and none pending, returns how many
+
+        An item no chat received was never marked processed, so a later
+        search may alert it again.
+        """
+        cutoff = time.time() - max_age
+        with self._lock, self.conn:
+            item_ids = [row[0] for row in self.conn.execute(
+                "SELECT DISTINCT item_id FROM outbox_deliveries d WHERE d.state = 'failed' AND d.updated_at < ? "
+                "AND NOT EXISTS (SELECT 1 FROM outbox_deliveries p WHERE p.item_id = d.item_id AND p.state = 'pending')",
+                (cutoff,)
+            )]
+            rows = [(item_id,) for item_id in item_ids]
+            self.conn.executemany("DELETE FROM outbox_deliveries WHERE item_id = ?", rows)
+            self.conn.executemany("DELETE FROM outbox_items WHERE item_id = ?", rows)
+        return len(item_ids)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Price History
+SQLite record of listing prices seen by every poll, with percentile queries and price-drop detection
+"""
+
+import itertools
+import queue
+import sqlite3
+import threading
+import time
+from logs import get_logger
+
+log = get_logger(__name__)
+
+# Most parameters in one SQLite statement on old builds
+MAX_SQL_PARAMS = 900
+
+INSERT_LISTING = (
+    "INSERT INTO listing_prices (item_id, marketplace, query, currency, first_price, last_price, low_price, "
+    "reference_price, first_seen, last_seen, skipped) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+def _price(value):
+    """A listing price as a float, None if missing or malformed"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def nearest_rank(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class PriceDrop:
+    """A listing whose price fell below the price it was last alerted at"""
+
+    __slots__ = ("query", "listing", "old_price", "new_price")
+
+    def __init__(self, query, listing, old_price, new_price):
+        self.query = query
+        self.listing = listing
+        self.old_price = old_price
+        self.new_price = new_price
+
+    @property
+    def percent(self):
+        return 100.0 * (self.old_price - self.new_price) / self.old_price
+
+    def __repr__(self):
+        return f"PriceDrop({self.listing.legacy_id!r}, {self.old_price} -> {self.new_price} {self.listing.currency})"
+
+
+class PriceHistory:
+    """Price observations of every listing a poll fetched, written in the background
+
+    record() only queues the listings; a writer thread stores each batch
+    with one executemany per table in a single transaction, so polls never
+    wait on the disk. Every observation is kept in price_observations for
+    retention seconds, and listing_prices holds the latest, lowest and
+    reference price of each (item, marketplace). The reference is the price
+    the listing was first seen (or last re-alerted) at; a fall of at least
+    drop_percent below it is queued as a PriceDrop for take_drops() and
+    becomes the new reference, so each further drop has to beat the last.
+    Listings marked by record_skipped() were never alerted, so their drops
+    are not reported.
+    """
+
+    def __init__(self, path, drop_percent=None, retention=None, queue_size=1000):
+        self.path = path
+        self.drop_percent = drop_percent
+        self.retention = retention
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS price_observations (
+                item_id TEXT NOT NULL,
+                marketplace TEXT NOT NULL,
+                query TEXT NOT NULL,
+                price REAL NOT NULL,
+                currency TEXT NOT NULL,
+                buying_options TEXT NOT NULL,
+                observed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_observations_item ON price_observations(item_id, observed_at);
+            CREATE INDEX IF NOT EXISTS idx_observations_query ON price_observations(query, observed_at);
+            CREATE TABLE IF NOT EXISTS listing_prices (
+                item_id TEXT NOT NULL,
+                marketplace TEXT NOT NULL,
+                query TEXT NOT NULL,
+                currency TEXT NOT NULL,
+                first_price REAL NOT NULL,
+                last_price REAL NOT NULL,
+                low_price REAL NOT NULL,
+                reference_price REAL NOT NULL,
+                first_seen REAL NOT NULL,
+                last_seen REAL NOT NULL,
+                skipped INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (item_id, marketplace)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_listing_prices_query ON listing_prices(query, currency, last_price);
+        """)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(listing_prices)")]
+        if "skipped" not in columns:
+            # Histories created before skipped listings were told apart from alerted ones
+            self.conn.execute("ALTER TABLE listing_prices ADD COLUMN skipped INTEGER NOT NULL DEFAULT 0")
+        self.conn.commit()
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._drops = []
+        self._last_prune = 0.0
+        self._writer = threading.Thread(target=self._run, name="price-history", daemon=True)
+        self._writer.start()
+
+    def record(self, query, listings, observed_at=None):
+        """Queue the listings one search fetched, never blocks
+
+        A batch is dropped with a warning if the writer has fallen too far behind.
+        """
+        return self._put(query, listings, observed_at, skipped=False)
+
+    def record_skipped(self, query, listings):
+        """Queue a mark on listings that were not alerted, so their price drops are never re-alerts"""
+        return self._put(query, listings, None, skipped=True)
+
+    def _put(self, query, listings, observed_at, skipped):
+        if not listings:
+            return True
+        try:
+            self._queue.put_nowait((query, list(listings), observed_at or time.time(), skipped))
+            return True
+        except queue.Full:
+            log.warning(f"⚠️  Price history writer is behind, dropped {len(listings)} observation(s) for '{query}'")
+            return False
+
+    def take_drops(self):
+        """Return and clear the price drops found since the last call"""
+        with self._lock:
+            drops, self._drops = self._drops, []
+        return drops
+
+    def _run(self):
+        """Writer loop, stores whatever has queued up in one transaction"""
+        while True:
+            batches = [self._queue.get()]
+            while True:
+                try:
+                    batches.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            observations = [batch for batch in batches if batch[0] is not None]
+            try:
+                if observations:
+                    self._write(observations)
+                if self.retention:
+                    self._prune()
+            except sqlite3.Error as e:
+                log.error(f"✗ Could not write price history: {e}")
+            if len(observations) < len(batches):
+                # close() queued the stop marker
+                return
+
+    def _write(self, batches):
+        rows = []
+        latest = {}
+        skips = []
+        for query, listings, observed_at, skipped in batches:
+            for listing in listings:
+                price = _price(listing.price)
+                item_id = listing.legacy_id or listing.item_id
+                if price is None or not item_id:
+                    continue
+                if skipped:
+                    skips.append((item_id, listing.marketplace, query, listing.currency, price, price, price, price,
+                                  observed_at, observed_at, 1))
+                    continue
+                rows.append((
+                    item_id, listing.marketplace, query, price, listing.currency,
+                    ",".join(listing.buying_options), observed_at
+                ))
+                # The same listing may be fetched by several searches, the last sighting wins
+                latest[(item_id, listing.marketplace)] = (query, listing, price, observed_at)
+        if not rows and not skips:
+            return
+
+        with self._lock, self.conn:
+            self.conn.executemany("INSERT INTO price_observations VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            known = self._references(list(latest))
+
+            drops = []
+            upserts = []
+            for key, (query, listing, price, observed_at) in latest.items():
+                reference = price
+                previous = known.get(key)
+                if previous is not None and previous[0] == listing.currency:
+                    reference = previous[1]
+                    if self.drop_percent and price <= reference * (1 - self.drop_percent / 100.0):
+                        if not previous[2]:
+                            drops.append(PriceDrop(query, listing, reference, price))
+                        reference = price
+                upserts.append((
+                    key[0], key[1], query, listing.currency, price, price, price, reference, observed_at, observed_at, 0
+                ))
+            self.conn.executemany(INSERT_LISTING + """
+                ON CONFLICT (item_id, marketplace) DO UPDATE SET
+                    query = excluded.query,
+                    first_price = CASE WHEN currency = excluded.currency THEN first_price ELSE excluded.first_price END,
+                    low_price = CASE WHEN currency = excluded.currency
+                        THEN MIN(low_price, excluded.low_price) ELSE excluded.low_price END,
+                    currency = excluded.currency,
+                    last_price = excluded.last_price,
+                    reference_price = excluded.reference_price,
+                    last_seen = excluded.last_seen
+            """, upserts)
+            # Normally already recorded by the search that found them, inserted in case that batch was dropped
+            self.conn.executemany(INSERT_LISTING + """
+                ON CONFLICT (item_id, marketplace) DO UPDATE SET skipped = 1
+            """, skips)
+            self._drops.extend(drops)
+
+    def _references(self, keys):
+        """(currency, reference price, skipped) of listings already recorded, keyed by (item_id, marketplace)"""
+        known = {}
+        item_ids = sorted({item_id for item_id, _ in keys})
+        for start in range(0, len(item_ids), MAX_SQL_PARAMS):
+            chunk = item_ids[start:start + MAX_SQL_PARAMS]
+            placeholders = ", ".join("?" * len(chunk))
+            for item_id, marketplace, currency, reference, skipped in self.conn.execute(
+                "SELECT item_id, marketplace, currency, reference_price, skipped FROM listing_prices "
+                f"WHERE item_id IN ({placeholders})", chunk
+            ):
+                known[(item_id, marketplace)] = (currency, reference, skipped)
+        return known
+
+    def _prune(self):
+        """Forget observations older than the retention period, at most hourly"""
+        now = time.time()
+        if now - self._last_prune < 3600:
+            return
+        self._last_prune = now
+        cutoff = now - self.retention
+        with self._lock, self.conn:
+            removed = self.conn.execute("DELETE FROM price_observations WHERE observed_at < ?", (cutoff,)).rowcount
+            self.conn.execute("DELETE FROM listing_prices WHERE last_seen < ?", (cutoff,))
+        if removed:
+            log.info(f"🧹 Pruned {removed} price observation(s) older than {self.retention / 86400:.0f} days")
+
+    def percentiles(self, fractions=(0.25, 0.5, 0.75), query=None, since=None):
+        """Price percentiles of each query's listings, per currency
+
+        Uses each listing's latest price, optionally only listings seen
+        since a timestamp. All queries (or the one given) are read in a
+        single index-ordered scan. Returns {(query, currency): (count,
+        [percentile per fraction])}.
+        """
+        sql = "SELECT query, currency, last_price FROM listing_prices"
+        clauses = []
+        params = []
+        if query is not None:
+            clauses.append("query = ?")
+            params.append(query)
+        if since is not None:
+            clauses.append("last_seen >= ?")
+            params.append(since)
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY query, currency, last_price"
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+
+        result = {}
+        for group, group_rows in itertools.groupby(rows, key=lambda row: (row[0], row[1])):
+            prices = [row[2] for row in group_rows]
+            result[group] = (len(prices), [nearest_rank(prices, fraction) for fraction in fractions])
+        return result
+
+    def close(self, timeout=10):
+        """Write what is still queued and close the database"""
+        self._queue.put((None, None, None, None))
+        self._writer.join(timeout)
+        with self._lock:
+            self.conn.close()
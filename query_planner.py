@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Query Planner
+Merges overlapping keyword subscriptions into fewer eBay searches
+"""
+
+import re
+from filters import FilterRule
+from marketplaces import DEFAULT_MARKETPLACE, validate_marketplace
+
+# eBay query operators that a local title match cannot reproduce
+_OPERATOR_CHARS = set('()",-*')
+
+
+def normalize_keywords(keywords):
+    """Lowercase and collapse whitespace so equivalent searches compare equal"""
+    return " ".join(keywords.lower().split())
+
+
+def _id_tuple(ids):
+    """A category or marketplace ID, or several, as a tuple without duplicates"""
+    if isinstance(ids, (str, int)):
+        ids = str(ids).split(",")
+    return tuple(dict.fromkeys(str(value).strip() for value in ids if str(value).strip()))
+
+
+class Subscription:
+    """A keyword search the user wants alerts for, optionally narrowed by a FilterRule
+
+    category_ids and marketplaces each take one ID or several; the search
+    runs in every category on every marketplace. Earlier marketplaces are
+    preferred when the same item is found on more than one.
+    """
+
+    __slots__ = ("keywords", "category_ids", "marketplaces", "filters")
+
+    def __init__(self, keywords, category_ids, filters=None, marketplaces=(DEFAULT_MARKETPLACE,)):
+        self.keywords = keywords
+        self.category_ids = _id_tuple(category_ids)
+        self.marketplaces = tuple(validate_marketplace(marketplace) for marketplace in _id_tuple(marketplaces))
+        self.filters = filters
+        if not self.category_ids or not self.marketplaces:
+            raise ValueError(f"Subscription '{keywords}' needs at least one category and marketplace")
+
+    @property
+    def key(self):
+        return (normalize_keywords(self.keywords), ",".join(self.category_ids), ",".join(self.marketplaces))
+
+    @property
+    def scope(self):
+        """The categories and marketplaces searched"""
+        return (self.category_ids, self.marketplaces)
+
+    def wants(self, item):
+        """Check an item against the subscription's filters"""
+        return self.filters is None or self.filters.matches(item)
+
+    def __eq__(self, other):
+        return isinstance(other, Subscription) and self.key == other.key and self.filters == other.filters
+
+    def __hash__(self):
+        return hash((self.key, self.filters))
+
+    def __repr__(self):
+        parts = [repr(self.keywords), repr(",".join(self.category_ids))]
+        if self.filters:
+            parts.append(repr(self.filters))
+        if self.marketplaces != (DEFAULT_MARKETPLACE,):
+            parts.append(f"marketplaces={self.marketplaces!r}")
+        return f"Subscription({', '.join(parts)})"
+
+
+class KeywordMatcher:
+    """Matches listing titles containing every word of a keyword search"""
+
+    __slots__ = ("patterns",)
+
+    def __init__(self, keywords):
+        self.patterns = [
+            re.compile(rf"(?<!\w){re.escape(word)}(?!\w)", re.IGNORECASE)
+            for word in normalize_keywords(keywords).split()
+        ]
+
+    def matches(self, title):
+        return all(pattern.search(title) for pattern in self.patterns)
+
+
+class PlannedQuery:
+    """One poll serving one or more subscriptions
+
+    A poll searches its keywords in each category on each marketplace.
+    """
+
+    __slots__ = ("keywords", "category_ids", "marketplaces", "routes", "api_rule")
+
+    def __init__(self, keywords, category_ids, marketplaces=(DEFAULT_MARKETPLACE,)):
+        self.keywords = keywords
+        self.category_ids = _id_tuple(category_ids)
+        self.marketplaces = _id_tuple(marketplaces)
+        # (subscription, matcher) pairs; a None matcher takes every title
+        self.routes = []
+        # Filter eBay applies before returning results, loose enough for every route
+        self.api_rule = None
+
+    @property
+    def key(self):
+        return (self.keywords, ",".join(self.category_ids), ",".join(self.marketplaces))
+
+    @property
+    def targets(self):
+        """(marketplace, category_id) pairs searched, preferred marketplaces first"""
+        return [(marketplace, category_id) for marketplace in self.marketplaces for category_id in self.category_ids]
+
+    def api_filter(self, currency=None):
+        """The Browse API filter= value for a marketplace with the given currency, or None"""
+        return self.api_rule.api_filter(currency) if self.api_rule is not None else None
+
+    @property
+    def subscriptions(self):
+        return [subscription for subscription, _ in self.routes]
+
+    @staticmethod
+    def _wanted(subscription, matcher, item):
+        return (matcher is None or matcher.matches(item.title)) and subscription.wants(item)
+
+    def route(self, items):
+        """Map each subscription to the items it should receive"""
+        return {
+            subscription: [item for item in items if self._wanted(subscription, matcher, item)]
+            for subscription, matcher in self.routes
+        }
+
+    def subscription_for(self, item):
+        """The first subscription that wants an item, None if none does"""
+        for subscription, matcher in self.routes:
+            if self._wanted(subscription, matcher, item):
+                return subscription
+        return None
+
+    def matching_items(self, items):
+        """Items wanted by at least one subscription, in their original order"""
+        if any(matcher is None and subscription.filters is None for subscription, matcher in self.routes):
+            return list(items)
+        return [
+            item for item in items
+            if any(self._wanted(subscription, matcher, item) for subscription, matcher in self.routes)
+        ]
+
+    def __repr__(self):
+        return f"PlannedQuery({self.keywords!r}, {self.key[1]!r}, {self.key[2]!r}, {len(self.routes)} subscriptions)"
+
+
+class QueryPlanner:
+    """Builds the set of searches needed to serve a list of subscriptions
+
+    Subscriptions with identical keywords, categories and marketplaces
+    always share one search. With coalesce=True a subscription whose words
+    are a superset of another subscription's with the same categories and
+    marketplaces is served by the broader search and picked out locally by
+    a title matcher. Searches using eBay query
+    operators (quotes, exclusions, OR groups, wildcards) are never merged.
+    Each search asks eBay to apply the loosest filter that still returns
+    every listing one of its subscriptions wants.
+    """
+
+    def __init__(self, coalesce=False):
+        self.coalesce = coalesce
+
+    @staticmethod
+    def _words(keywords):
+        normalized = normalize_keywords(keywords)
+        if _OPERATOR_CHARS & set(normalized):
+            return None
+        return frozenset(normalized.split())
+
+    def plan(self, subscriptions):
+        """Return the planned queries for the given subscriptions"""
+        unique = list(dict.fromkeys(subscriptions))
+
+        # The broadest plain search in each category that covers a subscription
+        parents = {}
+        if self.coalesce:
+            words = {subscription: self._words(subscription.keywords) for subscription in unique}
+            for subscription in unique:
+                own = words[subscription]
+                if not own:
+                    continue
+                candidates = [
+                    other for other in unique
+                    if other.scope == subscription.scope
+                    and words[other] and words[other] < own
+                ]
+                if candidates:
+                    parents[subscription] = min(candidates, key=lambda other: len(words[other]))
+
+        planned = {}
+        for subscription in unique:
+            parent = parents.get(subscription, subscription)
+            # Chains collapse onto the root because the broadest ancestor is chosen
+            query = planned.get(parent.key)
+            if query is None:
+                query = planned[parent.key] = PlannedQuery(
+                    normalize_keywords(parent.keywords), parent.category_ids, parent.marketplaces
+                )
+            matcher = KeywordMatcher(subscription.keywords) if parent is not subscription else None
+            query.routes.append((subscription, matcher))
+
+        for query in planned.values():
+            query.api_rule = FilterRule.loosest([s.filters for s in query.subscriptions])
+        return list(planned.values())
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Rate Limiting
+Token bucket shared by threaded callers
+"""
+
+import threading
+import time
+
+
+class TokenBucket:
+    """Token bucket rate limiter allowing short bursts up to its capacity"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Take a token and return how long the caller must wait for it"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Tokens may go negative: each caller reserves its own slot in the queue
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        """Block until a token is available"""
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
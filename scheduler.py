@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Adaptive Poll Scheduler
+Polls busy queries more often and quiet ones less, within a daily call budget
+"""
+
+import heapq
+import itertools
+import time
+
+
+class QueryState:
+    """Polling statistics and schedule for one query"""
+
+    __slots__ = ("key", "rate", "calls_per_poll", "interval", "next_due",
+                 "polls", "total_new", "last_new", "last_polled")
+
+    def __init__(self, key, interval, next_due):
+        self.key = key
+        self.rate = None  # EWMA of new items per poll
+        self.calls_per_poll = 1.0  # EWMA of API calls per poll
+        self.interval = interval
+        self.next_due = next_due
+        self.polls = 0
+        self.total_new = 0
+        self.last_new = 0
+        self.last_polled = None
+
+
+class PollScheduler:
+    """Priority-queue scheduler that shares a daily API call budget by arrival rate
+
+    Each query's share of the budget is proportional to an EWMA of the new
+    items it returned per poll (plus a floor so quiet queries are still
+    checked), divided by how many API calls a poll of it costs. Intervals
+    are clamped to [min_interval, max_interval]. clock returns the current
+    time in seconds, a replay can pass a faster one.
+    """
+
+    def __init__(self, daily_budget, min_interval, max_interval, initial_interval,
+                 alpha=0.3, rate_floor=0.05, clock=time.time):
+        self.daily_budget = daily_budget
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.initial_interval = initial_interval
+        self.alpha = alpha
+        self.rate_floor = rate_floor
+        self.clock = clock
+        self.queries = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._day_start = clock()
+        self.calls_today = 0
+
+    def __len__(self):
+        return len(self.queries)
+
+    def __contains__(self, key):
+        return key in self.queries
+
+    def _weight(self, state):
+        rate = state.rate if state.rate is not None else 1.0
+        return rate + self.rate_floor
+
+    def _push(self, state):
+        heapq.heappush(self._heap, (state.next_due, next(self._seq), state.key))
+
+    def add(self, key, now=None):
+        """Start polling a query, due immediately"""
+        if key in self.queries:
+            return
+        state = QueryState(key, self.initial_interval, now if now is not None else self.clock())
+        self.queries[key] = state
+        self._push(state)
+
+    def remove(self, key):
+        """Stop polling a query"""
+        # Its heap entry is dropped lazily when it surfaces
+        self.queries.pop(key, None)
+
+    def seconds_until_next(self, now=None):
+        """Seconds until the next query is due, or None if nothing is scheduled"""
+        now = now if now is not None else self.clock()
+        while self._heap:
+            next_due, _, key = self._heap[0]
+            state = self.queries.get(key)
+            if state is None or state.next_due != next_due:
+                heapq.heappop(self._heap)
+                continue
+            return max(0.0, next_due - now)
+        return None
+
+    def pop_due(self, now=None):
+        """Remove and return the keys of every query that is due"""
+        now = now if now is not None else self.clock()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            next_due, _, key = heapq.heappop(self._heap)
+            state = self.queries.get(key)
+            if state is not None and state.next_due == next_due:
+                due.append(key)
+        return due
+
+    def _budget_interval(self, state):
+        """Interval that gives this query its share of the daily budget"""
+        total_weight = sum(self._weight(s) for s in self.queries.values())
+        calls_per_second = self.daily_budget / 86400.0
+        polls_per_second = calls_per_second * self._weight(state) / total_weight / state.calls_per_poll
+        return 1.0 / polls_per_second if polls_per_second > 0 else self.max_interval
+
+    def record(self, key, new_items, calls=1, now=None):
+        """Update a query's rate estimate after a poll and schedule its next one"""
+        state = self.queries.get(key)
+        if state is None:
+            return
+        now = now if now is not None else self.clock()
+
+        if now - self._day_start >= 86400:
+            self._day_start = now
+            self.calls_today = 0
+        self.calls_today += calls
+
+        if state.rate is None:
+            state.rate = float(new_items)
+        else:
+            state.rate = self.alpha * new_items + (1 - self.alpha) * state.rate
+        state.calls_per_poll = self.alpha * max(calls, 1) + (1 - self.alpha) * state.calls_per_poll
+        state.polls += 1
+        state.total_new += new_items
+        state.last_new = new_items
+        state.last_polled = now
+
+        state.interval = min(self.max_interval, max(self.min_interval, self._budget_interval(state)))
+        if self.calls_today >= self.daily_budget:
+            # Budget spent: fall back to the slowest schedule until the day rolls over
+            state.interval = self.max_interval
+        state.next_due = now + state.interval
+        self._push(state)
+
+    def reschedule(self, key, delay, now=None):
+        """Push a query's next poll back, e.g. after a failed search"""
+        state = self.queries.get(key)
+        if state is None:
+            return
+        state.next_due = (now if now is not None else self.clock()) + delay
+        self._push(state)
+
+    def export_state(self):
+        """Learned rates and due times of every query, as JSON-friendly data for a checkpoint"""
+        return {
+            "day_start": self._day_start,
+            "calls_today": self.calls_today,
+            "queries": [
+                {"key": list(state.key) if isinstance(state.key, tuple) else state.key,
+                 **{name: getattr(state, name) for name in QueryState.__slots__ if name != "key"}}
+                for state in self.queries.values()
+            ],
+        }
+
+    def restore_state(self, data, now=None):
+        """Resume the rates and due times saved by export_state for queries already added
+
+        Due times are capped at one current interval from now, so changed
+        interval limits take effect at once. Returns the number of queries
+        restored; the others stay due immediately.
+        """
+        now = now if now is not None else self.clock()
+        if now - data.get("day_start", 0) < 86400:
+            self._day_start = data["day_start"]
+            self.calls_today = data.get("calls_today", 0)
+        restored = 0
+        for saved in data.get("queries", ()):
+            key = tuple(saved["key"]) if isinstance(saved["key"], list) else saved["key"]
+            state = self.queries.get(key)
+            if state is None:
+                continue
+            for name in QueryState.__slots__:
+                if name not in ("key", "next_due") and name in saved:
+                    setattr(state, name, saved[name])
+            state.interval = min(self.max_interval, max(self.min_interval, state.interval))
+            # The previous heap entry no longer matches next_due and is dropped lazily
+            state.next_due = min(saved.get("next_due", now), now + state.interval)
+            self._push(state)
+            restored += 1
+        return restored
+
+    def snapshot(self, now=None):
+        """Current schedule as a list of dicts, soonest first"""
+        now = now if now is not None else self.clock()
+        rows = []
+        for state in sorted(self.queries.values(), key=lambda s: s.next_due):
+            rows.append({
+                "query": state.key,
+                "rate": round(state.rate, 3) if state.rate is not None else None,
+                "calls_per_poll": round(state.calls_per_poll, 2),
+                "interval": round(state.interval, 1),
+                "due_in": round(max(0.0, state.next_due - now), 1),
+                "polls": state.polls,
+                "total_new": state.total_new,
+                "last_new": state.last_new,
+            })
+        return rows
+
+    def projected_daily_calls(self):
+        """API calls per day if every query keeps its current interval"""
+        return sum(86400.0 / s.interval * s.calls_per_poll for s in self.queries.values())
+
+    def describe(self, now=None):
+        """Human-readable schedule table"""
+        lines = [
+            f"📅 Poll schedule: {len(self.queries)} queries, "
+            f"{self.calls_today}/{self.daily_budget} calls used today, "
+            f"~{self.projected_daily_calls():.0f} calls/day projected"
+        ]
+        for row in self.snapshot(now):
+            lines.append(
+                f"   {row['query']}: every {row['interval']}s (due in {row['due_in']}s), "
+                f"rate {row['rate']}/poll, {row['polls']} polls, {row['total_new']} new"
+            )
+        return "\n".join(lines)
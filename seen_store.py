@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Seen-Item Store
+Tracks processed item IDs with an in-memory index and durable backends
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from logs import get_logger
+
+log = get_logger(__name__)
+
+
+class SeenStore:
+    """Base class for processed item stores"""
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        # Items may be recorded from notification worker threads
+        self._lock = threading.RLock()
+
+    def _cutoff(self, now=None):
+        """Oldest timestamp that is still considered fresh"""
+        if not self.ttl:
+            return None
+        return (now or time.time()) - self.ttl
+
+    def __contains__(self, item_id):
+        raise NotImplementedError
+
+    def __iter__(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def add(self, item_id):
+        """Record an item ID, returns True if it was not already present"""
+        raise NotImplementedError
+
+    def expire(self):
+        """Drop entries older than the TTL, returns how many were removed"""
+        return 0
+
+    def flush(self):
+        """Make pending writes durable"""
+
+    def close(self):
+        """Flush and release any open handles"""
+        self.flush()
+
+
+class FileSeenStore(SeenStore):
+    """Hash set loaded once at startup, persisted to an append-only log"""
+
+    COMPACT_MIN_LINES = 1000
+
+    def __init__(self, path, ttl=None, fsync_every=20, compact_ratio=2.0):
+        super().__init__(ttl)
+        self.path = path
+        self.fsync_every = max(1, fsync_every)
+        self.compact_ratio = compact_ratio
+        self._items = {}
+        self._log_lines = 0
+        self._pending = 0
+        self._last_expire = time.time()
+        self._log = None
+        self._load()
+
+    def _load(self):
+        """Read the log into memory and open it for appending"""
+        needs_newline = False
+        if os.path.exists(self.path):
+            legacy_time = os.path.getmtime(self.path)
+            with open(self.path) as f:
+                for line in f:
+                    needs_newline = not line.endswith("\n")
+                    self._log_lines += 1
+                    # Legacy items.txt lines hold only the ID
+                    parts = line.strip().split("\t")
+                    if not parts[0]:
+                        continue
+                    try:
+                        seen_at = float(parts[1]) if len(parts) > 1 else legacy_time
+                    except ValueError:
+                        seen_at = legacy_time
+                    self._items[parts[0]] = seen_at
+
+        self.expire()
+        self._log = open(self.path, "a")
+        if needs_newline:
+            self._log.write("\n")
+        self._maybe_compact()
+        log.info(f"✓ Loaded {len(self._items)} processed items from {self.path}")
+
+    def __contains__(self, item_id):
+        seen_at = self._items.get(item_id)
+        if seen_at is None:
+            return False
+        cutoff = self._cutoff()
+        return cutoff is None or seen_at >= cutoff
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, item_id):
+        """Record an item ID, returns True if it was not already present"""
+        with self._lock:
+            if item_id in self:
+                return False
+
+            now = time.time()
+            self._items[item_id] = now
+            self._log.write(f"{item_id}\t{now:.0f}\n")
+            # Hand every line to the OS so a crash loses nothing; fsync in batches
+            self._log.flush()
+            self._log_lines += 1
+            self._pending += 1
+            if self._pending >= self.fsync_every:
+                self.flush()
+
+            if self.ttl and now - self._last_expire > min(self.ttl, 3600):
+                self.expire()
+            self._maybe_compact()
+            return True
+
+    def expire(self):
+        """Drop entries older than the TTL, returns how many were removed"""
+        with self._lock:
+            self._last_expire = time.time()
+            cutoff = self._cutoff(self._last_expire)
+            if cutoff is None:
+                return 0
+            expired = [item_id for item_id, seen_at in self._items.items() if seen_at < cutoff]
+            for item_id in expired:
+                del self._items[item_id]
+            return len(expired)
+
+    def _maybe_compact(self):
+        """Rewrite the log once dead lines outweigh live entries"""
+        threshold = max(len(self._items) * self.compact_ratio, self.COMPACT_MIN_LINES)
+        if self._log_lines > threshold:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the log with only live entries"""
+        with self._lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                for item_id, seen_at in self._items.items():
+                    f.write(f"{item_id}\t{seen_at:.0f}\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+            if self._log:
+                self._log.close()
+            os.replace(tmp_path, self.path)
+            self._log = open(self.path, "a")
+            self._log_lines = len(self._items)
+            self._pending = 0
+
+    def flush(self):
+        """Make pending writes durable"""
+        with self._lock:
+            if self._log and self._pending:
+                self._log.flush()
+                os.fsync(self._log.fileno())
+                self._pending = 0
+
+    def close(self):
+        """Flush and release any open handles"""
+        with self._lock:
+            if self._log:
+                self.flush()
+                self._log.close()
+                self._log = None
+
+
+class SqliteSeenStore(SeenStore):
+    """SQLite-backed store keyed on an indexed item ID primary key"""
+
+    def __init__(self, path, ttl=None, import_from=None):
+        super().__init__(ttl)
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS seen_items ("
+            "item_id TEXT PRIMARY KEY, seen_at REAL NOT NULL) WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_seen_at ON seen_items(seen_at)")
+        self.conn.commit()
+
+        if import_from and len(self) == 0 and os.path.exists(import_from):
+            self._import_file(import_from)
+        self.expire()
+        log.info(f"✓ Opened processed items database {self.path} ({len(self)} items)")
+
+    def _import_file(self, path):
+        """Seed the database from a legacy items.txt file"""
+        legacy = FileSeenStore(path)
+        rows = [(item_id, seen_at) for item_id, seen_at in legacy._items.items()]
+        legacy.close()
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO seen_items VALUES (?, ?)", rows)
+        log.info(f"✓ Imported {len(rows)} processed items from {path}")
+
+    def __contains__(self, item_id):
+        cutoff = self._cutoff() or 0
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM seen_items WHERE item_id = ? AND seen_at >= ?", (item_id, cutoff)
+            ).fetchone()
+        return row is not None
+
+    def __iter__(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT item_id FROM seen_items").fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM seen_items").fetchone()[0]
+
+    def add(self, item_id):
+        """Record an item ID, returns True if it was not already present"""
+        now = time.time()
+        cutoff = self._cutoff(now) or 0
+        with self._lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO seen_items VALUES (?, ?) "
+                "ON CONFLICT(item_id) DO UPDATE SET seen_at = excluded.seen_at "
+                "WHERE seen_items.seen_at < ?",
+                (item_id, now, cutoff)
+            )
+        return cursor.rowcount == 1
+
+    def expire(self):
+        """Drop entries older than the TTL, returns how many were removed"""
+        cutoff = self._cutoff()
+        if cutoff is None:
+            return 0
+        with self._lock, self.conn:
+            cursor = self.conn.execute("DELETE FROM seen_items WHERE seen_at < ?", (cutoff,))
+        return cursor.rowcount
+
+    def close(self):
+        """Flush and release any open handles"""
+        self.conn.close()
+
+
+def create_seen_store(backend, items_file, db_file=None, ttl=None, fsync_every=20):
+    """Create the configured seen-item store"""
+    if backend == "sqlite":
+        return SqliteSeenStore(db_file or f"{items_file}.db", ttl=ttl, import_from=items_file)
+    if backend == "file":
+        return FileSeenStore(items_file, ttl=ttl, fsync_every=fsync_every)
+    raise ValueError(f"Unknown seen store backend: {backend}")
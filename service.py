@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Service Mode
+Signal-driven graceful shutdown, health reporting and poll schedule checkpoints for running the monitor as a daemon
+"""
+
+import json
+import os
+import signal
+import threading
+import time
+from datetime import datetime, timezone
+from logs import get_logger
+
+log = get_logger(__name__)
+
+
+class GracefulShutdown:
+    """Turns SIGTERM and SIGINT into a stop request the main loop can finish up on
+
+    The first signal only sets a flag and wakes wait(), so the searches in
+    flight complete and pending alerts are drained. A second signal raises
+    KeyboardInterrupt to stop at once. Handlers can only be installed from
+    the main thread; elsewhere install() does nothing.
+    """
+
+    def __init__(self, signals=(signal.SIGTERM, signal.SIGINT)):
+        self.signals = signals
+        self.reason = None
+        self._event = threading.Event()
+        self._previous = {}
+
+    def install(self):
+        if threading.current_thread() is not threading.main_thread():
+            return self
+        for signum in self.signals:
+            self._previous[signum] = signal.signal(signum, self._handle)
+        return self
+
+    def restore(self):
+        for signum, handler in self._previous.items():
+            signal.signal(signum, handler)
+        self._previous.clear()
+
+    def _handle(self, signum, frame):
+        if self._event.is_set():
+            raise KeyboardInterrupt
+        self.request(signal.Signals(signum).name)
+
+    def request(self, reason="request"):
+        """Ask the monitor to stop after its current poll"""
+        if not self._event.is_set():
+            self.reason = reason
+            log.info(f"\n🛑 {reason} received, finishing in-flight searches and draining alerts "
+                     f"(repeat to stop at once)")
+        self._event.set()
+
+    @property
+    def requested(self):
+        return self._event.is_set()
+
+    def wait(self, seconds):
+        """Sleep up to seconds, returns True early if a stop was requested"""
+        return self._event.wait(max(0.0, seconds))
+
+
+def _timestamp(value):
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value, timezone.utc).isoformat(timespec="seconds")
+
+
+class HealthStatus:
+    """Liveness, readiness and the last successful poll of every subscription
+
+    The main loop calls beat(expected) before sleeping or polling, with how
+    long that should take. It counts as stalled, and /healthz fails, once
+    it is stall_timeout seconds past that. /readyz only passes while the
+    loop is running: not while starting up or draining for shutdown.
+    """
+
+    def __init__(self, stall_timeout=600, worker_id=None):
+        self.stall_timeout = stall_timeout
+        self.worker_id = worker_id
+        self.state = "starting"
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._deadline = None
+        self._subscriptions = {}
+
+    def beat(self, expected=0.0):
+        with self._lock:
+            self._deadline = time.time() + expected + self.stall_timeout
+
+    def set_state(self, state):
+        self.state = state
+        if state == "running":
+            self.beat()
+
+    def track(self, subscriptions):
+        """Report on exactly these subscriptions, keeping what is known of ones already tracked"""
+        with self._lock:
+            tracked = {}
+            for subscription in subscriptions:
+                tracked[subscription.key] = self._subscriptions.get(subscription.key) or {
+                    "keywords": subscription.keywords,
+                    "category_ids": list(subscription.category_ids),
+                    "marketplaces": list(subscription.marketplaces),
+                    "last_success": None, "last_failure": None, "new_items": 0,
+                }
+            self._subscriptions = tracked
+
+    def polled(self, subscriptions, new_items):
+        """Record a poll serving these subscriptions, new_items is None if it failed"""
+        now = time.time()
+        with self._lock:
+            for subscription in subscriptions:
+                entry = self._subscriptions.get(subscription.key)
+                if entry is None:
+                    continue
+                if new_items is None:
+                    entry["last_failure"] = now
+                else:
+                    entry["last_success"] = now
+                    entry["new_items"] += new_items
+
+    def alive(self):
+        return self._deadline is None or time.time() <= self._deadline
+
+    def ready(self):
+        return self.state == "running" and self.alive()
+
+    def report(self):
+        now = time.time()
+        with self._lock:
+            subscriptions = [
+                dict(entry,
+                     last_success=_timestamp(entry["last_success"]),
+                     last_failure=_timestamp(entry["last_failure"]),
+                     seconds_since_success=round(now - entry["last_success"], 1) if entry["last_success"] else None)
+                for entry in self._subscriptions.values()
+            ]
+        return {
+            "state": self.state if self.alive() else "stalled",
+            "worker": self.worker_id,
+            "uptime": round(now - self.started, 1),
+            "subscriptions": subscriptions,
+        }
+
+    def routes(self):
+        """/healthz and /readyz handlers for MetricsServer.add_route"""
+        def respond(ok):
+            return 200 if ok else 503, "application/json", json.dumps(self.report()) + "\n"
+        return {
+            "/healthz": lambda: respond(self.alive()),
+            "/readyz": lambda: respond(self.ready()),
+        }
+
+
+class StateCheckpoint:
+    """JSON file holding the poll schedule across restarts, replaced atomically on each save"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """The saved state, None if there is none or it is unreadable"""
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.warning(f"⚠️  Ignoring unreadable state checkpoint {self.path}: {e}")
+            return None
+
+    def save(self, state):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
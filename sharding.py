@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Query Sharding
+Spreads planned searches across monitor workers with a consistent hash ring
+"""
+
+import bisect
+import hashlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+from logs import get_logger
+
+log = get_logger(__name__)
+
+
+def _hash(value):
+    """Stable 64-bit hash, identical in every process and on every host"""
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+def shard_key(query_key):
+    """Ring key for a planned query's (keywords, category IDs, marketplaces) key"""
+    keywords, category_ids, marketplaces = query_key
+    return f"{marketplaces}|{category_ids}|{keywords}"
+
+
+class HashRing:
+    """Consistent hash ring mapping keys to workers
+
+    Each worker is placed on the ring at several virtual points so keys
+    spread evenly, and adding or removing a worker only moves the keys
+    next to its points.
+    """
+
+    def __init__(self, workers=(), replicas=64):
+        self.replicas = replicas
+        self.workers = sorted(set(workers))
+        self._points = sorted(
+            (_hash(f"{worker}#{i}"), worker) for worker in self.workers for i in range(replicas)
+        )
+        self._hashes = [point for point, _ in self._points]
+
+    def __len__(self):
+        return len(self.workers)
+
+    def worker_for(self, key):
+        """Worker owning a key, or None if the ring is empty"""
+        if not self._points:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._points)
+        return self._points[index][1]
+
+
+class WorkerRegistry:
+    """Base class for the shared record of live workers"""
+
+    def heartbeat(self, worker_id):
+        """Record that a worker is alive"""
+        raise NotImplementedError
+
+    def alive(self, dead_after):
+        """IDs of workers that sent a heartbeat in the last dead_after seconds"""
+        raise NotImplementedError
+
+    def leave(self, worker_id):
+        """Remove a worker that is shutting down"""
+        raise NotImplementedError
+
+    def close(self):
+        """Release any open handles"""
+
+
+class SqliteWorkerRegistry(WorkerRegistry):
+    """Worker heartbeats in a SQLite database shared by every worker
+
+    Works for processes on one host, or across hosts when the database is
+    on a filesystem with working locks.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS shard_workers ("
+            "worker_id TEXT PRIMARY KEY, heartbeat REAL NOT NULL, started_at REAL NOT NULL) WITHOUT ROWID"
+        )
+        self.conn.commit()
+
+    def heartbeat(self, worker_id):
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO shard_workers VALUES (?, ?, ?) "
+                "ON CONFLICT(worker_id) DO UPDATE SET heartbeat = excluded.heartbeat",
+                (worker_id, now, now)
+            )
+
+    def alive(self, dead_after):
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT worker_id FROM shard_workers WHERE heartbeat >= ? ORDER BY worker_id",
+                (time.time() - dead_after,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def leave(self, worker_id):
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM shard_workers WHERE worker_id = ?", (worker_id,))
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def default_worker_id(index=None):
+    """Worker ID unique to this host and process, or to a numbered local worker"""
+    if index is not None:
+        # Stable across restarts, so a restarted worker replays its own outbox items
+        return f"{socket.gethostname()}-{index}"
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class ShardMembership:
+    """One worker's view of the shard ring
+
+    A background thread sends a heartbeat every interval seconds. refresh()
+    rebuilds the ring from the workers whose heartbeat is recent, so when a
+    worker stops or dies its queries move to the survivors within
+    dead_after seconds (immediately when it leaves cleanly).
+    """
+
+    def __init__(self, registry, worker_id=None, interval=10, dead_after=30, replicas=64):
+        self.registry = registry
+        self.worker_id = worker_id or default_worker_id()
+        self.interval = interval
+        self.dead_after = dead_after
+        self.replicas = replicas
+        self.ring = HashRing([self.worker_id], replicas)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.registry.heartbeat(self.worker_id)
+            except sqlite3.Error as e:
+                log.error(f"✗ Shard heartbeat failed: {e}")
+
+    def start(self):
+        """Join the ring and start sending heartbeats"""
+        self.registry.heartbeat(self.worker_id)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="shard-heartbeat", daemon=True)
+            self._thread.start()
+        return self
+
+    def refresh(self):
+        """Rebuild the ring from live workers, returns True if membership changed"""
+        workers = set(self.registry.alive(self.dead_after))
+        # Never drop ourselves, even if our own heartbeat is late
+        workers.add(self.worker_id)
+        if sorted(workers) == self.ring.workers:
+            return False
+        self.ring = HashRing(workers, self.replicas)
+        return True
+
+    def owns(self, query_key):
+        """Check if this worker should poll a planned query"""
+        return self.ring.worker_for(shard_key(query_key)) == self.worker_id
+
+    def stop(self):
+        """Stop heartbeats and leave the ring so others take over at once"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        try:
+            self.registry.leave(self.worker_id)
+        except sqlite3.Error as e:
+            log.error(f"✗ Could not leave the shard ring: {e}")
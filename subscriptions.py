@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Subscription File
+Loads keyword subscriptions from a JSON, YAML or TOML file and notices when it changes
+"""
+
+import json
+import os
+import re
+from filters import FilterRule
+from marketplaces import DEFAULT_MARKETPLACE
+from query_planner import Subscription
+from logs import get_logger
+
+log = get_logger(__name__)
+
+ENTRY_OPTIONS = ("keywords", "category_id", "marketplaces", "filters")
+
+
+def _parse(path, text):
+    """Decode the file according to its extension"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".json":
+        return json.loads(text)
+    if extension in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("YAML subscription files need PyYAML (pip install pyyaml)") from None
+        try:
+            return yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            raise ValueError(str(e)) from None
+    if extension == ".toml":
+        try:
+            import tomllib
+        except ImportError:
+            raise ValueError("TOML subscription files need Python 3.11 or newer") from None
+        return tomllib.loads(text)
+    raise ValueError(f"Unknown subscription file type '{extension}', use .json, .yaml, .yml or .toml")
+
+
+class SubscriptionFile:
+    """A subscription file that can be re-read whenever it changes
+
+    The file holds either a list of entries, or a mapping with a
+    "subscriptions" list and an optional "excluded_sellers" list applied to
+    every entry. An entry is a keyword string or a mapping with keywords,
+    category_id and marketplaces (one ID or a list of them) and filters
+    (FilterRule options). Entries left unchanged
+    since the last load keep their Subscription, so a reload only compiles
+    the filters of new or edited entries.
+    """
+
+    def __init__(self, path, category_id, excluded_sellers=(), marketplaces=(DEFAULT_MARKETPLACE,)):
+        self.path = path
+        self.category_id = category_id
+        self.excluded_sellers = list(excluded_sellers)
+        self.marketplaces = marketplaces
+        self._signature = None
+        self._built = {}
+
+    def _stat(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def changed(self):
+        """Check whether the file was modified since the last load"""
+        try:
+            return self._stat() != self._signature
+        except OSError:
+            return False
+
+    def load(self):
+        """Read the file and return its subscriptions
+
+        Raises ValueError or OSError if the file is unreadable or invalid.
+        """
+        signature = self._stat()
+        with open(self.path, encoding="utf-8") as f:
+            data = _parse(self.path, f.read())
+
+        excluded_sellers = self.excluded_sellers
+        if isinstance(data, dict):
+            unknown = set(data) - {"subscriptions", "excluded_sellers"}
+            if unknown:
+                raise ValueError(f"Unknown subscription file key(s): {', '.join(sorted(unknown))}")
+            excluded_sellers = excluded_sellers + list(data.get("excluded_sellers") or ())
+            data = data.get("subscriptions") or []
+        if not isinstance(data, list):
+            raise ValueError("Subscription file must hold a list of subscriptions")
+
+        built = {}
+        subscriptions = []
+        for entry in data:
+            # Sellers are part of the key so editing the global list rebuilds every rule
+            key = json.dumps([entry, excluded_sellers], sort_keys=True, default=str)
+            subscription = built.get(key) or self._built.get(key) or self._build(entry, excluded_sellers)
+            built[key] = subscription
+            subscriptions.append(subscription)
+
+        self._built = built
+        self._signature = signature
+        return subscriptions
+
+    def _build(self, entry, excluded_sellers):
+        if isinstance(entry, str):
+            entry = {"keywords": entry}
+        if not isinstance(entry, dict) or not entry.get("keywords"):
+            raise ValueError(f"Subscription needs keywords: {entry!r}")
+        unknown = set(entry) - set(ENTRY_OPTIONS)
+        if unknown:
+            raise ValueError(f"Unknown subscription option(s) for '{entry['keywords']}': {', '.join(sorted(unknown))}")
+        try:
+            filters = FilterRule.from_dict(entry.get("filters"), excluded_sellers)
+        except (TypeError, ValueError, re.error) as e:
+            raise ValueError(f"Invalid filters for '{entry['keywords']}': {e}") from None
+        try:
+            return Subscription(
+                str(entry["keywords"]), entry.get("category_id") or self.category_id, filters,
+                entry.get("marketplaces") or self.marketplaces
+            )
+        except TypeError:
+            raise ValueError(f"Invalid category_id or marketplaces for '{entry['keywords']}'") from None
+
+    def poll(self):
+        """Return the new subscriptions if the file changed, otherwise None
+
+        An invalid file is logged and ignored, keeping the previous subscriptions.
+        """
+        if not self.changed():
+            return None
+        try:
+            return self.load()
+        except (OSError, ValueError) as e:
+            log.error(f"✗ Ignoring invalid subscription file {self.path}: {e}")
+            # Don't report the same broken version again
+            try:
+                self._signature = self._stat()
+            except OSError:
+                pass
+            return None
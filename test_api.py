@@ -51,9 +51,9 @@ def test_ebay_api():
             
             if item_data:
                 print("✓ Found item from API")
-                print(f"Item ID: {item_data.get('itemId', 'N/A')}")
-                print(f"Title: {item_data.get('title', 'N/A')}")
-                print(f"Seller: {item_data.get('seller', {}).get('username', 'N/A')}")
+                print(f"Item ID: {item_data.item_id or 'N/A'}")
+                print(f"Title: {item_data.title or 'N/A'}")
+                print(f"Seller: {item_data.seller or 'N/A'}")
                 
                 # Test parsing
                 print("\n3. Testing Item Parsing...")
@@ -23,9 +23,9 @@ def main():
         
         if result:
             print("✓ Found item!")
-            print(f"   Title: {result.get('title', 'N/A')}")
-            print(f"   Seller: {result.get('seller', {}).get('username', 'N/A')}")
-            print(f"   Price: {result.get('price', {}).get('value', 'N/A')}")
+            print(f"   Title: {result.title or 'N/A'}")
+            print(f"   Seller: {result.seller or 'N/A'}")
+            print(f"   Price: {result.price or 'N/A'}")
         else:
             print("✗ No items found")
             
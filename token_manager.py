@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+OAuth Token Manager
+Caches the eBay application token on disk and refreshes it before it expires
+"""
+
+import json
+import os
+import threading
+import time
+from logs import get_logger
+
+log = get_logger(__name__)
+
+
+class TokenManager:
+    """Shares one OAuth token between all searches, threads and restarts
+
+    fetch() must return the token endpoint's JSON (access_token and
+    expires_in). Tokens are written to cache_file with their expiry so a
+    restart reuses a still-valid token, and tokens written there by other
+    processes are picked up before fetching a new one. Concurrent callers
+    share a single refresh. Once start() is called a background thread
+    renews the token refresh_margin seconds before it expires, so searches
+    never wait for the OAuth round trip.
+    """
+
+    # A token this close to expiry is no longer handed out
+    EXPIRY_MARGIN = 60
+    RETRY_DELAY = 30
+
+    def __init__(self, fetch, cache_file=None, owner="", refresh_margin=600):
+        self.fetch = fetch
+        self.cache_file = cache_file
+        # Identifies the credentials, so a cached token for other credentials is ignored
+        self.owner = owner
+        self.refresh_margin = refresh_margin
+        self.token = None
+        self.issued_at = 0
+        self.expires_at = 0
+        self._rejected = None
+        self._cond = threading.Condition()
+        self._refreshing = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _valid(self, now=None):
+        now = now if now is not None else time.time()
+        return self.token is not None and now < self.expires_at - self.EXPIRY_MARGIN
+
+    def _refresh_due(self):
+        """When the background thread should renew the current token"""
+        # Short-lived tokens are renewed halfway through rather than immediately
+        return self.expires_at - min(self.refresh_margin, (self.expires_at - self.issued_at) / 2)
+
+    def get(self):
+        """Return a valid token, fetching one if needed"""
+        with self._cond:
+            if self._valid():
+                return self.token
+        return self.refresh(force=False)
+
+    def invalidate(self, token):
+        """Drop a token the API rejected, unless it has already been replaced"""
+        with self._cond:
+            # Also keeps the cache file from handing the same token back
+            self._rejected = token
+            if self.token == token:
+                self.token = None
+                self.expires_at = 0
+
+    def refresh(self, force=True):
+        """Fetch a new token, joining a refresh already in flight instead of starting another
+
+        With force=False a valid token (in memory or in the cache file) is
+        returned without fetching.
+        """
+        with self._cond:
+            if self._refreshing:
+                while self._refreshing:
+                    self._cond.wait()
+                # Share the result; if that refresh failed, try again ourselves
+                if self._valid():
+                    return self.token
+            elif not force and (self._valid() or self._load_cache()):
+                return self.token
+            self._refreshing = True
+
+        try:
+            data = self.fetch()
+            token = data["access_token"]
+            issued_at = time.time()
+            expires_at = issued_at + data.get("expires_in", 7200)
+        except Exception:
+            with self._cond:
+                self._refreshing = False
+                self._cond.notify_all()
+            raise
+
+        with self._cond:
+            self.token = token
+            self.issued_at = issued_at
+            self.expires_at = expires_at
+            self._refreshing = False
+            self._cond.notify_all()
+        self._save_cache()
+        return token
+
+    def _load_cache(self):
+        """Adopt an unexpired token from the cache file, returns True if one was found"""
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return False
+        try:
+            with open(self.cache_file) as f:
+                data = json.load(f)
+            token, expires_at = data["access_token"], float(data["expires_at"])
+            issued_at = float(data.get("issued_at", 0))
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            log.warning(f"⚠️  Ignoring unreadable token cache {self.cache_file}: {e}")
+            return False
+        if data.get("owner") != self.owner or token == self._rejected or expires_at <= self.expires_at:
+            return False
+
+        previous = self.token, self.issued_at, self.expires_at
+        self.token, self.issued_at, self.expires_at = token, issued_at, expires_at
+        if not self._valid():
+            self.token, self.issued_at, self.expires_at = previous
+            return False
+        log.info(f"✓ Using cached eBay access token (expires in {(expires_at - time.time()) / 60:.0f} min)")
+        return True
+
+    def _save_cache(self):
+        """Write the current token to the cache file, readable only by this user"""
+        if not self.cache_file:
+            return
+        with self._cond:
+            data = {
+                "access_token": self.token, "issued_at": self.issued_at,
+                "expires_at": self.expires_at, "owner": self.owner
+            }
+        tmp_path = f"{self.cache_file}.{os.getpid()}.tmp"
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.cache_file)
+        except OSError as e:
+            log.warning(f"⚠️  Could not write token cache {self.cache_file}: {e}")
+
+    def _run(self):
+        """Background loop renewing the token ahead of expiry"""
+        while not self._stop.is_set():
+            with self._cond:
+                due = self._refresh_due()
+            delay = due - time.time()
+            if delay > 0:
+                self._stop.wait(delay)
+                continue
+            try:
+                # Another process may already have renewed it
+                with self._cond:
+                    renewed = self._load_cache() and self._refresh_due() > time.time()
+                if not renewed:
+                    self.refresh()
+                    log.info("✓ Refreshed eBay access token in the background")
+            except Exception as e:
+                log.error(f"✗ Background token refresh failed, retrying in {self.RETRY_DELAY}s: {e}")
+                self._stop.wait(self.RETRY_DELAY)
+
+    def start(self):
+        """Start renewing the token in the background"""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="token-refresh", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the background refresh thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Traffic Capture and Replay
+Records eBay and Telegram HTTP exchanges to a gzipped JSONL log and serves them back offline
+"""
+
+import gzip
+import io
+import json
+import re
+import threading
+import time
+from collections import deque
+from urllib.parse import parse_qs, urlsplit
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from logs import get_logger
+
+log = get_logger(__name__)
+
+# Response headers the monitor reads
+KEPT_HEADERS = ("Content-Type", "Retry-After")
+MARKETPLACE_HEADER = "X-EBAY-C-MARKETPLACE-ID"
+OAUTH_PATH = "/identity/v1/oauth2/token"
+# Answer to token requests a recording has no exchange for: it was made with a cached token
+REPLAY_TOKEN = {
+    "status": 200,
+    "headers": {"Content-Type": "application/json"},
+    "response": json.dumps({"access_token": "replay-token", "expires_in": 7200,
+                            "token_type": "Application Access Token"}),
+}
+_BOT_TOKEN = re.compile(r"/bot[^/]+/")
+
+
+def redact_url(url):
+    """Drop the Telegram bot token from a URL"""
+    return _BOT_TOKEN.sub("/bot<token>/", url)
+
+
+def _body_text(body):
+    if body is None:
+        return None
+    return body.decode("utf-8", "replace") if isinstance(body, bytes) else str(body)
+
+
+def _redact_response(text):
+    """Replace an OAuth access token in a response body"""
+    if '"access_token"' not in text:
+        return text
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return text
+    data["access_token"] = "recorded-token"
+    return json.dumps(data)
+
+
+def _match_keys(method, url, marketplace):
+    """(exact, loose) keys used to find the recorded response to a request
+
+    Hosts are ignored so a recording can be replayed against any configured
+    endpoint. The loose key also ignores paging and filters, so a replay
+    still gets the right search's responses when the code under test asks
+    differently.
+    """
+    parts = urlsplit(redact_url(url))
+    query = parse_qs(parts.query)
+    loose = (method, parts.path, tuple(query.get("q", ())), tuple(query.get("category_ids", ())), marketplace)
+    return (method, f"{parts.path}?{parts.query}", marketplace), loose
+
+
+class TrafficRecorder:
+    """Appends one JSON line per HTTP exchange to a gzip file
+
+    Each line holds the offset from the start of the recording, the
+    request (method, URL, marketplace header, body), how long the exchange
+    took, and the response status, headers and body, or the error raised.
+    Bot tokens and OAuth access tokens are redacted.
+    """
+
+    finished = False
+
+    def __init__(self, path, flush_every=50):
+        self.path = path
+        self.flush_every = flush_every
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._unflushed = 0
+        self.count = 0
+
+    def adapter(self, pool_size=10):
+        """A transport adapter recording through this recorder"""
+        return RecordingAdapter(self, pool_connections=pool_size, pool_maxsize=pool_size)
+
+    def write(self, entry):
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self.count += 1
+            self._unflushed += 1
+            if self._unflushed >= self.flush_every:
+                self._file.flush()
+                self._unflushed = 0
+
+    def offset(self):
+        return time.monotonic() - self._start
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        log.info(f"💾 Recorded {self.count} HTTP exchange(s) to {self.path}")
+
+
+class RecordingAdapter(HTTPAdapter):
+    """HTTPAdapter that writes every exchange to a TrafficRecorder"""
+
+    def __init__(self, recorder, **kwargs):
+        super().__init__(**kwargs)
+        self.recorder = recorder
+
+    def send(self, request, **kwargs):
+        entry = {
+            "t": round(self.recorder.offset(), 4),
+            "method": request.method,
+            "url": redact_url(request.url),
+            "marketplace": request.headers.get(MARKETPLACE_HEADER),
+            "body": _body_text(request.body),
+        }
+        start = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+            # Reads a streamed body in full; iter_content then serves it from memory
+            content = response.content
+        except requests.exceptions.RequestException as e:
+            entry.update(elapsed=round(time.perf_counter() - start, 4), error=type(e).__name__, message=str(e))
+            self.recorder.write(entry)
+            raise
+        entry.update(
+            elapsed=round(time.perf_counter() - start, 4),
+            status=response.status_code,
+            headers={name: response.headers[name] for name in KEPT_HEADERS if name in response.headers},
+            response=_redact_response(content.decode("utf-8", "replace")),
+        )
+        self.recorder.write(entry)
+        return response
+
+
+class TrafficReplay:
+    """Serves recorded responses in place of the network
+
+    Requests are answered with the next unused recording of the same URL,
+    or failing that of the same search (keywords, category, marketplace).
+    POSTs (OAuth, Telegram) that run out reuse their last response, so a
+    replay may send more alerts than the recording did. OAuth requests a
+    recording has no exchange for, because the token was cached while
+    recording, get a synthetic token. Responses are
+    delayed by their recorded time divided by speed; speed 0 answers at
+    once. The replay is finished once a search has no recording left.
+    """
+
+    def __init__(self, path, speed=1.0):
+        self.path = path
+        self.speed = speed
+        self.finished = False
+        self._lock = threading.Lock()
+        self._exact = {}
+        self._loose = {}
+        self._last = {}
+        self._remaining = 0
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                entry["used"] = False
+                exact, loose = _match_keys(entry["method"], entry["url"], entry.get("marketplace"))
+                self._exact.setdefault(exact, deque()).append(entry)
+                self._loose.setdefault(loose, deque()).append(entry)
+                self._remaining += 1
+        self.total = self._remaining
+        self._adapter = ReplayAdapter(self)
+        log.info(f"▶️  Replaying {self.total} HTTP exchange(s) from {path}"
+                 + (f" at {speed:g}x speed" if speed else " as fast as possible"))
+
+    def adapter(self, pool_size=10):
+        return self._adapter
+
+    @staticmethod
+    def _take(entries):
+        while entries:
+            entry = entries.popleft()
+            if not entry["used"]:
+                return entry
+        return None
+
+    def lookup(self, method, url, marketplace):
+        """The recorded exchange answering a request, None if there is none"""
+        exact, loose = _match_keys(method, url, marketplace)
+        with self._lock:
+            entry = self._take(self._exact.get(exact, deque())) or self._take(self._loose.get(loose, deque()))
+            if entry is not None:
+                entry["used"] = True
+                self._remaining -= 1
+                self._last[loose] = entry
+                return entry
+            if method != "GET" and loose in self._last:
+                return self._last[loose]
+            if method == "POST" and urlsplit(url).path.endswith(OAUTH_PATH):
+                return REPLAY_TOKEN
+            self.finished = True
+            return None
+
+    def close(self):
+        log.info(f"⏹  Replay used {self.total - self._remaining}/{self.total} recorded exchange(s)")
+
+
+class ReplayAdapter(BaseAdapter):
+    """Transport adapter answering from a TrafficReplay"""
+
+    def __init__(self, replay):
+        super().__init__()
+        self.replay = replay
+
+    def send(self, request, **kwargs):
+        entry = self.replay.lookup(request.method, request.url, request.headers.get(MARKETPLACE_HEADER))
+        if entry is None:
+            raise requests.exceptions.ConnectionError(
+                f"No recorded response for {request.method} {redact_url(request.url)}", request=request
+            )
+        if self.replay.speed and entry.get("elapsed"):
+            time.sleep(entry["elapsed"] / self.replay.speed)
+        if "error" in entry:
+            error = getattr(requests.exceptions, entry["error"], requests.exceptions.ConnectionError)
+            raise error(entry.get("message", ""), request=request)
+
+        content = entry["response"].encode("utf-8")
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.headers = CaseInsensitiveDict(entry.get("headers") or {})
+        response.raw = io.BytesIO(content)
+        response._content = content
+        response._content_consumed = True
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        response.reason = "Replayed"
+        return response
+
+    def close(self):
+        pass
+
+
+class ReplayClock:
+    """Virtual time for a replay, running speed times faster than the wall clock
+
+    At speed 0 time only moves on through sleeps, which return at once.
+    """
+
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self._start = time.time()
+        self._skipped = 0.0
+
+    def time(self):
+        elapsed = time.time() - self._start
+        if self.speed:
+            elapsed *= self.speed
+        return self._start + elapsed + self._skipped
+
+    def sleep(self, seconds, wait=None):
+        """Let seconds of virtual time pass, waiting with wait(real seconds) or time.sleep"""
+        if self.speed:
+            (wait or time.sleep)(seconds / self.speed)
+        else:
+            self._skipped += seconds
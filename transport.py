@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+HTTP Transport
+Pooled HTTP client with timeouts, retries, per-host circuit breakers and rate-limit throttling
+"""
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from logs import get_logger
+from metrics import track_request, CIRCUIT_STATE, HTTP_RETRIES
+
+log = get_logger(__name__)
+
+# Responses meaning the host (or a proxy in front of it) is failing rather than refusing the request
+FAILURE_STATUSES = frozenset({500, 502, 503, 504})
+
+
+def create_session(pool_size=10, adapter=None):
+    """Create a keep-alive HTTP session backed by a connection pool, or by the given adapter"""
+    session = requests.Session()
+    adapter = adapter or HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class HostUnavailableError(requests.exceptions.RequestException):
+    """A request was not sent because its host is failing or has asked us to back off"""
+
+    def __init__(self, host, retry_in, reason):
+        super().__init__(f"{host} {reason}, retry in {retry_in:.0f}s")
+        self.host = host
+        self.retry_in = retry_in
+
+
+def retry_after_seconds(response, default=None):
+    """Seconds to wait from a Retry-After header (delay or HTTP date), or default"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+class CircuitBreaker:
+    """Fails calls to a host fast once it keeps failing, then probes it for recovery
+
+    After failure_threshold consecutive failures the circuit opens for
+    about cooldown seconds. The first call after that is let through as a
+    probe (half-open): success closes the circuit at once, failure reopens
+    it with the cooldown doubled up to max_cooldown. A long outage is
+    probed less and less often, but service resumes on the first good probe.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, host, failure_threshold=5, cooldown=5.0, max_cooldown=300.0):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.open_until = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        self.state = state
+        CIRCUIT_STATE.set(state, host=self.host)
+
+    def retry_in(self):
+        """Seconds until a call would be let through"""
+        with self._lock:
+            if self.state == self.OPEN:
+                return max(0.0, self.open_until - time.monotonic())
+            return 0.0
+
+    def before_request(self):
+        """Admit a call, or raise HostUnavailableError while the circuit is open"""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == self.OPEN:
+                if now < self.open_until:
+                    raise HostUnavailableError(self.host, self.open_until - now, "circuit open")
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    # Only one probe at a time; the others wait for its verdict
+                    raise HostUnavailableError(self.host, 0, "is being probed")
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                log.info(f"✓ {self.host} is responding again, circuit closed")
+                self._set_state(self.CLOSED)
+            self.failures = 0
+            self.cooldown = self.base_cooldown
+            self._probing = False
+
+    def release(self):
+        """Give up a probe without a verdict, e.g. when the call was interrupted"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN:
+                self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+                self._open()
+            elif self.state == self.CLOSED and self.failures >= self.failure_threshold:
+                self._open()
+            self._probing = False
+
+    def _open(self):
+        # Jittered so processes sharing a host don't all probe at the same moment
+        delay = self.cooldown * random.uniform(0.8, 1.2)
+        self.open_until = time.monotonic() + delay
+        self._set_state(self.OPEN)
+        log.warning(f"⚠️  {self.host} is failing ({self.failures} errors in a row), pausing requests for {delay:.0f}s")
+
+
+class Throttle:
+    """Spaces out requests to a host after it answers 429 Too Many Requests
+
+    Retry-After is honoured exactly. A 429 without it doubles the spacing
+    between requests (up to max_spacing); each success then halves it, so
+    the request rate recovers over a few calls instead of jumping straight
+    back to the rate that was refused.
+    """
+
+    def __init__(self, max_spacing=60.0):
+        self.max_spacing = max_spacing
+        self.spacing = 0.0
+        self.ready_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait_time(self):
+        """Seconds until the next request may be sent"""
+        with self._lock:
+            return max(0.0, self.ready_at - time.monotonic())
+
+    def reserve(self, max_wait):
+        """Claim the next send slot, returns the seconds to wait for it or None if over max_wait"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self.ready_at)
+            if start - now > max_wait:
+                return None
+            self.ready_at = start + self.spacing
+            return start - now
+
+    def penalize(self, retry_after=None):
+        """Back off after a 429, returns the seconds until the next request"""
+        with self._lock:
+            now = time.monotonic()
+            self.spacing = min(self.max_spacing, max(1.0, self.spacing * 2))
+            delay = retry_after if retry_after is not None else self.spacing
+            self.ready_at = max(self.ready_at, now + delay)
+            return self.ready_at - now
+
+    def relax(self):
+        with self._lock:
+            self.spacing = self.spacing / 2 if self.spacing >= 0.1 else 0.0
+
+
+class Transport:
+    """HTTP client shared by the eBay API and the Telegram notifier
+
+    Every request gets a (connect, read) timeout and goes through the
+    circuit breaker and throttle of its host. Connection errors, timeouts
+    and 5xx responses are retried with jittered exponential backoff, and a
+    429 is retried once its Retry-After has passed if that is within
+    max_wait seconds. When retries run out the last response is returned
+    (or the last error raised) for the caller to handle. A request that
+    would have to wait longer than max_wait, or hit an open circuit, fails
+    at once with HostUnavailableError.
+    """
+
+    def __init__(self, session=None, timeout=(5, 30), max_retries=2, backoff_base=0.5, backoff_max=30.0,
+                 max_wait=60.0, failure_threshold=5, cooldown=5.0, max_cooldown=300.0):
+        self.session = session or create_session()
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_wait = max_wait
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, url):
+        """The (breaker, throttle) pair of a URL's host"""
+        host = urlsplit(url).netloc
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                breaker = CircuitBreaker(host, self.failure_threshold, self.cooldown, self.max_cooldown)
+                state = self._hosts[host] = (breaker, Throttle(self.max_wait))
+            return state
+
+    def blocked_for(self, url):
+        """Seconds before a request to this URL's host would be sent"""
+        breaker, throttle = self._host(url)
+        return max(breaker.retry_in(), throttle.wait_time())
+
+    def _backoff(self, attempt):
+        return min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def request(self, method, url, endpoint="http", retries=None, throttle=True, limiter=None, **kwargs):
+        """Send a request, returns the requests Response
+
+        endpoint labels the request metrics. With throttle=False a 429 is
+        returned to the caller without slowing other requests to the host,
+        for callers whose rate limits are narrower than the host (Telegram
+        limits each chat separately). limiter is an optional TokenBucket
+        taken from before every attempt, retries included.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        retries = self.max_retries if retries is None else retries
+        breaker, host_throttle = self._host(url)
+        host = breaker.host
+
+        attempt = 0
+        while True:
+            if limiter is not None:
+                limiter.acquire()
+            wait = host_throttle.reserve(self.max_wait)
+            if wait is None:
+                raise HostUnavailableError(host, host_throttle.wait_time(), "is rate limiting us")
+            if wait:
+                time.sleep(wait)
+            breaker.before_request()
+
+            response = None
+            error = None
+            retry_reason = None
+            with track_request(endpoint) as box:
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                except requests.exceptions.RequestException as e:
+                    breaker.record_failure()
+                    box["status"] = type(e).__name__
+                    error = e
+                    retry_reason = "error"
+                except BaseException:
+                    breaker.release()
+                    raise
+                else:
+                    status = response.status_code
+                    box["status"] = "ok" if status < 400 else str(status)
+                    if status in FAILURE_STATUSES:
+                        breaker.record_failure()
+                        retry_reason = str(status)
+                    else:
+                        breaker.record_success()
+                        if status == 429 and throttle:
+                            delay = host_throttle.penalize(retry_after_seconds(response))
+                            log.warning(f"⚠️  {host} rate limited {endpoint} requests, backing off {delay:.1f}s")
+                            if delay <= self.max_wait:
+                                retry_reason = "429"
+                        elif throttle:
+                            host_throttle.relax()
+
+            if retry_reason is None or attempt >= retries:
+                if error is not None:
+                    raise error
+                return response
+
+            HTTP_RETRIES.inc(endpoint=endpoint, reason=retry_reason)
+            if response is not None:
+                response.close()
+            if retry_reason != "429":
+                # The throttle already holds back a retry after a 429
+                time.sleep(self._backoff(attempt))
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Query Watermarks
+Persists the newest listing seen per search query for incremental polling
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from logs import get_logger
+
+log = get_logger(__name__)
+
+LEGACY_MARKETPLACE = "EBAY_GB"
+
+
+class Watermark:
+    """Newest listing date seen for a query and the item IDs listed at that moment"""
+
+    __slots__ = ("listing_date", "item_ids")
+
+    def __init__(self, listing_date, item_ids=()):
+        self.listing_date = listing_date
+        self.item_ids = set(item_ids)
+
+    def covers(self, item_id, listing_date):
+        """Check if an item was already returned by an earlier poll"""
+        if not listing_date:
+            return item_id in self.item_ids
+        if listing_date != self.listing_date:
+            return listing_date < self.listing_date
+        return item_id in self.item_ids
+
+    def to_dict(self):
+        return {"listing_date": self.listing_date, "item_ids": sorted(self.item_ids)}
+
+
+def _newest(items):
+    """(listing date, item IDs at that date) of the newest listings, None if undated"""
+    dated = [(item.listing_date, item.item_id) for item in items if item.listing_date]
+    if not dated:
+        return None
+    newest_date = max(listing_date for listing_date, _ in dated)
+    return newest_date, {item_id for listing_date, item_id in dated if listing_date == newest_date}
+
+
+def _merge(current, newest_date, newest_ids):
+    """Watermark advanced to the newest listings, or None if current already covers them"""
+    if current and current.listing_date > newest_date:
+        return None
+    if current and current.listing_date == newest_date:
+        if newest_ids <= current.item_ids:
+            return None
+        return Watermark(newest_date, current.item_ids | newest_ids)
+    return Watermark(newest_date, newest_ids)
+
+
+class WatermarkStore:
+    """Per-(keywords, category, marketplace) high-water marks saved to a JSON file"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._marks = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def _key(keywords, category_id, marketplace):
+        # Watermarks saved before other marketplaces could be searched are all for EBAY_GB
+        if marketplace == LEGACY_MARKETPLACE:
+            return f"{category_id}|{keywords}"
+        return f"{marketplace}|{category_id}|{keywords}"
+
+    def _load(self):
+        """Read saved watermarks, if any"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            for key, mark in data.items():
+                self._marks[key] = Watermark(mark["listing_date"], mark.get("item_ids", []))
+            log.info(f"✓ Loaded {len(self._marks)} query watermarks from {self.path}")
+        except (ValueError, KeyError, OSError) as e:
+            log.warning(f"⚠️  Could not read watermarks from {self.path}, starting fresh: {e}")
+
+    def get(self, keywords, category_id, marketplace=LEGACY_MARKETPLACE):
+        """Get the watermark for a search, or None if it has never been polled"""
+        with self._lock:
+            return self._marks.get(self._key(keywords, category_id, marketplace))
+
+    def advance(self, keywords, category_id, items, marketplace=LEGACY_MARKETPLACE):
+        """Move a search's watermark up to the newest of the given listings"""
+        newest = _newest(items)
+        if newest is None:
+            return
+        key = self._key(keywords, category_id, marketplace)
+
+        with self._lock:
+            advanced = _merge(self._marks.get(key), *newest)
+            if advanced is not None:
+                self._marks[key] = advanced
+                self._dirty = True
+
+    def save(self):
+        """Write watermarks to disk if they changed since the last save"""
+        with self._lock:
+            if not self.path or not self._dirty:
+                return
+            data = {key: mark.to_dict() for key, mark in self._marks.items()}
+            self._dirty = False
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        """Save any unsaved watermarks"""
+        self.save()
+
+
+class SqliteWatermarkStore:
+    """Watermarks in a SQLite database shared by several monitor workers
+
+    Reads always go to the database, so a worker taking over a query from
+    another continues from its watermark. Advances are merged inside a
+    write transaction and are durable at once; save() has nothing to do.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # Autocommit mode: advance() manages its own transactions
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS watermarks ("
+            "query_key TEXT PRIMARY KEY, listing_date TEXT NOT NULL, item_ids TEXT NOT NULL) WITHOUT ROWID"
+        )
+
+    _key = staticmethod(WatermarkStore._key)
+
+    def _read(self, key):
+        row = self.conn.execute(
+            "SELECT listing_date, item_ids FROM watermarks WHERE query_key = ?", (key,)
+        ).fetchone()
+        return Watermark(row[0], json.loads(row[1])) if row else None
+
+    def get(self, keywords, category_id, marketplace=LEGACY_MARKETPLACE):
+        """Get the watermark for a search, or None if it has never been polled"""
+        with self._lock:
+            return self._read(self._key(keywords, category_id, marketplace))
+
+    def advance(self, keywords, category_id, items, marketplace=LEGACY_MARKETPLACE):
+        """Move a search's watermark up to the newest of the given listings"""
+        newest = _newest(items)
+        if newest is None:
+            return
+        key = self._key(keywords, category_id, marketplace)
+
+        with self._lock:
+            # Take the write lock before reading so concurrent workers merge rather than overwrite
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                advanced = _merge(self._read(key), *newest)
+                if advanced is not None:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?)",
+                        (key, advanced.listing_date, json.dumps(sorted(advanced.item_ids)))
+                    )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def save(self):
+        """Advances are written immediately"""
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def create_watermark_store(path=None, db_path=None):
+    """Create the configured watermark store, SQLite when db_path is set"""
+    if db_path:
+        return SqliteWatermarkStore(db_path)
+    return WatermarkStore(path)